@@ -1,39 +1,101 @@
 import os
-import logging
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from replicas import RoutingSession, replica_binds
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
-
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "postgresql://localhost/foodbridge")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
-# Initialize the app with the extension
-db.init_app(app)
-
-with app.app_context():
-    # Import models to ensure tables are created
+def create_app(config=None):
+    """
+    Build the Flask app
+    Nothing here touches the database, so a cold start only pays for imports;
+    tables and migrations are applied by `flask migrate` (or AUTO_CREATE_SCHEMA=1)
+    """
+    # Create the app
+    app = Flask(__name__)
+    
+    # Queued JSON logging with request ids, levels per APP_ENV (see logs.py)
+    import logs
+    logs.init_app(app)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+    # Proxies in front of the app whose X-Forwarded-* headers are trusted; the client IP
+    # from X-Forwarded-For keys the per-IP rate limits (see ratelimit.py)
+    proxy_hops = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops, x_host=proxy_hops)
+    
+    # Configure the database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "postgresql://localhost/foodbridge")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = _engine_options("DATABASE")
+    
+    # Optional read replicas for read-only routes (see replicas.py), each with its own pool
+    replica_urls = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    app.config["SQLALCHEMY_BINDS"] = replica_binds(replica_urls, _engine_options("DATABASE_REPLICA"))
+    app.config["REPLICA_MAX_LAG_SECONDS"] = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5))
+    app.config["READ_YOUR_WRITES_SECONDS"] = float(os.environ.get("READ_YOUR_WRITES_SECONDS", 10))
+    
+    # How long a buyer's checkout holds a listing against other buyers (see reservations.py)
+    app.config["RESERVATION_HOLD_SECONDS"] = int(os.environ.get("RESERVATION_HOLD_SECONDS", 15 * 60))
+    
+    # Settled payments and sold listings older than this move to the archive tables (see archive.py)
+    app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", 90))
+    
+    # Webhook handling: "inline" applies events in the request, "queue" stores them for the worker
+    app.config["WEBHOOK_MODE"] = os.environ.get("WEBHOOK_MODE", "inline")
+    
+    # Server-Timing header with DB time and query count on every response; on by default only in development
+    server_timing = os.environ.get("SERVER_TIMING", "").lower()
+    app.config["SERVER_TIMING"] = (server_timing in ("1", "true", "yes") if server_timing
+                                   else app.config["APP_ENV"] == "development")
+    
+    # Create tables and run migrations at startup (handy locally; deployments run `flask migrate`)
+    app.config["AUTO_CREATE_SCHEMA"] = os.environ.get("AUTO_CREATE_SCHEMA", "").lower() in ("1", "true", "yes")
+    
+    if config:
+        app.config.update(config)
+    
+    # Initialize the app with the extension
+    db.init_app(app)
+    
+    # Import models so they are registered with SQLAlchemy
     import models
     
-    # Import routes
+    # Routes, and CLI commands (with the modules only they use) only under the `flask` command
     import routes
+    app.register_blueprint(routes.bp)
+    if click.get_current_context(silent=True) is not None:
+        import cli
+        app.register_blueprint(cli.bp)
     
-    # Create tables if they don't exist
+    # Request timing, SQL query counts and /metrics
+    import instrumentation
+    instrumentation.init_app(app)
+    
+    if app.config["AUTO_CREATE_SCHEMA"]:
+        with app.app_context():
+            create_schema()
+    
+    return app
+
+def _engine_options(prefix):
+    """Engine/pool options, with pool sizing from <prefix>_POOL_SIZE, _MAX_OVERFLOW and _POOL_TIMEOUT"""
+    options = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    for setting, cast in (("pool_size", int), ("max_overflow", int), ("pool_timeout", float)):
+        value = os.environ.get(f"{prefix}_{setting.upper()}")
+        if value:
+            options[setting] = cast(value)
+    return options
+
+def create_schema():
+    """Create missing tables and apply pending migrations; returns the migrations applied"""
+    import migrations
     db.create_all()
+    return migrations.upgrade(db.engine)
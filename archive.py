@@ -0,0 +1,137 @@
+"""
+Hot/cold archival of settled payments and sold listings
+
+payments and listings only grow, and every dashboard query and index
+pays for rows nobody looks at any more. `flask archive` moves rows older
+than ARCHIVE_AFTER_DAYS (90 by default) into payments_archive and
+listings_archive, a batch at a time, each batch in one short transaction:
+
+    payments   completed or failed, created and last updated before the
+               cutoff (pending ones are left to reconcile-payments)
+    listings   unavailable, created before the cutoff, sold (a completed
+               payment already in the archive) and with no payment left
+               in payments, which still references listings; payments
+               are archived first for that reason
+
+Archived rows keep their ids and columns. Lookups by reference (status
+page, polling API and stream, payment callback) and payment exports fall
+back to the archive, so nothing a user can reach goes missing; dashboards,
+the feed and its facets (which only count available listings) read the
+hot tables alone.
+
+Run it periodically, e.g. `flask archive --interval 3600` or from cron.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, exists, insert, literal, or_, select, tuple_
+from app import db
+from models import ArchivedListing, ArchivedPayment, Listing, Payment, User
+
+DEFAULT_AFTER_DAYS = 90
+BATCH_SIZE = 500
+
+class ArchiveResult:
+    """Counts from one archive run"""
+
+    def __init__(self):
+        self.payments = 0
+        self.listings = 0
+        self.batches = 0
+
+    def to_dict(self):
+        return {'payments': self.payments, 'listings': self.listings, 'batches': self.batches}
+
+def cutoff(days=None):
+    """Rows older than this are archived"""
+    if days is None:
+        days = current_app.config.get('ARCHIVE_AFTER_DAYS', DEFAULT_AFTER_DAYS)
+    return datetime.utcnow() - timedelta(days=days)
+
+def _archivable_payments(before):
+    return (Payment.status != 'pending', Payment.created_at < before, Payment.updated_at < before)
+
+def _archivable_listings(before):
+    now = datetime.utcnow()
+    return (
+        Listing.is_available == False,
+        Listing.created_at < before,
+        or_(Listing.reserved_until.is_(None), Listing.reserved_until < now),
+        ~exists().where(Payment.listing_id == Listing.id),
+        exists().where(ArchivedPayment.listing_id == Listing.id, ArchivedPayment.status == 'completed'),
+    )
+
+def _batch_query(model, conditions, after, batch_size):
+    """Next batch of (created_at, id) in key order, locked against concurrent changes where supported"""
+    query = select(model.created_at, model.id).where(*conditions)
+    if after is not None:
+        query = query.where(tuple_(model.created_at, model.id) > tuple_(
+            *after, types=(model.created_at.type, model.id.type)))
+    query = query.order_by(model.created_at, model.id).limit(batch_size)
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(of=model, skip_locked=True)
+    return query
+
+def _move(model, archive_model, conditions, ids):
+    """Copy the rows still matching conditions to the archive and delete them, in the open transaction"""
+    columns = [column.name for column in archive_model.__table__.columns if column.name != 'archived_at']
+    source = model.__table__.c
+    matching = (*conditions, source.id.in_(ids))
+    copied = db.session.execute(insert(archive_model.__table__).from_select(
+        columns + ['archived_at'],
+        select(*[source[name] for name in columns], literal(datetime.utcnow(), archive_model.archived_at.type))
+        .where(*matching))).rowcount
+    removed = db.session.execute(delete(model.__table__).where(*matching)).rowcount
+    if copied != removed:
+        raise RuntimeError(f"copied {copied} rows to {archive_model.__tablename__} but removed {removed}")
+    return removed
+
+def _archive(model, archive_model, conditions, batch_size, pause, limit):
+    moved = batches = 0
+    after = None
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        rows = db.session.execute(_batch_query(model, conditions, after, size)).all()
+        if not rows:
+            break
+        after = tuple(rows[-1])
+        try:
+            moved += _move(model, archive_model, conditions, [row.id for row in rows])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error archiving {model.__tablename__}: {str(e)}")
+            break
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return moved, batches
+
+def archive(days=None, batch_size=BATCH_SIZE, pause=0.0, limit=None):
+    """Move old settled payments, then old sold listings, to the archive tables"""
+    result = ArchiveResult()
+    before = cutoff(days)
+    result.payments, batches = _archive(Payment, ArchivedPayment, _archivable_payments(before),
+                                        batch_size, pause, limit)
+    result.batches += batches
+    result.listings, batches = _archive(Listing, ArchivedListing, _archivable_listings(before),
+                                        batch_size, pause, limit)
+    result.batches += batches
+    return result
+
+def find_payment(reference):
+    """Payment (or ArchivedPayment) with this transaction reference, or None"""
+    payment = Payment.query.filter_by(transaction_id=reference).first()
+    if payment is None:
+        payment = ArchivedPayment.query.filter_by(transaction_id=reference).first()
+    return payment
+
+def find_listing_with_supplier(listing_id):
+    """(listing, supplier) from listings or listings_archive, or None"""
+    for model in (Listing, ArchivedListing):
+        found = db.session.query(model, User).join(User, model.supplier_id == User.id).filter(
+            model.id == listing_id).first()
+        if found:
+            return found
+    return None
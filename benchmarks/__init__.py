@@ -0,0 +1,6 @@
+"""
+Benchmark and load-test tooling (not imported by the application)
+
+    python -m benchmarks.loadtest --help
+    python -m benchmarks.compare baseline.json current.json
+"""
@@ -0,0 +1,294 @@
+"""
+Rate limits and load shedding under burst load
+
+Starts the app and throws bursts at the limited routes (see ratelimit.py),
+one scenario at a time, each from its own simulated client IPs
+(X-Forwarded-For, which the app trusts from one proxy hop):
+
+    login-ip        --threads clients from one IP, a fresh session per request
+    login-session   one session cookie, a different IP per request
+    register-ip     like login-ip against /register
+    initiate-user   one signed-in buyer starting checkouts on many listings
+    initiate-shed   --shed-buyers buyers, one IP each, all checking out
+                    against a provider taking --provider-latency seconds
+
+Every scenario checks that:
+    - every 429 and 503 carries a Retry-After of at least one second
+    - requests let past a bucket (anything but 429) stay within
+      burst + rate * elapsed, and a full burst is let through
+    - initiate-user: the fake Paystack saw one initialization per 200
+    - initiate-shed: 503s came back fast (p95 under half the provider
+      latency), and provider calls stayed within what the checkout
+      concurrency cap allows
+
+Exits non-zero if any check fails.
+
+    python -m benchmarks.burst --duration 5 --output burst.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks import dataset
+from benchmarks.fake_paystack import FakePaystack
+from benchmarks.loadtest import percentile, prepare_dataset, wait_until_ready, git_revision
+
+SECRET_KEY = 'bench-secret-key'
+
+
+class Tally:
+    """Statuses, latencies and Retry-After problems for one scenario"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.seconds = {}
+        self.missing_retry_after = 0
+
+    def record(self, response, seconds):
+        with self.lock:
+            self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+            self.seconds.setdefault(response.status_code, []).append(seconds)
+            if response.status_code in (429, 503):
+                retry_after = response.headers.get('Retry-After', '')
+                if not retry_after.isdigit() or int(retry_after) < 1:
+                    self.missing_retry_after += 1
+
+
+def hammer(threads, duration, send):
+    """Call send(thread_index) in a loop on each thread for duration seconds"""
+    tally = Tally()
+    stop = threading.Event()
+
+    def loop(index):
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = send(index)
+            except requests.RequestException:
+                with tally.lock:
+                    tally.statuses['error'] = tally.statuses.get('error', 0) + 1
+                continue
+            tally.record(response, time.perf_counter() - started)
+
+    workers = [threading.Thread(target=loop, args=(index,), daemon=True) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return tally, time.perf_counter() - started
+
+
+def ip(block, number):
+    return f'10.{block}.{number // 250 % 250}.{number % 250 + 1}'
+
+
+def login(args, number, address):
+    session = requests.Session()
+    session.headers['X-Forwarded-For'] = address
+    response = session.post(args.target + '/login', allow_redirects=False, timeout=args.request_timeout,
+                            data={'email': dataset.buyer_email(number), 'password': dataset.BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f'Login of {dataset.buyer_email(number)} failed with {response.status_code}')
+    return session
+
+
+def check_bucket(name, tally, elapsed, rate, workers, earlier=0):
+    """Problems with how many requests got past a bucket of `rate` over `elapsed` seconds"""
+    problems = []
+    passed = earlier + sum(count for status, count in tally.statuses.items() if status not in (429, 'error'))
+    total = earlier + sum(tally.statuses.values())
+    # Each worker process keeps its own buckets unless RATE_LIMIT_URL is set
+    ceiling = (rate.burst + rate.per_second * elapsed) * workers + 1
+    if passed > ceiling:
+        problems.append(f'{passed} requests got past the {name} bucket, at most {ceiling:.0f} expected')
+    if passed < min(rate.burst, total):
+        problems.append(f'only {passed} requests got past the {name} bucket, a burst of {rate.burst} should')
+    return problems, passed, ceiling
+
+
+def report_scenario(name, tally, elapsed, problems, **extra):
+    if tally.missing_retry_after:
+        problems.append(f'{tally.missing_retry_after} 429/503 responses without a usable Retry-After')
+    if tally.statuses.get('error'):
+        problems.append(f"{tally.statuses['error']} requests failed outright")
+    latencies = {str(status): round(percentile(sorted(values), 0.95) * 1000, 1)
+                 for status, values in tally.seconds.items()}
+    summary = {'scenario': name, 'seconds': round(elapsed, 2),
+               'statuses': {str(status): count for status, count in sorted(tally.statuses.items(), key=str)},
+               'p95_ms_by_status': latencies, **extra, 'problems': problems}
+    print(f"{name:<15} {summary['statuses']} p95={latencies}"
+          + (f"  FAILED: {'; '.join(problems)}" if problems else ''), file=sys.stderr)
+    return summary
+
+
+def run_scenarios(args, fake, targets, limiter):
+    scenarios = []
+    listings = [item for item in targets['available'] if item['price']]
+    policies = limiter.policies
+
+    # login-ip: new session every time, so only the per-IP bucket can stop it
+    def send(index):
+        return requests.post(args.target + '/login', allow_redirects=False, timeout=args.request_timeout,
+                             headers={'X-Forwarded-For': ip(1, 0)},
+                             data={'email': dataset.buyer_email(index), 'password': 'wrong-password'})
+    tally, elapsed = hammer(args.threads, args.duration, send)
+    problems, passed, ceiling = check_bucket('login ip', tally, elapsed, policies['login'].rates['ip'], args.workers)
+    scenarios.append(report_scenario('login-ip', tally, elapsed, problems, passed=passed, ceiling=round(ceiling)))
+
+    # login-session: one cookie, a new IP per request, so only the per-session bucket can stop it
+    first = requests.Session()
+    first.post(args.target + '/login', allow_redirects=False, timeout=args.request_timeout,
+               headers={'X-Forwarded-For': ip(2, 0)}, data={'email': dataset.buyer_email(0), 'password': 'wrong'})
+    cookies = first.cookies.get_dict()
+    counter = iter(range(1, 10 ** 9))
+
+    def send(index):
+        return requests.post(args.target + '/login', allow_redirects=False, timeout=args.request_timeout,
+                             cookies=cookies, headers={'X-Forwarded-For': ip(2, next(counter))},
+                             data={'email': dataset.buyer_email(index), 'password': 'wrong-password'})
+    tally, elapsed = hammer(args.threads, args.duration, send)
+    problems, passed, ceiling = check_bucket('login session', tally, elapsed, policies['login'].rates['session'],
+                                             args.workers, earlier=1)
+    scenarios.append(report_scenario('login-session', tally, elapsed, problems, passed=passed,
+                                     ceiling=round(ceiling)))
+
+    # register-ip: incomplete forms, so nothing is created, but every attempt costs a token
+    def send(index):
+        return requests.post(args.target + '/register', allow_redirects=False, timeout=args.request_timeout,
+                             headers={'X-Forwarded-For': ip(3, 0)},
+                             data={'name': 'Burst', 'email': f'burst{index}@bench.local'})
+    tally, elapsed = hammer(args.threads, args.duration, send)
+    problems, passed, ceiling = check_bucket('register ip', tally, elapsed, policies['register'].rates['ip'],
+                                             args.workers)
+    scenarios.append(report_scenario('register-ip', tally, elapsed, problems, passed=passed,
+                                     ceiling=round(ceiling)))
+
+    # initiate-user: one buyer, many listings; every 200 must be exactly one provider call
+    buyer = login(args, 0, ip(4, 0))
+    with fake.server.lock:
+        before = len(fake.server.transactions)
+    rng = random.Random(args.seed)
+
+    def send(index):
+        listing = rng.choice(listings)
+        return buyer.post(args.target + '/paystack/initiate', timeout=args.request_timeout,
+                          json={'listing_id': listing['id'], 'amount': listing['price'],
+                                'currency': listing['currency']})
+    tally, elapsed = hammer(min(args.threads, 4), args.duration, send)
+    with fake.server.lock:
+        new = list(fake.server.transactions.values())[before:]
+    problems, passed, ceiling = check_bucket('initiate session', tally, elapsed,
+                                             policies['initiate'].rates['session'], args.workers)
+    if len(new) != tally.statuses.get(200, 0):
+        problems.append(f'{len(new)} Paystack initializations for {tally.statuses.get(200, 0)} successful checkouts')
+    scenarios.append(report_scenario('initiate-user', tally, elapsed, problems, passed=passed,
+                                     ceiling=round(ceiling), paystack_initializations=len(new)))
+
+    # initiate-shed: more buyers than checkout slots, each under its own limits, against a slow provider
+    print(f'Logging in {args.shed_buyers} buyers...', file=sys.stderr)
+    buyers = [login(args, number, ip(5, number)) for number in range(1, args.shed_buyers + 1)]
+    with fake.server.lock:
+        before = len(fake.server.transactions)
+
+    def send(index):
+        listing = rng.choice(listings)
+        return buyers[index].post(args.target + '/paystack/initiate', timeout=args.request_timeout,
+                                  json={'listing_id': listing['id'], 'amount': listing['price'],
+                                        'currency': listing['currency']})
+    tally, elapsed = hammer(len(buyers), args.duration, send)
+    with fake.server.lock:
+        calls = len(fake.server.transactions) - before
+    problems = []
+    cap = limiter.cap('initiate')
+    if cap is not None:
+        allowed_calls = cap.limit * args.workers * (elapsed / args.provider_latency + 1)
+        if calls > allowed_calls:
+            problems.append(f'{calls} provider calls, the checkout cap allows about {allowed_calls:.0f}')
+        if not tally.statuses.get(503):
+            problems.append('no checkout was shed at the concurrency cap')
+    shed_seconds = sorted(tally.seconds.get(503, []))
+    if shed_seconds and percentile(shed_seconds, 0.95) > args.provider_latency / 2:
+        problems.append(f'503s took {percentile(shed_seconds, 0.95):.2f}s at p95; shedding should not queue')
+    scenarios.append(report_scenario('initiate-shed', tally, elapsed, problems, provider_calls=calls,
+                                     cap=cap.limit if cap else None))
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file in a temporary directory')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per scenario')
+    parser.add_argument('--threads', type=int, default=4, help='Concurrent clients per rate scenario')
+    parser.add_argument('--shed-buyers', type=int, default=40)
+    parser.add_argument('--provider-latency', type=float, default=1.0)
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn only')
+    parser.add_argument('--port', type=int, default=5061)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--request-timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+    args.target = f'http://127.0.0.1:{args.port}'
+    if args.server == 'werkzeug':
+        args.workers = 1
+    # prepare_dataset() settings: enough buyers for the shed scenario, plenty of listings to check out
+    args.farmers, args.buyers, args.listings, args.payments, args.reseed = 5, args.shed_buyers + 1, 2000, 0, True
+
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='foodbridge-bench-'), 'bench.db')}"
+    os.environ.update(DATABASE_URL=args.database_url, PAYSTACK_SECRET_KEY=SECRET_KEY, LOG_LEVEL='WARNING',
+                      # Buyers come back to the same listings; holds must not turn checkouts into 409s
+                      RESERVATION_HOLD_SECONDS='1',
+                      PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', PASSWORD_HASH_QUEUE_TIMEOUT='60',
+                      PAYSTACK_READ_TIMEOUT=str(args.provider_latency * 5 + 5), PAYSTACK_BREAKER_THRESHOLD='1000000')
+    # Same configuration as the server, for the expected numbers
+    from ratelimit import limiter_from_env
+    limiter = limiter_from_env()
+    if not limiter.enabled:
+        raise SystemExit('RATE_LIMITS is off; nothing to measure')
+
+    with FakePaystack(latency=args.provider_latency) as fake:
+        os.environ['PAYSTACK_BASE_URL'] = fake.url
+        counts, targets = prepare_dataset(args)
+        server = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--server', args.server,
+                                   '--port', str(args.port), '--workers', str(args.workers)], env=dict(os.environ))
+        try:
+            wait_until_ready(args.target)
+            scenarios = run_scenarios(args, fake, targets, limiter)
+        finally:
+            server.terminate()
+            server.wait()
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'dataset': counts, 'server': args.server,
+                 'workers': args.workers, 'duration': args.duration, 'threads': args.threads,
+                 'provider_latency_seconds': args.provider_latency,
+                 'policies': {name: {scope: repr(rate) for scope, rate in policy.rates.items()}
+                              for name, policy in limiter.policies.items()},
+                 'concurrency': {name: cap.limit for name, cap in limiter.caps.items()}},
+        'scenarios': scenarios,
+        'ok': not any(item['problems'] for item in scenarios)
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare two load test results (benchmarks.loadtest --output)
+
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+
+Prints p50/p95/p99 and throughput per endpoint and concurrency level and
+exits with status 1 if any endpoint's p95 got slower by more than the
+threshold (percent) or started returning errors.
+"""
+import argparse
+import json
+import sys
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline, current, threshold):
+    """Yield (level, endpoint, before, after, regressed) for every endpoint present in both"""
+    baseline_levels = {level['concurrency']: level for level in baseline['levels']}
+    for level in current['levels']:
+        before_level = baseline_levels.get(level['concurrency'])
+        if before_level is None:
+            continue
+        for endpoint, after in level['endpoints'].items():
+            before = before_level['endpoints'].get(endpoint)
+            if before is None:
+                continue
+            p95_change = change(before['p95_ms'], after['p95_ms'])
+            regressed = (p95_change is not None and p95_change > threshold) or \
+                (after['errors'] > 0 and before['errors'] == 0)
+            yield level['concurrency'], endpoint, before, after, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Allowed p95 slowdown in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding='utf-8') as handle:
+        baseline = json.load(handle)
+    with open(args.current, encoding='utf-8') as handle:
+        current = json.load(handle)
+
+    print(f"baseline {baseline['meta'].get('git_revision')}  current {current['meta'].get('git_revision')}")
+    print(f"{'VU':>4} {'endpoint':<20}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'rps':>16}")
+
+    regressions = 0
+    for concurrency, endpoint, before, after, regressed in compare(baseline, current, args.threshold):
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            delta = change(before[key], after[key])
+            cells.append(f"{after[key]:>9} ({delta:+.0f}%)" if delta is not None else f"{after[key]:>9}      ")
+        marker = '  REGRESSION' if regressed else ''
+        print(f"{concurrency:>4} {endpoint:<20}{cells[0]:>18}{cells[1]:>18}{cells[2]:>18}{cells[3]:>16}{marker}")
+        regressions += regressed
+
+    if regressions:
+        print(f'\n{regressions} regression(s) beyond {args.threshold:.0f}% p95', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
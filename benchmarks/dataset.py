@@ -0,0 +1,192 @@
+"""
+Synthetic, reproducible dataset for benchmarks
+
+The same seed always produces the same users, listings and payments, so
+runs on different commits measure the same data. Every seeded user has
+the password BENCH_PASSWORD; emails are farmer<N>@bench.local and
+buyer<N>@bench.local.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.dataset --listings 50000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+
+BENCH_PASSWORD = 'bench-password'
+INSERT_CHUNK_SIZE = 5000
+
+PRODUCE = ('tomatoes', 'maize', 'cassava', 'yams', 'plantain', 'onions', 'cabbage', 'carrots', 'beans',
+           'rice', 'millet', 'sorghum', 'groundnuts', 'okra', 'peppers', 'spinach', 'kale', 'mangoes',
+           'oranges', 'bananas', 'pineapples', 'watermelon', 'avocados', 'potatoes', 'sweet potatoes',
+           'eggs', 'milk', 'bread', 'lentils', 'garlic')
+QUALIFIERS = ('fresh', 'organic', 'ripe', 'dried', 'local', 'surplus', 'bulk', 'red', 'green', 'yellow',
+              'smoked', 'sun-dried', 'day-old', 'free-range', 'small', 'large')
+UNITS = ('kg', 'bags', 'crates', 'boxes', 'bunches', 'litres', 'trays')
+CURRENCIES = ('USD', 'GHS', 'NGN', 'EUR', 'CAD')
+
+
+def farmer_email(number):
+    return f'farmer{number}@bench.local'
+
+
+def buyer_email(number):
+    return f'buyer{number}@bench.local'
+
+
+def _uuid(rng, created_at):
+    # Time-ordered like the ids the app issues (ids.new_id), but reproducible from the seed
+    from ids import uuid7_from
+    ms = int(created_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return str(uuid7_from(ms, rng.getrandbits(74)))
+
+
+def _insert(db, table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(table.insert(), rows[start:start + INSERT_CHUNK_SIZE])
+    db.session.commit()
+
+
+def seed(farmers=50, buyers=200, listings=10000, payments=20000, seed=42, days=180):
+    """Insert the dataset into the configured database and return the row counts"""
+    from app import db
+    from models import User, Listing, Payment
+    from cache import invalidate_listings
+    from passwords import get_policy
+    from validation import parse_quantity
+    from rates import applied_rates, base_price
+    import facets
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # Hashing is deliberately slow; every bench user shares one hash
+    password_hash = get_policy().hash(BENCH_PASSWORD)
+
+    def timestamp():
+        return now - timedelta(seconds=rng.randint(0, days * 86400))
+
+    users = []
+    farmer_ids = []
+    for number in range(farmers):
+        created_at = timestamp()
+        farmer_ids.append(_uuid(rng, created_at))
+        users.append({'id': farmer_ids[-1], 'email': farmer_email(number), 'role': 'farmer',
+                      'name': f'Bench Farm {number}', 'password_hash': password_hash, 'created_at': created_at})
+    buyer_ids = []
+    for number in range(buyers):
+        created_at = timestamp()
+        buyer_ids.append(_uuid(rng, created_at))
+        users.append({'id': buyer_ids[-1], 'email': buyer_email(number), 'role': 'buyer',
+                      'name': f'Bench Buyer {number}', 'password_hash': password_hash, 'created_at': created_at})
+    _insert(db, User.__table__, users)
+
+    rates = applied_rates()
+    listing_rows = []
+    for _ in range(listings):
+        item_name = f'{rng.choice(QUALIFIERS)} {rng.choice(PRODUCE)}'.capitalize()
+        quantity = f'{rng.randint(1, 500)} {rng.choice(UNITS)}'
+        quantity_amount, quantity_unit = parse_quantity(quantity)
+        created_at = timestamp()
+        listing_rows.append({
+            'id': _uuid(rng, created_at),
+            'item_name': item_name,
+            'quantity': quantity,
+            'quantity_amount': quantity_amount,
+            'quantity_unit': quantity_unit,
+            'price': round(rng.uniform(1, 500), 2),
+            'currency': rng.choice(CURRENCIES),
+            'is_available': rng.random() < 0.8,
+            'contact': f'+233{rng.randint(200000000, 599999999)}',
+            'created_at': created_at,
+            'supplier_id': rng.choice(farmer_ids)
+        })
+    for row in listing_rows:
+        row['price_base'] = base_price(rates, row['price'], row['currency'])
+    _insert(db, Listing.__table__, listing_rows)
+
+    payment_rows = []
+    for number in range(payments if listing_rows else 0):
+        listing = rng.choice(listing_rows)
+        created_at = max(listing['created_at'], timestamp())
+        status = rng.choices(('completed', 'failed', 'pending'), weights=(70, 20, 10))[0]
+        payment_rows.append({
+            'id': _uuid(rng, created_at),
+            'created_at': created_at,
+            'updated_at': created_at + timedelta(seconds=rng.randint(1, 600)),
+            'amount': listing['price'],
+            'currency': listing['currency'],
+            'status': status,
+            'transaction_id': f'bench_{seed}_{number:08d}',
+            'supplier_id': listing['supplier_id'],
+            'buyer_id': rng.choice(buyer_ids),
+            'listing_id': listing['id']
+        })
+    _insert(db, Payment.__table__, payment_rows)
+
+    facets.rebuild()
+    invalidate_listings()
+    return {'farmers': farmers, 'buyers': buyers, 'listings': len(listing_rows), 'payments': len(payment_rows)}
+
+
+def clear():
+    """Remove every row the dataset can have created (bench users and everything that hangs off them)"""
+    from app import db
+    from models import User, Listing, Payment, WaitingList
+    import facets
+
+    bench_users = db.session.query(User.id).filter(User.email.like('%@bench.local'))
+    Payment.query.filter(db.or_(Payment.buyer_id.in_(bench_users), Payment.supplier_id.in_(bench_users))).delete(
+        synchronize_session=False)
+    WaitingList.query.filter(WaitingList.buyer_id.in_(bench_users)).delete(synchronize_session=False)
+    Listing.query.filter(Listing.supplier_id.in_(bench_users)).delete(synchronize_session=False)
+    User.query.filter(User.email.like('%@bench.local')).delete(synchronize_session=False)
+    db.session.commit()
+    # Bulk deletes bypass the incremental facet counts
+    facets.rebuild()
+
+
+def targets(sample_size=5000, seed=42):
+    """
+    Ids the load driver needs: each bench farmer's listings (for updates) and
+    a sample of available listings with their price (for checkouts)
+    """
+    from app import db
+    from models import User, Listing
+
+    farmer_listings = {}
+    rows = db.session.query(User.email, Listing.id).join(Listing, Listing.supplier_id == User.id).filter(
+        User.email.like('farmer%@bench.local'))
+    for email, listing_id in rows:
+        farmer_listings.setdefault(email, []).append(listing_id)
+
+    available = db.session.query(Listing.id, Listing.price, Listing.currency, User.email).join(
+        User, Listing.supplier_id == User.id).filter(Listing.is_available == True,
+                                                     User.email.like('%@bench.local')).all()
+    random.Random(seed).shuffle(available)
+    return {
+        'farmer_listings': farmer_listings,
+        'available': [{'id': row[0], 'price': float(row[1] or 1), 'currency': row[2] or 'USD'}
+                      for row in available[:sample_size]]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farmers', type=int, default=50)
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--payments', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--clear', action='store_true', help='Remove an existing bench dataset first')
+    args = parser.parse_args()
+
+    from app import create_app, create_schema
+    app = create_app()
+    with app.app_context():
+        create_schema()
+        if args.clear:
+            clear()
+        print(seed(args.farmers, args.buyers, args.listings, args.payments, args.seed))
+
+
+if __name__ == '__main__':
+    main()
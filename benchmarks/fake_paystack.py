@@ -0,0 +1,144 @@
+"""
+Local stand-in for the Paystack API
+
+Implements the two calls the app makes (initialize and verify) with
+configurable latency and failure rate, so payment routes can be load
+tested without touching the real provider. Point the app at it with
+PAYSTACK_BASE_URL=http://127.0.0.1:<port>.
+
+    python -m benchmarks.fake_paystack --port 8099 --latency 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakePaystackHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _simulate(self):
+        """Sleep for the configured latency; True if this call should fail with a 503"""
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        return server.failure_rate and random.random() < server.failure_rate
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._reply(400, {'status': False, 'message': 'Invalid JSON'})
+
+        if self.path.rstrip('/') != '/transaction/initialize':
+            return self._reply(404, {'status': False, 'message': 'Not found'})
+        if self._simulate():
+            return self._reply(503, {'status': False, 'message': 'Service unavailable'})
+
+        reference = payload.get('reference') or f"fake_{random.getrandbits(48):012x}"
+        with self.server.lock:
+            self.server.transactions[reference] = payload
+        self._reply(200, {
+            'status': True,
+            'message': 'Authorization URL created',
+            'data': {
+                'authorization_url': f'https://checkout.paystack.test/{reference}',
+                'access_code': reference,
+                'reference': reference
+            }
+        })
+
+    def do_GET(self):
+        prefix = '/transaction/verify/'
+        if not self.path.startswith(prefix):
+            return self._reply(404, {'status': False, 'message': 'Not found'})
+        if self._simulate():
+            return self._reply(503, {'status': False, 'message': 'Service unavailable'})
+
+        reference = self.path[len(prefix):]
+        with self.server.lock:
+            payload = self.server.transactions.get(reference)
+        if payload is None:
+            return self._reply(400, {'status': False, 'message': 'Transaction reference not found'})
+        self._reply(200, {
+            'status': True,
+            'message': 'Verification successful',
+            'data': {
+                'reference': reference,
+                'status': self.server.verify_status,
+                'amount': payload.get('amount'),
+                'currency': payload.get('currency')
+            }
+        })
+
+
+class FakePaystack:
+    """Threaded fake Paystack server; use as a context manager or call start()/stop()"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 verify_status='success'):
+        self.server = ThreadingHTTPServer((host, port), FakePaystackHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.jitter = jitter
+        self.server.failure_rate = failure_rate
+        self.server.verify_status = verify_status
+        self.server.transactions = {}
+        self.server.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-paystack', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency, up to this many seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of calls answered with a 503')
+    parser.add_argument('--verify-status', default='success', help="Status reported by verify ('success', 'failed', ...)")
+    args = parser.parse_args()
+
+    fake = FakePaystack(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.verify_status)
+    print(f'Fake Paystack listening on {fake.url}')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
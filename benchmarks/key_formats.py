@@ -0,0 +1,180 @@
+"""
+Insert and lookup cost of the primary key formats
+
+Builds one payments-shaped table per key format and fills it in batches,
+the way payments and listings grow:
+
+    text-uuid4   String(36) keys from uuid4 (the old models)
+    uuid4        ids.UUIDKey (native uuid / 16 bytes) with random uuid4 values
+    uuid7        ids.UUIDKey with time-ordered uuid7 values (the new models)
+
+Each row has a primary key and an indexed foreign-key-like column pointing
+at one of --parents parent ids. Reported per format:
+
+    insert_rows_per_second   overall, and over the last 10% of batches (when
+                             the index no longer fits in the cache)
+    pk_lookup_us, fk_lookup_us   p50/p95 of single-row selects by primary key
+                             and of selects by the indexed reference column
+    table_bytes, index_bytes (SQLite: from dbstat when available)
+
+On SQLite, --cache-kib caps the page cache so that a few hundred thousand
+rows behave like a table that no longer fits in memory. On Postgres
+(--database-url) the tables are created in that database and dropped again.
+
+    python -m benchmarks.key_formats --rows 300000 --output keys.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Index, MetaData, Numeric, String, Table, create_engine, event, select, text
+
+from benchmarks.loadtest import percentile, git_revision
+from ids import UUIDKey, uuid7
+
+FORMATS = {
+    'text-uuid4': (lambda: String(36), lambda: str(uuid.uuid4())),
+    'uuid4': (UUIDKey, lambda: str(uuid.uuid4())),
+    'uuid7': (UUIDKey, lambda: str(uuid7())),
+}
+
+
+def build_table(metadata, name, key_type):
+    return Table(
+        f'keybench_{name.replace("-", "_")}', metadata,
+        Column('id', key_type(), primary_key=True),
+        Column('listing_id', key_type(), nullable=False),
+        Column('created_at', DateTime, nullable=False),
+        Column('amount', Numeric(10, 2), nullable=False),
+        Index(f'ix_keybench_{name.replace("-", "_")}_listing', 'listing_id'),
+    )
+
+
+def sizes(engine, table):
+    """(table bytes, index bytes), or (None, None) when the database cannot tell"""
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            row = conn.execute(text("SELECT pg_table_size(:t), pg_indexes_size(:t)"), {'t': table.name}).first()
+            return row[0], row[1]
+        try:
+            rows = conn.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all()
+        except Exception:
+            return None, None
+        indexes = {index['name'] for index in engine.dialect.get_indexes(conn, table.name)}
+        by_name = dict(rows)
+        index_bytes = sum(size for name, size in by_name.items()
+                          if name in indexes or name.startswith(f'sqlite_autoindex_{table.name}'))
+        return by_name.get(table.name), index_bytes
+
+
+def run_format(engine, name, args):
+    key_type, new_key = FORMATS[name]
+    metadata = MetaData()
+    table = build_table(metadata, name, key_type)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    rng = random.Random(args.seed)
+    parents = [new_key() for _ in range(args.parents)]
+    started_at = datetime.utcnow() - timedelta(days=365)
+    keys = []
+    batch_seconds = []
+    for batch in range(args.rows // args.batch_size):
+        rows = []
+        for number in range(args.batch_size):
+            keys.append(new_key())
+            rows.append({'id': keys[-1], 'listing_id': rng.choice(parents),
+                         'created_at': started_at + timedelta(seconds=len(keys)),
+                         'amount': round(rng.uniform(1, 500), 2)})
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        batch_seconds.append(time.perf_counter() - started)
+
+    tail = batch_seconds[-max(1, len(batch_seconds) // 10):]
+    pk_times, fk_times = [], []
+    with engine.connect() as conn:
+        for _ in range(args.lookups):
+            key = rng.choice(keys)
+            started = time.perf_counter()
+            conn.execute(select(table.c.amount).where(table.c.id == key)).first()
+            pk_times.append(time.perf_counter() - started)
+            parent = rng.choice(parents)
+            started = time.perf_counter()
+            conn.execute(select(table.c.id).where(table.c.listing_id == parent).limit(20)).all()
+            fk_times.append(time.perf_counter() - started)
+    pk_times.sort()
+    fk_times.sort()
+
+    table_bytes, index_bytes = sizes(engine, table)
+    if not args.keep:
+        metadata.drop_all(engine)
+
+    result = {
+        'format': name,
+        'rows': len(keys),
+        'insert_rows_per_second': round(len(keys) / sum(batch_seconds)),
+        'insert_rows_per_second_last_10pct': round(len(tail) * args.batch_size / sum(tail)),
+        'pk_lookup_us': {'p50': round(percentile(pk_times, 0.50) * 1e6, 1),
+                         'p95': round(percentile(pk_times, 0.95) * 1e6, 1)},
+        'fk_lookup_us': {'p50': round(percentile(fk_times, 0.50) * 1e6, 1),
+                         'p95': round(percentile(fk_times, 0.95) * 1e6, 1)},
+        'table_bytes': table_bytes,
+        'index_bytes': index_bytes,
+    }
+    print(f"{name:<11} insert {result['insert_rows_per_second']:>7}/s (last 10%: "
+          f"{result['insert_rows_per_second_last_10pct']}/s)  pk p50={result['pk_lookup_us']['p50']}us "
+          f"fk p50={result['fk_lookup_us']['p50']}us  index={index_bytes}", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file per format in a temporary directory')
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--parents', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--cache-kib', type=int, default=2048, help='SQLite page cache size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='Leave the tables in place')
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='foodbridge-keys-')
+    results = []
+    for name in args.formats.split(','):
+        url = args.database_url or f"sqlite:///{os.path.join(directory, name + '.db')}"
+        engine = create_engine(url)
+        if engine.dialect.name == 'sqlite':
+            @event.listens_for(engine, 'connect')
+            def _cache_size(dbapi_connection, connection_record):
+                dbapi_connection.execute(f'PRAGMA cache_size = -{args.cache_kib}')
+        try:
+            results.append(run_format(engine, name, args))
+        finally:
+            engine.dispose()
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'database': args.database_url or 'sqlite',
+                 'rows': args.rows, 'batch_size': args.batch_size, 'parents': args.parents,
+                 'lookups': args.lookups, 'cache_kib': args.cache_kib},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""
+Load test for the main user journeys
+
+Seeds a synthetic dataset (benchmarks.dataset), starts a fake Paystack
+(benchmarks.fake_paystack) and the app in a separate process, then drives
+a weighted mix of login, buyer dashboard browsing and search, listing
+create/update, checkout initiation, signed webhooks and status polling
+from N concurrent virtual users. Each concurrency level reports
+throughput and p50/p95/p99 latency per endpoint; results are written as
+JSON for benchmarks.compare.
+
+    python -m benchmarks.loadtest --concurrency 1,8,32 --duration 30 --output results.json
+    python -m benchmarks.loadtest --database-url postgresql://localhost/foodbridge_bench --listings 100000
+
+Use --target to drive an already running deployment instead (its
+PAYSTACK_BASE_URL and PAYSTACK_SECRET_KEY must match --paystack-url and
+--secret-key, and it must use the same database as --database-url).
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from benchmarks import dataset
+from benchmarks.fake_paystack import FakePaystack
+
+DEFAULT_MIX = {
+    'login': 5,
+    'buyer_dashboard': 20,
+    'search': 20,
+    'api_listings': 10,
+    'create_listing': 5,
+    'update_listing': 5,
+    'initiate': 10,
+    'webhook': 8,
+    'transaction_status': 17
+}
+
+SEARCH_TERMS = dataset.PRODUCE + dataset.QUALIFIERS + ('tomatos', 'casava', 'fresh maize', 'organic eggs')
+
+SECRET_KEY = 'bench-secret-key'
+
+
+class Recorder:
+    """Collects latencies and outcomes per endpoint; thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.outcomes = {}
+        self.enabled = False
+
+    def record(self, endpoint, seconds, outcome):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            counts = self.outcomes.setdefault(endpoint, {'ok': 0, 'rejected': 0, 'error': 0})
+            counts[outcome] += 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        counts = recorder.outcomes[endpoint]
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'ok': counts['ok'],
+            'rejected': counts['rejected'],
+            'errors': counts['error'],
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 2),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2)
+        }
+    total = sum(item['requests'] for item in endpoints.values())
+    return {
+        'duration_seconds': round(elapsed, 2),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+        'errors': sum(item['errors'] for item in endpoints.values()),
+        'endpoints': endpoints
+    }
+
+
+class VirtualUser:
+    """One simulated buyer and farmer pair issuing requests from the mix"""
+
+    def __init__(self, number, args, targets, recorder):
+        self.args = args
+        self.base = args.target.rstrip('/')
+        self.targets = targets
+        self.recorder = recorder
+        self.rng = random.Random(args.seed * 1000 + number)
+        self.farmer_number = self.rng.randrange(args.farmers)
+        self.references = []
+        self.pending = []
+        self.buyer = None
+        self.farmer = self._login(dataset.farmer_email(self.farmer_number))
+        self.buyer = self._login(dataset.buyer_email(self.rng.randrange(args.buyers)))
+
+    def _call(self, endpoint, session, method, path, ok=(200,), rejected=(), **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', self.args.request_timeout)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, self.base + path, **kwargs)
+            response.content
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.perf_counter() - started, 'error')
+            return None
+        elapsed = time.perf_counter() - started
+        if response.status_code in ok:
+            outcome = 'ok'
+        elif response.status_code in rejected:
+            outcome = 'rejected'
+        else:
+            outcome = 'error'
+        self.recorder.record(endpoint, elapsed, outcome)
+        return response
+
+    def _login(self, email):
+        session = requests.Session()
+        self._call('login', session, 'POST', '/login', ok=(302,),
+                   data={'email': email, 'password': dataset.BENCH_PASSWORD})
+        return session
+
+    def login(self):
+        self.buyer = self._login(dataset.buyer_email(self.rng.randrange(self.args.buyers)))
+        self.references = []
+        self.pending = []
+
+    def buyer_dashboard(self):
+        self._call('buyer_dashboard', self.buyer, 'GET', '/buyer_dashboard', ok=(200, 304))
+
+    def search(self):
+        term = self.rng.choice(SEARCH_TERMS)
+        self._call('search', self.buyer, 'GET', '/buyer_dashboard', ok=(200, 304), params={'search': term})
+
+    def api_listings(self):
+        params = {'limit': 24}
+        if self.rng.random() < 0.5:
+            params['search'] = self.rng.choice(SEARCH_TERMS)
+        response = self._call('api_listings', self.buyer, 'GET', '/api/listings', ok=(200, 304), params=params)
+        # Follow the cursor now and then, like infinite scroll does
+        if response is not None and response.status_code == 200 and self.rng.random() < 0.3:
+            cursor = response.json().get('next_cursor')
+            if cursor:
+                params['cursor'] = cursor
+                self._call('api_listings', self.buyer, 'GET', '/api/listings', ok=(200, 304), params=params)
+
+    def create_listing(self):
+        self._call('create_listing', self.farmer, 'POST', '/create_listing', ok=(302,), data={
+            'item_name': f'{self.rng.choice(dataset.QUALIFIERS)} {self.rng.choice(dataset.PRODUCE)}'.capitalize(),
+            'quantity': f'{self.rng.randint(1, 200)} {self.rng.choice(dataset.UNITS)}',
+            'price': f'{self.rng.uniform(1, 300):.2f}',
+            'currency': self.rng.choice(dataset.CURRENCIES),
+            'contact': '+233200000000',
+            'is_available': 'on'
+        })
+
+    def update_listing(self):
+        listing_ids = self.targets['farmer_listings'].get(dataset.farmer_email(self.farmer_number))
+        if not listing_ids:
+            return self.create_listing()
+        self._call('update_listing', self.farmer, 'POST', f'/update_listing/{self.rng.choice(listing_ids)}',
+                   ok=(302,), data={
+                       'quantity': f'{self.rng.randint(1, 200)} {self.rng.choice(dataset.UNITS)}',
+                       'price': f'{self.rng.uniform(1, 300):.2f}',
+                       'is_available': 'on'
+                   })
+
+    def initiate(self):
+        if not self.targets['available']:
+            return
+        listing = self.rng.choice(self.targets['available'])
+        response = self._call('initiate', self.buyer, 'POST', '/paystack/initiate', ok=(200,), rejected=(400, 404, 409),
+                              json={'listing_id': listing['id'], 'amount': listing['price'],
+                                    'currency': listing['currency']})
+        if response is not None and response.status_code == 200:
+            reference = response.json()['reference']
+            self.references.append(reference)
+            self.pending.append(reference)
+
+    def webhook(self):
+        """Paystack confirming (or, sometimes, failing) one of this user's checkouts"""
+        if not self.pending:
+            return self.initiate()
+        reference = self.pending.pop(self.rng.randrange(len(self.pending)))
+        success = self.rng.random() < 0.9
+        payload = json.dumps({
+            'event': 'charge.success' if success else 'charge.failed',
+            'data': {'id': self.rng.getrandbits(53), 'reference': reference,
+                     'status': 'success' if success else 'failed'}
+        }).encode('utf-8')
+        signature = hmac.new(self.args.secret_key.encode('utf-8'), payload, hashlib.sha512).hexdigest()
+        self._call('webhook', requests, 'POST', '/paystack/webhook', ok=(200,), data=payload,
+                   headers={'Content-Type': 'application/json', 'X-Paystack-Signature': signature})
+
+    def transaction_status(self):
+        if not self.references:
+            return self.initiate()
+        reference = self.rng.choice(self.references)
+        self._call('transaction_status', self.buyer, 'GET', f'/api/transaction-status/{reference}')
+
+    def run(self, mix, stop):
+        actions = list(mix)
+        weights = [mix[action] for action in actions]
+        while not stop.is_set():
+            getattr(self, self.rng.choices(actions, weights)[0])()
+
+
+def run_level(concurrency, args, targets, mix):
+    recorder = Recorder()
+    users = [VirtualUser(number, args, targets, recorder) for number in range(concurrency)]
+    stop = threading.Event()
+    threads = [threading.Thread(target=user.run, args=(mix, stop), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(args.warmup)
+    recorder.enabled = True
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    recorder.enabled = False
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for thread in threads:
+        thread.join(args.request_timeout + 1)
+    return dict(concurrency=concurrency, **summarize(recorder, elapsed))
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    if text:
+        for part in text.split(','):
+            name, _, weight = part.partition('=')
+            if name.strip() not in DEFAULT_MIX:
+                raise SystemExit(f'Unknown mix entry: {name} (choose from {", ".join(DEFAULT_MIX)})')
+            mix[name.strip()] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True,
+                                             stderr=subprocess.DEVNULL).strip())
+        return revision, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def wait_until_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url + '/login', timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit(f'App did not come up at {url}')
+
+
+def prepare_dataset(args):
+    from app import create_app, create_schema
+    app = create_app()
+    with app.app_context():
+        create_schema()
+        from models import User
+        existing = User.query.filter(User.email.like('%@bench.local')).count()
+        if existing and args.reseed:
+            dataset.clear()
+            existing = 0
+        if not existing:
+            print(f'Seeding {args.listings} listings, {args.payments} payments...', file=sys.stderr)
+            counts = dataset.seed(args.farmers, args.buyers, args.listings, args.payments, args.seed)
+        else:
+            counts = {'reused_bench_users': existing}
+        return counts, dataset.targets(seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file in a temporary directory')
+    parser.add_argument('--target', help='Base URL of an already running app (skips starting one)')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma separated virtual user counts')
+    parser.add_argument('--duration', type=float, default=20.0, help='Measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Unmeasured seconds before each level')
+    parser.add_argument('--mix', help='Override weights, e.g. search=40,initiate=0')
+    parser.add_argument('--farmers', type=int, default=50)
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--payments', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reseed', action='store_true', help='Replace an existing bench dataset')
+    parser.add_argument('--paystack-url', help='Use this Paystack stand-in instead of starting one')
+    parser.add_argument('--paystack-latency', type=float, default=0.02)
+    parser.add_argument('--secret-key', default=SECRET_KEY)
+    parser.add_argument('--request-timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix='foodbridge-bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['PAYSTACK_SECRET_KEY'] = args.secret_key
+    # Every simulated user comes from 127.0.0.1; the limits would measure themselves (see benchmarks/burst.py)
+    os.environ.setdefault('RATE_LIMITS', 'off')
+
+    fake = None
+    if not args.paystack_url:
+        fake = FakePaystack(latency=args.paystack_latency).start()
+        args.paystack_url = fake.url
+    os.environ['PAYSTACK_BASE_URL'] = args.paystack_url
+
+    counts, targets = prepare_dataset(args)
+
+    server = None
+    if not args.target:
+        args.target = f'http://127.0.0.1:{args.port}'
+        server = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--port', str(args.port),
+                                   '--server', args.server], env=dict(os.environ))
+    try:
+        wait_until_ready(args.target)
+        results = []
+        for level in levels:
+            print(f'Running {level} virtual user(s) for {args.duration:.0f}s...', file=sys.stderr)
+            results.append(run_level(level, args, targets, mix))
+            print_level(results[-1])
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+        if fake is not None:
+            fake.stop()
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {
+            'git_revision': revision,
+            'git_dirty': dirty,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': database_url.split(':', 1)[0],
+            'server': 'external' if server is None else args.server,
+            'paystack_latency_seconds': args.paystack_latency if fake is not None else None,
+            'dataset': counts,
+            'mix': mix,
+            'duration_seconds': args.duration,
+            'warmup_seconds': args.warmup,
+            'seed': args.seed
+        },
+        'levels': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+        print(f'Results written to {args.output}', file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+def print_level(level):
+    print(f"\n{level['concurrency']} VU: {level['requests']} requests, {level['throughput_rps']} req/s, "
+          f"{level['errors']} errors", file=sys.stderr)
+    print(f"{'endpoint':<20}{'reqs':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}",
+          file=sys.stderr)
+    for endpoint, stats in level['endpoints'].items():
+        print(f"{endpoint:<20}{stats['requests']:>8}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['errors']:>8}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Cost of a log call on the request thread
+
+Logs --records records from --threads threads through each setup and
+reports the time spent inside logger.info() per call:
+
+    direct     StreamHandler + JsonFormatter, written by the calling thread
+               (what a plain basicConfig-style handler does)
+    queued     logs.NonBlockingQueueHandler, written by a QueueListener
+    sampled    queued, with a LOG_SAMPLING rule keeping 1% of the records
+    filtered   below the logger level (the production default for INFO)
+
+Output goes to a file that sleeps --sink-latency-ms per write, standing in
+for a slow disk or a blocked stdout pipe; the direct path pays that on
+every call, the queued one does not (until the queue fills and records
+are dropped, which is reported).
+
+    python -m benchmarks.logging_overhead --records 20000 --threads 8 --sink-latency-ms 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from logging.handlers import QueueListener
+
+from benchmarks.loadtest import percentile, git_revision
+from logs import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, RequestIdFilter
+
+
+class SlowFile:
+    def __init__(self, path, latency):
+        self.handle = open(path, 'w', encoding='utf-8')
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.handle.write(text)
+
+    def flush(self):
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+def run(name, args, sink):
+    logger = logging.getLogger(f'bench.{name}')
+    logger.propagate = False
+    logger.setLevel(logging.WARNING if name == 'filtered' else logging.INFO)
+    output = logging.StreamHandler(sink)
+    output.setFormatter(JsonFormatter())
+
+    listener = None
+    if name == 'direct':
+        handler = output
+    else:
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=args.queue_size))
+        if name == 'sampled':
+            handler.addFilter(SamplingFilter(f'bench.{name}=0.01'))
+        handler.addFilter(RequestIdFilter())
+        listener = QueueListener(handler.queue, output)
+        listener.start()
+    logger.addHandler(handler)
+
+    per_thread = args.records // args.threads
+    timings = [[] for _ in range(args.threads)]
+    barrier = threading.Barrier(args.threads)
+
+    def work(index):
+        barrier.wait()
+        for number in range(per_thread):
+            started = time.perf_counter()
+            logger.info(f'Webhook received: charge.success ref-{index}-{number}')
+            timings[index].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if listener:
+        listener.stop()
+    logger.removeHandler(handler)
+
+    calls = sorted(seconds for thread_timings in timings for seconds in thread_timings)
+    result = {
+        'setup': name,
+        'calls': len(calls),
+        'calls_per_second': round(len(calls) / elapsed),
+        'p50_us': round(percentile(calls, 0.50) * 1e6, 1),
+        'p99_us': round(percentile(calls, 0.99) * 1e6, 1),
+        'max_us': round(calls[-1] * 1e6, 1),
+        'dropped': getattr(handler, 'dropped', 0),
+    }
+    print(f"{name:<9} {result['calls_per_second']:>9}/s p50={result['p50_us']}us p99={result['p99_us']}us "
+          f"dropped={result['dropped']}", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--sink-latency-ms', type=float, default=0.2)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--setups', default='direct,queued,sampled,filtered')
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+
+    results = []
+    directory = tempfile.mkdtemp(prefix='foodbridge-logs-')
+    for name in args.setups.split(','):
+        sink = SlowFile(os.path.join(directory, f'{name}.log'), args.sink_latency_ms / 1000)
+        try:
+            results.append(run(name, args, sink))
+        finally:
+            sink.close()
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'records': args.records, 'threads': args.threads,
+                 'sink_latency_ms': args.sink_latency_ms, 'queue_size': args.queue_size},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Login rate versus dashboard latency under a login burst
+
+Starts the app once per password hashing concurrency limit, hammers
+/login from --login-users threads while --dashboard-users threads browse
+the buyer dashboard, and reports successful logins per second, logins
+shed with 503, and dashboard p50/p95/p99 for each limit.
+
+    python -m benchmarks.login_contention --limits 64,4,2,1 --duration 15 --output login.json
+
+A limit of 64 is effectively the old unbounded behaviour on most machines.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from benchmarks import dataset
+from benchmarks.loadtest import Recorder, summarize, prepare_dataset, wait_until_ready, git_revision
+
+
+def login_loop(base, args, recorder, stop, number):
+    email = dataset.buyer_email(number % args.buyers)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = requests.post(base + '/login', data={'email': email, 'password': dataset.BENCH_PASSWORD},
+                                     allow_redirects=False, timeout=30)
+            outcome = {302: 'ok', 503: 'rejected'}.get(response.status_code, 'error')
+        except requests.RequestException:
+            outcome = 'error'
+        recorder.record('login', time.perf_counter() - started, outcome)
+
+
+def dashboard_loop(base, args, recorder, stop, number):
+    session = requests.Session()
+    session.post(base + '/login', data={'email': dataset.buyer_email(number % args.buyers),
+                                        'password': dataset.BENCH_PASSWORD}, timeout=60)
+    page = 0
+    while not stop.is_set():
+        page += 1
+        # Vary the search so the feed cache does not answer every request
+        params = {'search': dataset.PRODUCE[page % len(dataset.PRODUCE)]} if page % 2 else {}
+        started = time.perf_counter()
+        try:
+            response = session.get(base + '/buyer_dashboard', params=params, timeout=30)
+            outcome = 'ok' if response.status_code == 200 else 'error'
+        except requests.RequestException:
+            outcome = 'error'
+        recorder.record('buyer_dashboard', time.perf_counter() - started, outcome)
+
+
+def run_limit(limit, args):
+    env = dict(os.environ, PASSWORD_HASH_CONCURRENCY=str(limit),
+               PASSWORD_HASH_QUEUE_TIMEOUT=str(args.queue_timeout))
+    base = f'http://127.0.0.1:{args.port}'
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--port', str(args.port)], env=env)
+    try:
+        wait_until_ready(base)
+        recorder = Recorder()
+        stop = threading.Event()
+        threads = [threading.Thread(target=dashboard_loop, args=(base, args, recorder, stop, number), daemon=True)
+                   for number in range(args.dashboard_users)]
+        for thread in threads:
+            thread.start()
+        # Dashboard users log in before the burst starts
+        time.sleep(args.warmup)
+
+        threads += [threading.Thread(target=login_loop, args=(base, args, recorder, stop, number), daemon=True)
+                    for number in range(args.login_users)]
+        for thread in threads[args.dashboard_users:]:
+            thread.start()
+
+        recorder.enabled = True
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        recorder.enabled = False
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for thread in threads:
+            thread.join(31)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    result = summarize(recorder, elapsed)
+    login = result['endpoints'].get('login', {})
+    dashboard = result['endpoints'].get('buyer_dashboard', {})
+    print(f"limit {limit:>3}: {login.get('ok', 0) / elapsed:7.1f} logins/s, {login.get('rejected', 0):>5} shed, "
+          f"login p95 {login.get('p95_ms')} ms | dashboard p50 {dashboard.get('p50_ms')} "
+          f"p95 {dashboard.get('p95_ms')} p99 {dashboard.get('p99_ms')} ms", file=sys.stderr)
+    return dict(hash_concurrency=limit, logins_per_second=round(login.get('ok', 0) / elapsed, 2), **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file in a temporary directory')
+    parser.add_argument('--limits', default='64,4,2,1', help='PASSWORD_HASH_CONCURRENCY values to compare')
+    parser.add_argument('--queue-timeout', type=float, default=2.0)
+    parser.add_argument('--login-users', type=int, default=32)
+    parser.add_argument('--dashboard-users', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--farmers', type=int, default=20)
+    parser.add_argument('--buyers', type=int, default=100)
+    parser.add_argument('--listings', type=int, default=5000)
+    parser.add_argument('--payments', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reseed', action='store_true')
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+
+    if not args.database_url:
+        import tempfile
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='foodbridge-bench-'), 'bench.db')}"
+    os.environ['DATABASE_URL'] = args.database_url
+    # This measures the hashing gate, not the per-client limits in front of it
+    os.environ.setdefault('RATE_LIMITS', 'off')
+    counts, _ = prepare_dataset(args)
+
+    results = [run_limit(int(limit), args) for limit in args.limits.split(',') if limit.strip()]
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'dataset': counts,
+                 'password_hash_method': os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'),
+                 'login_users': args.login_users, 'dashboard_users': args.dashboard_users,
+                 'queue_timeout': args.queue_timeout, 'duration_seconds': args.duration},
+        'levels': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Read-replica routing against two SQLite files that diverge
+
+Seeds a primary database, copies it to a "replica" file and then changes
+each copy behind the other's back, so every response shows which one
+served it. The app runs in process with DATABASE_REPLICA_URLS pointing at
+the copy (see replicas.py) and the checks are:
+
+    routing          a @replica_reads view reads the replica's rows
+    read-your-writes after the farmer creates a listing, their reads go to
+                     the primary, and back to the replica once
+                     READ_YOUR_WRITES_SECONDS have passed
+    pending-recheck  a payment still pending on the replica but settled on
+                     the primary is reported settled; one settled on the
+                     replica is taken from the replica
+    lag-fallback     a replica reporting more than REPLICA_MAX_LAG_SECONDS
+                     of lag, or failing its check, is skipped for the
+                     primary, and used again once it recovers
+
+Exits non-zero if any check fails.
+
+    python -m benchmarks.replica_routing --read-your-writes-seconds 1
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PRIMARY_ONLY = 'primary-only produce'
+REPLICA_ONLY = 'replica-only produce'
+
+
+def _add_listing(engine, supplier_id, item_name):
+    from ids import new_id
+    from models import Listing
+    with engine.begin() as connection:
+        connection.execute(Listing.__table__.insert().values(
+            id=new_id(), item_name=item_name, quantity='1 kg', quantity_amount=1, quantity_unit='kg',
+            contact='bench', is_available=True, supplier_id=supplier_id))
+
+
+def _set_status(engine, reference, status):
+    from models import Payment
+    with engine.begin() as connection:
+        connection.execute(Payment.__table__.update().where(Payment.transaction_id == reference).values(
+            status=status))
+
+
+def _sign_in(client, user):
+    with client.session_transaction() as session:
+        session['user_id'] = user['id']
+        session['user_name'] = user['name']
+        session['user_role'] = user['role']
+
+
+def _own_listings(client):
+    response = client.get('/api/listings?scope=mine&limit=100')
+    return {listing['item_name'] for listing in response.get_json()['listings']}
+
+
+def _status(client, reference):
+    return client.get(f'/api/transaction-status/{reference}').get_json().get('status')
+
+
+def run(args, directory):
+    primary_path = os.path.join(directory, 'primary.db')
+    replica_path = os.path.join(directory, 'replica.db')
+    os.environ.update(DATABASE_URL=f'sqlite:///{primary_path}', AUTO_CREATE_SCHEMA='1', RATE_LIMITS='off',
+                      READ_YOUR_WRITES_SECONDS=str(args.read_your_writes_seconds),
+                      REPLICA_MAX_LAG_SECONDS=str(args.max_lag_seconds))
+    os.environ.pop('DATABASE_REPLICA_URLS', None)
+
+    from app import create_app, create_schema, db
+    from models import Payment, User
+    from benchmarks import dataset
+
+    # Seed the primary, then start the replica as an exact copy of it
+    app = create_app()
+    with app.app_context():
+        create_schema()
+        dataset.seed(farmers=2, buyers=2, listings=20, payments=40, seed=args.seed)
+        farmer = User.query.filter_by(email=dataset.farmer_email(0)).one()
+        farmer = {'id': farmer.id, 'name': farmer.name, 'role': farmer.role}
+        pending = Payment.query.filter_by(status='pending').order_by(Payment.created_at).limit(2).all()
+        if len(pending) < 2:
+            raise SystemExit('The seeded dataset has fewer than two pending payments; try another --seed')
+        references = []
+        for payment in pending:
+            buyer = db.session.get(User, payment.buyer_id)
+            references.append((payment.transaction_id, {'id': buyer.id, 'name': buyer.name, 'role': buyer.role}))
+        db.session.remove()
+        db.engine.dispose()
+    shutil.copyfile(primary_path, replica_path)
+
+    os.environ['DATABASE_REPLICA_URLS'] = f'sqlite:///{replica_path}'
+    app = create_app()
+    app.config['REPLICA_LAG_CHECK_SECONDS'] = 0
+    import replicas
+
+    results = {}
+    with app.app_context():
+        primary_engine, replica_engine = db.engines[None], db.engines['replica_0']
+        _add_listing(primary_engine, farmer['id'], PRIMARY_ONLY)
+        _add_listing(replica_engine, farmer['id'], REPLICA_ONLY)
+        (settled_on_primary, buyer_a), (settled_on_replica, buyer_b) = references
+        _set_status(primary_engine, settled_on_primary, 'completed')
+        _set_status(replica_engine, settled_on_replica, 'failed')
+
+    client = app.test_client()
+    _sign_in(client, farmer)
+
+    items = _own_listings(client)
+    results['routing'] = REPLICA_ONLY in items and PRIMARY_ONLY not in items
+
+    created = client.post('/create_listing', data={'item_name': 'just listed', 'quantity': '5 kg', 'price': '10',
+                                                   'currency': 'USD', 'contact': 'bench', 'is_available': 'on'})
+    right_after = _own_listings(client)
+    time.sleep(args.read_your_writes_seconds + 0.2)
+    later = _own_listings(client)
+    results['read-your-writes'] = (created.status_code == 302 and {'just listed', PRIMARY_ONLY} <= right_after
+                                   and REPLICA_ONLY in later and 'just listed' not in later)
+
+    buyer_client = app.test_client()
+    _sign_in(buyer_client, buyer_a)
+    from_primary = _status(buyer_client, settled_on_primary)
+    _sign_in(buyer_client, buyer_b)
+    from_replica = _status(buyer_client, settled_on_replica)
+    results['pending-recheck'] = from_primary == 'completed' and from_replica == 'failed'
+
+    def lagging(engine):
+        return args.max_lag_seconds + 60
+
+    def unreachable(engine):
+        raise ConnectionError('replica down')
+
+    healthy_lag = replicas.health.lag
+    try:
+        replicas.health.lag = lagging
+        lagged = _own_listings(client)
+        replicas.health.lag = unreachable
+        down = _own_listings(client)
+    finally:
+        replicas.health.lag = healthy_lag
+    recovered = _own_listings(client)
+    results['lag-fallback'] = (PRIMARY_ONLY in lagged and REPLICA_ONLY not in lagged and PRIMARY_ONLY in down
+                               and REPLICA_ONLY in recovered)
+
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--read-your-writes-seconds', type=float, default=1.0)
+    parser.add_argument('--max-lag-seconds', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args, directory)
+
+    for name, ok in results.items():
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
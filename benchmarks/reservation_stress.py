@@ -0,0 +1,218 @@
+"""
+Checkout race on a single listing
+
+Logs in --buyers buyers, then has all of them start checkout on the same
+listing at the same instant, several rounds in a row:
+
+    race         exactly one buyer gets a payment link, the rest 409
+    expired      after the winner's hold lapses, exactly one new winner
+    released     after charge.failed for that winner, exactly one new winner
+    sold         after charge.success, every buyer gets 404
+
+After every round the fake Paystack must have seen exactly as many
+initializations as there were winners, and the listing at most one
+completed payment. Exits non-zero if any of that does not hold.
+
+    python -m benchmarks.reservation_stress --buyers 200 --hold-seconds 3
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks import dataset
+from benchmarks.fake_paystack import FakePaystack
+from benchmarks.loadtest import percentile, prepare_dataset, wait_until_ready, git_revision
+
+SECRET_KEY = 'bench-secret-key'
+
+
+def login(args, number):
+    session = requests.Session()
+    response = session.post(args.target + '/login', allow_redirects=False, timeout=args.request_timeout,
+                            data={'email': dataset.buyer_email(number), 'password': dataset.BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit(f'Login of {dataset.buyer_email(number)} failed with {response.status_code}')
+    return session
+
+
+def race(args, sessions, listing):
+    """Every session calls /paystack/initiate at once; returns [(status, seconds, reference)]"""
+    barrier = threading.Barrier(len(sessions))
+    results = [None] * len(sessions)
+    for session in sessions:
+        # Drop keep-alive connections the server may have closed while we waited between rounds
+        session.close()
+
+    def attempt(index, session):
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            response = session.post(args.target + '/paystack/initiate', timeout=args.request_timeout,
+                                    json={'listing_id': listing['id'], 'amount': listing['price'],
+                                          'currency': listing['currency']})
+            status = response.status_code
+            reference = response.json().get('reference') if status == 200 else None
+        except requests.RequestException:
+            status, reference = 'error', None
+        results[index] = (status, time.perf_counter() - started, reference)
+
+    threads = [threading.Thread(target=attempt, args=(index, session)) for index, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def send_webhook(args, reference, success):
+    payload = json.dumps({
+        'event': 'charge.success' if success else 'charge.failed',
+        'data': {'id': int(time.time() * 1000), 'reference': reference, 'status': 'success' if success else 'failed'}
+    }).encode('utf-8')
+    signature = hmac.new(SECRET_KEY.encode('utf-8'), payload, hashlib.sha512).hexdigest()
+    response = requests.post(args.target + '/paystack/webhook', data=payload, timeout=args.request_timeout,
+                             headers={'Content-Type': 'application/json', 'X-Paystack-Signature': signature})
+    if response.status_code != 200:
+        raise SystemExit(f'Webhook for {reference} failed with {response.status_code}')
+
+
+def summarize_round(name, results, initializations, expected_winners, expected_loser_status):
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    winners = [reference for status, _, reference in results if status == 200]
+    losers = sorted(seconds for status, seconds, _ in results if status != 200)
+    winner_seconds = [seconds for status, seconds, _ in results if status == 200]
+
+    problems = []
+    if len(winners) != expected_winners:
+        problems.append(f'{len(winners)} winners, expected {expected_winners}')
+    if initializations != expected_winners:
+        problems.append(f'{initializations} Paystack initializations, expected {expected_winners}')
+    unexpected = len(results) - len(winners) - statuses.get(str(expected_loser_status), 0)
+    if unexpected:
+        problems.append(f'{unexpected} responses other than 200/{expected_loser_status}')
+
+    summary = {
+        'round': name,
+        'statuses': statuses,
+        'paystack_initializations': initializations,
+        'winner_ms': round(winner_seconds[0] * 1000, 1) if winner_seconds else None,
+        'loser_p50_ms': round(percentile(losers, 0.50) * 1000, 1) if losers else None,
+        'loser_p95_ms': round(percentile(losers, 0.95) * 1000, 1) if losers else None,
+        'loser_max_ms': round(losers[-1] * 1000, 1) if losers else None,
+        'problems': problems
+    }
+    print(f"{name:<9} {statuses} initializations={initializations} winner={summary['winner_ms']}ms "
+          f"losers p50={summary['loser_p50_ms']}ms p95={summary['loser_p95_ms']}ms"
+          + (f"  FAILED: {'; '.join(problems)}" if problems else ''), file=sys.stderr)
+    return summary, winners
+
+
+def completed_payments(listing_id):
+    from app import create_app
+    from models import Payment
+    app = create_app()
+    with app.app_context():
+        return Payment.query.filter_by(listing_id=listing_id, status='completed').count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file in a temporary directory')
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--hold-seconds', type=int, default=3)
+    parser.add_argument('--provider-latency', type=float, default=0.5,
+                        help='Seconds per Paystack call; losers should not pay it')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn only')
+    parser.add_argument('--threads', type=int, default=16, help='gunicorn only')
+    parser.add_argument('--port', type=int, default=5059)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--request-timeout', type=float, default=60.0)
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+    args.target = f'http://127.0.0.1:{args.port}'
+    # prepare_dataset() settings: every buyer needed, a handful of listings to race for
+    args.farmers, args.listings, args.payments, args.reseed = 2, 20, 0, True
+
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='foodbridge-bench-'), 'bench.db')}"
+    os.environ.update(DATABASE_URL=args.database_url, PAYSTACK_SECRET_KEY=SECRET_KEY, LOG_LEVEL='WARNING',
+                      RESERVATION_HOLD_SECONDS=str(args.hold_seconds),
+                      # Hundreds of logins are setup, not what is measured
+                      PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', PASSWORD_HASH_QUEUE_TIMEOUT='60', RATE_LIMITS='off',
+                      PAYSTACK_READ_TIMEOUT=str(args.provider_latency * 5 + 5), PAYSTACK_BREAKER_THRESHOLD='1000000')
+
+    rounds = []
+    with FakePaystack(latency=args.provider_latency) as fake:
+        os.environ['PAYSTACK_BASE_URL'] = fake.url
+        counts, targets = prepare_dataset(args)
+        listing = next(item for item in targets['available'] if item['price'])
+
+        def initializations():
+            with fake.server.lock:
+                return sum(1 for payload in fake.server.transactions.values()
+                           if payload.get('metadata', {}).get('listing_id') == listing['id'])
+
+        server = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--server', args.server,
+                                   '--port', str(args.port), '--workers', str(args.workers),
+                                   '--threads', str(args.threads)], env=dict(os.environ))
+        try:
+            wait_until_ready(args.target)
+            print(f'Logging in {args.buyers} buyers...', file=sys.stderr)
+            sessions = [login(args, number) for number in range(args.buyers)]
+
+            seen = 0
+            for name, expected_winners, loser_status in (('race', 1, 409), ('expired', 1, 409),
+                                                         ('released', 1, 409), ('sold', 0, 404)):
+                if name == 'expired':
+                    time.sleep(args.hold_seconds + 1)
+                elif name == 'released':
+                    send_webhook(args, winners[0], success=False)
+                elif name == 'sold':
+                    send_webhook(args, winners[0], success=True)
+
+                results = race(args, sessions, listing)
+                total = initializations()
+                summary, winners = summarize_round(name, results, total - seen, expected_winners, loser_status)
+                seen = total
+                rounds.append(summary)
+                if summary['problems'] and not winners and name != 'sold':
+                    break
+        finally:
+            server.terminate()
+            server.wait()
+
+    completed = completed_payments(listing['id'])
+    if completed > 1:
+        rounds.append({'round': 'oversell', 'problems': [f'{completed} completed payments for one listing']})
+        print(f'FAILED: {completed} completed payments for one listing', file=sys.stderr)
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'dataset': counts, 'buyers': args.buyers,
+                 'hold_seconds': args.hold_seconds, 'provider_latency_seconds': args.provider_latency,
+                 'server': args.server},
+        'rounds': rounds,
+        'ok': not any(item['problems'] for item in rounds)
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
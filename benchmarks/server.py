@@ -0,0 +1,45 @@
+"""
+Serve the app for a benchmark run
+
+    python -m benchmarks.server --port 5055
+
+Uses a threaded Werkzeug server with request logging off; with
+--server gunicorn the app runs under gunicorn instead (closer to
+production, requires gunicorn).
+"""
+import argparse
+import logging
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn only')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn only')
+    parser.add_argument('--worker-class', default='gthread', help='gunicorn only: sync, gthread or gevent')
+    args = parser.parse_args()
+
+    if args.server == 'gunicorn':
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '--bind', f'{args.host}:{args.port}',
+                                   '--workers', str(args.workers),
+                                   '--threads', str(args.threads if args.worker_class == 'gthread' else 1),
+                                   '--worker-class', args.worker_class, '--log-level', 'warning', 'main:app'])
+
+    from werkzeug.serving import make_server
+    from app import create_app
+    app = create_app()
+
+    # Per-request logging would dominate the measurements, whatever LOG_LEVEL says
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server(args.host, args.port, app, threaded=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Dashboard latency while checkouts wait on a slow payment provider
+
+For each gunicorn worker class, measures buyer dashboard latency twice:
+alone, then while --initiators users keep calling /paystack/initiate
+against a fake Paystack that takes --provider-latency seconds per call.
+With sync workers the dashboards queue behind the slow calls; with
+gthread or gevent workers they should stay flat.
+
+    python -m benchmarks.slow_provider --modes sync,gthread,gevent --provider-latency 2 --output slow.json
+
+Requires gunicorn (and gevent for the gevent mode).
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_paystack import FakePaystack
+from benchmarks.loadtest import Recorder, VirtualUser, summarize, prepare_dataset, wait_until_ready, git_revision
+
+SECRET_KEY = 'bench-secret-key'
+
+
+def measure(users, actions, args, stop_after):
+    """Run each (user, action) pair in its own loop for stop_after seconds and return the summary"""
+    recorder = Recorder()
+    stop = threading.Event()
+
+    def loop(user, action):
+        user.recorder = recorder
+        while not stop.is_set():
+            getattr(user, action)()
+
+    threads = [threading.Thread(target=loop, args=pair, daemon=True) for pair in zip(users, actions)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recorder.enabled = True
+    started = time.perf_counter()
+    time.sleep(stop_after)
+    recorder.enabled = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join(args.request_timeout + 1)
+    return summarize(recorder, elapsed)
+
+
+def run_mode(mode, args, targets):
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--server', 'gunicorn', '--port',
+                               str(args.port), '--workers', str(args.workers), '--threads', str(args.threads),
+                               '--worker-class', mode], env=dict(os.environ))
+    try:
+        wait_until_ready(args.target)
+        # Log everyone in before measuring so logins don't skew the dashboards
+        setup = Recorder()
+        browsers = [VirtualUser(number, args, targets, setup) for number in range(args.dashboard_users)]
+        initiators = [VirtualUser(1000 + number, args, targets, setup) for number in range(args.initiators)]
+
+        alone = measure(browsers, ['buyer_dashboard'] * len(browsers), args, args.duration)
+        contended = measure(browsers + initiators,
+                            ['buyer_dashboard'] * len(browsers) + ['initiate'] * len(initiators),
+                            args, args.duration)
+    finally:
+        # SIGINT is gunicorn's quick shutdown; SIGTERM would wait out in-flight slow calls
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    before = alone['endpoints'].get('buyer_dashboard', {})
+    during = contended['endpoints'].get('buyer_dashboard', {})
+    initiate = contended['endpoints'].get('initiate', {})
+    print(f"{mode:<8} dashboard p95 {before.get('p95_ms')} -> {during.get('p95_ms')} ms "
+          f"(p99 {before.get('p99_ms')} -> {during.get('p99_ms')}), "
+          f"{initiate.get('throughput_rps', 0)} initiations/s, {during.get('errors', 0)} dashboard errors",
+          file=sys.stderr)
+    return {'worker_class': mode, 'dashboard_alone': alone, 'with_slow_initiations': contended}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file in a temporary directory')
+    parser.add_argument('--modes', default='sync,gthread,gevent')
+    parser.add_argument('--provider-latency', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gthread worker')
+    parser.add_argument('--initiators', type=int, default=16)
+    parser.add_argument('--dashboard-users', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--port', type=int, default=5058)
+    parser.add_argument('--farmers', type=int, default=20)
+    parser.add_argument('--buyers', type=int, default=100)
+    parser.add_argument('--listings', type=int, default=5000)
+    parser.add_argument('--payments', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reseed', action='store_true')
+    parser.add_argument('--request-timeout', type=float, default=60.0)
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+    args.target = f'http://127.0.0.1:{args.port}'
+    args.secret_key = SECRET_KEY
+
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='foodbridge-bench-'), 'bench.db')}"
+    os.environ.update(DATABASE_URL=args.database_url, PAYSTACK_SECRET_KEY=SECRET_KEY, LOG_LEVEL='WARNING',
+                      # Checkouts from one IP would be refused before they reach the slow provider
+                      RATE_LIMITS='off',
+                      # The provider is slow on purpose; don't let the client give up or trip the breaker
+                      PAYSTACK_READ_TIMEOUT=str(args.provider_latency * 5), PAYSTACK_BREAKER_THRESHOLD='1000000')
+
+    with FakePaystack(latency=args.provider_latency) as fake:
+        os.environ['PAYSTACK_BASE_URL'] = fake.url
+        counts, targets = prepare_dataset(args)
+        results = [run_mode(mode.strip(), args, targets) for mode in args.modes.split(',') if mode.strip()]
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'dataset': counts,
+                 'provider_latency_seconds': args.provider_latency, 'workers': args.workers,
+                 'threads': args.threads, 'initiators': args.initiators,
+                 'dashboard_users': args.dashboard_users, 'duration_seconds': args.duration},
+        'modes': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
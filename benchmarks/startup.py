@@ -0,0 +1,117 @@
+"""
+Cold start benchmark
+
+Measures, over several fresh interpreter processes:
+    import_ms          importing main (builds the app)
+    first_response_ms  process spawn until the first HTTP response from
+                       the app (interpreter start, imports, app build,
+                       first request), as on a serverless cold start
+and lists the slowest imports of one run (python -X importtime).
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.loadtest import git_revision
+
+IMPORT_SNIPPET = 'import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)'
+
+
+def measure_import(env):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET], env=env, text=True,
+                                     stderr=subprocess.DEVNULL)
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def measure_first_response(env, port, path):
+    url = f'http://127.0.0.1:{port}{path}'
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.server', '--port', str(port)], env=env,
+                              stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                requests.get(url, timeout=5)
+                return (time.perf_counter() - started) * 1000
+            except requests.ConnectionError:
+                if server.poll() is not None:
+                    raise SystemExit('App exited during start-up')
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def slowest_imports(env, count):
+    """Top modules by cumulative import time for one `import main`"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], env=env, text=True,
+                            capture_output=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only modules imported directly by main/app/routes (two levels of nesting)
+        if len(name) - len(name.lstrip()) <= 3:
+            modules.append((name.strip(), int(cumulative) / 1000))
+    return sorted(modules, key=lambda item: item[1], reverse=True)[:count]
+
+
+def summarize(values):
+    return {
+        'median_ms': round(statistics.median(values), 1),
+        'min_ms': round(min(values), 1),
+        'max_ms': round(max(values), 1),
+        'runs': [round(value, 1) for value in values]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a SQLite file in a temporary directory')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--path', default='/login', help='Path requested for time-to-first-response')
+    parser.add_argument('--output', help='Write results JSON here')
+    args = parser.parse_args()
+
+    database_url = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='foodbridge-bench-'), 'bench.db')}"
+    env = dict(os.environ, DATABASE_URL=database_url, LOG_LEVEL='WARNING')
+
+    import_times = [measure_import(env) for _ in range(args.runs)]
+    first_response_times = [measure_first_response(env, args.port, args.path) for _ in range(args.runs)]
+    imports = slowest_imports(env, 10)
+
+    revision, dirty = git_revision()
+    report = {
+        'meta': {'git_revision': revision, 'git_dirty': dirty, 'python': sys.version.split()[0],
+                 'database': database_url.split(':', 1)[0], 'path': args.path},
+        'import': summarize(import_times),
+        'first_response': summarize(first_response_times),
+        'slowest_imports_ms': dict(imports)
+    }
+
+    print(f"import main:     median {report['import']['median_ms']} ms", file=sys.stderr)
+    print(f"first response:  median {report['first_response']['median_ms']} ms", file=sys.stderr)
+    for name, milliseconds in imports:
+        print(f"  {name:<30}{milliseconds:>8.1f} ms", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
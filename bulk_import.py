@@ -0,0 +1,143 @@
+"""
+Streaming bulk import of listings from CSV or NDJSON
+
+Rows are read one at a time from the upload stream, validated with the
+same rules as create_listing and inserted in chunks with a single
+executemany INSERT and one commit per chunk. Invalid rows are reported
+with their line number and skipped; they never abort the import. Memory
+stays constant: only one chunk and a capped list of errors are held.
+
+CSV needs a header row; recognised columns are item_name, quantity,
+price, currency, contact and is_available (missing is_available means
+available). NDJSON has one JSON object per line with the same keys.
+"""
+import codecs
+import csv
+import json
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+from app import db
+from models import Listing
+from ids import new_id
+from validation import validate_listing, ListingValidationError
+from cache import invalidate_listings
+from facets import count_inserted
+from rates import applied_rates, base_price
+from waitlist import notify_matches_many
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+class ImportResult:
+    """Counts and a capped sample of per-row errors"""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+def detect_format(filename, declared=None):
+    """'csv' or 'ndjson' from an explicit format or the file extension"""
+    if declared:
+        return declared.lower()
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return 'csv'
+
+def iter_rows(binary_stream, file_format):
+    """Yield (line number, dict) for each row; parse errors are yielded as (line, Exception)"""
+    text_stream = codecs.getreader('utf-8-sig')(binary_stream, errors='replace')
+
+    if file_format == 'ndjson':
+        for line_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('Each line must be a JSON object')
+            except ValueError as e:
+                yield line_number, ListingValidationError(f'Invalid JSON: {e}')
+                continue
+            yield line_number, row
+        return
+
+    if file_format != 'csv':
+        raise ValueError(f'Unsupported import format: {file_format}')
+
+    reader = csv.DictReader(text_stream)
+    for row in reader:
+        # reader.line_num is the physical line the row ended on (header is line 1)
+        yield reader.line_num, {key.strip().lower(): (value or '').strip()
+                                for key, value in row.items() if key is not None}
+
+def import_listings(binary_stream, supplier_id, file_format='csv', chunk_size=DEFAULT_CHUNK_SIZE,
+                    notify_waiting_list=True):
+    """Import listings for one supplier from a binary stream and return an ImportResult"""
+    result = ImportResult()
+    chunk = []
+
+    for line_number, row in iter_rows(binary_stream, file_format):
+        if isinstance(row, Exception):
+            result.add_error(line_number, str(row))
+            continue
+        try:
+            values = validate_listing(row, default_available=True)
+        except ListingValidationError as e:
+            result.add_error(line_number, str(e))
+            continue
+
+        chunk.append((line_number, values))
+        if len(chunk) >= chunk_size:
+            _flush(chunk, supplier_id, result, notify_waiting_list)
+            chunk = []
+
+    if chunk:
+        _flush(chunk, supplier_id, result, notify_waiting_list)
+
+    if result.imported:
+        invalidate_listings()
+    return result
+
+def _flush(chunk, supplier_id, result, notify_waiting_list):
+    """Insert one chunk with a single executemany and commit it"""
+    now = datetime.utcnow()
+    rows = [dict(values, id=new_id(), supplier_id=supplier_id, created_at=now)
+            for _, values in chunk]
+    try:
+        rates = applied_rates()
+        for row in rows:
+            row['price_base'] = base_price(rates, row['price'], row['currency'])
+        db.session.execute(Listing.__table__.insert(), rows)
+        count_inserted(rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error importing listings chunk: {str(e)}")
+        for line_number, _ in chunk:
+            result.add_error(line_number, 'Database error, row not imported')
+        return
+
+    result.imported += len(rows)
+
+    if notify_waiting_list:
+        try:
+            notify_matches_many([SimpleNamespace(**row) for row in rows])
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error notifying waiting list after import: {str(e)}")
@@ -0,0 +1,243 @@
+"""
+Read-through cache for the available-listings feed and search results
+
+Entries are keyed by a feed version. Writes that change what buyers see
+(create/update/delete listing, a listing sold through the webhook) call
+invalidate_listings(), which bumps the version, so stale entries are never
+read again and age out through LRU/TTL eviction.
+
+The default backend is in-process. Writes from another process (other
+workers, the webhook worker, CLI commands) don't reach its version, so it
+also moves on by itself every CACHE_TTL, which bounds how stale a page can
+be, and the feed sends no ETag/Last-Modified from it. Set CACHE_URL to a
+redis:// URL to share the cache and the version across processes (requires
+the optional `redis` package); the version and its timestamp then back the
+ETag/Last-Modified headers on the feed.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 1024
+
+_MISSING = object()
+# Named tuples that cached values may contain, by name (see cached_type)
+_TUPLE_TYPES = {}
+
+def cached_type(cls):
+    """Register a namedtuple class so RedisCache can store and rebuild it"""
+    _TUPLE_TYPES[cls.__name__] = cls
+    return cls
+
+def _encode(value):
+    """JSON-safe form of a cached value, tagging the types JSON lacks"""
+    if isinstance(value, SimpleNamespace):
+        return {'__ns__': {key: _encode(item) for key, item in vars(value).items()}}
+    if isinstance(value, tuple):
+        items = [_encode(item) for item in value]
+        if type(value).__name__ in _TUPLE_TYPES:
+            return {'__nt__': type(value).__name__, 'items': items}
+        return {'__tuple__': items}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f'Cannot cache a {type(value).__name__}')
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if '__ns__' in value:
+        return SimpleNamespace(**{key: _decode(item) for key, item in value['__ns__'].items()})
+    if '__nt__' in value:
+        return _TUPLE_TYPES[value['__nt__']](*[_decode(item) for item in value['items']])
+    if '__tuple__' in value:
+        return tuple(_decode(item) for item in value['__tuple__'])
+    if '__decimal__' in value:
+        return Decimal(value['__decimal__'])
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__date__' in value:
+        return date.fromisoformat(value['__date__'])
+    return {key: _decode(item) for key, item in value.items()}
+
+class LRUCache:
+    """Thread-safe in-process cache with LRU eviction and per-entry TTL"""
+
+    # Other processes can't bump this version, so it can't back validators
+    shared = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        self._last_modified = datetime.now(timezone.utc)
+        self._bumped_at = time.monotonic()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self):
+        with self._lock:
+            # Expire the version like an entry, so changes made elsewhere show within the TTL
+            if time.monotonic() - self._bumped_at >= self.ttl:
+                self._bump()
+            return self._version, self._last_modified
+
+    def bump_version(self):
+        with self._lock:
+            self._bump()
+
+    def _bump(self):
+        self._version += 1
+        self._last_modified = datetime.now(timezone.utc)
+        self._bumped_at = time.monotonic()
+        # Entries under older versions are unreachable now; free them right away
+        self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class RedisCache:
+    """
+    Shared cache in Redis; TTL is enforced by Redis and eviction by its maxmemory policy
+    Values are stored as JSON, never pickled, so write access to Redis can't run code here
+    """
+
+    shared = True
+    VERSION_KEY = 'foodbridge:listings:version'
+    MODIFIED_KEY = 'foodbridge:listings:modified'
+
+    def __init__(self, url, ttl=DEFAULT_TTL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points at Redis but the 'redis' package is not installed")
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(f'foodbridge:cache:{key}')
+        return _MISSING if raw is None else _decode(json.loads(raw))
+
+    def set(self, key, value):
+        self._client.set(f'foodbridge:cache:{key}', json.dumps(_encode(value)), ex=self.ttl)
+
+    def version(self):
+        version, modified = self._client.mget(self.VERSION_KEY, self.MODIFIED_KEY)
+        last_modified = datetime.fromtimestamp(float(modified), timezone.utc) if modified else \
+            datetime.fromtimestamp(0, timezone.utc)
+        return int(version or 0), last_modified
+
+    def bump_version(self):
+        pipeline = self._client.pipeline()
+        pipeline.incr(self.VERSION_KEY)
+        pipeline.set(self.MODIFIED_KEY, time.time())
+        pipeline.execute()
+
+    def clear(self):
+        self.bump_version()
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Return the process-wide cache backend, creating it on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = os.environ.get('CACHE_URL', '')
+                ttl = int(os.environ.get('CACHE_TTL', DEFAULT_TTL))
+                if url.startswith(('redis://', 'rediss://')):
+                    _backend = RedisCache(url, ttl=ttl)
+                else:
+                    _backend = LRUCache(int(os.environ.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)), ttl=ttl)
+    return _backend
+
+def set_backend(backend):
+    """Replace the process-wide backend (e.g. with a custom shared cache; set `shared = True` on it for ETags)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def listings_state():
+    """(version, last modified) of the available-listings feed"""
+    try:
+        return get_backend().version()
+    except Exception as e:
+        logging.error(f"Cache unavailable: {str(e)}")
+        return None, None
+
+def validators_shared():
+    """True if every process sees the feed version, so it can back ETag/Last-Modified"""
+    return getattr(get_backend(), 'shared', False)
+
+def invalidate_listings():
+    """Call after any committed write that changes available listings"""
+    try:
+        get_backend().bump_version()
+    except Exception as e:
+        logging.error(f"Error invalidating listings cache: {str(e)}")
+
+def feed_key(version, *parts):
+    """Stable key for one cached view of the feed at a given version"""
+    return hashlib.sha1(repr((version,) + parts).encode('utf-8')).hexdigest()
+
+def get_or_load(version, parts, loader):
+    """Read-through: return the cached value for parts at version, calling loader on a miss"""
+    if version is None:
+        return loader()
+
+    key = feed_key(version, *parts)
+    backend = get_backend()
+    try:
+        value = backend.get(key)
+    except Exception as e:
+        logging.error(f"Cache read failed: {str(e)}")
+        return loader()
+
+    if value is _MISSING:
+        value = loader()
+        try:
+            backend.set(key, value)
+        except Exception as e:
+            logging.error(f"Cache write failed: {str(e)}")
+    return value
@@ -0,0 +1,211 @@
+import time
+import click
+from flask import Blueprint
+from app import create_schema, db
+import webhooks
+from bulk_import import import_listings, detect_format, DEFAULT_CHUNK_SIZE
+from models import User
+from exports import EXPORT_FORMATS, parse_date, payments_export_statements, iter_export
+from query_plans import check_query_plans
+import reconcile
+import archive
+import sales
+import facets
+import rates
+import id_migration
+from cache import invalidate_listings
+
+# Commands are registered at the top level: `flask migrate`, `flask webhooks worker`, ...
+bp = Blueprint('commands', __name__, cli_group=None)
+
+@bp.cli.command('migrate')
+def migrate_command():
+    """Create missing tables and apply pending schema migrations (run on every deploy)"""
+    applied = create_schema()
+    if applied:
+        for name in applied:
+            click.echo(f"Applied {name}")
+    else:
+        click.echo("Database is up to date")
+    if id_migration.pending_tables(db.engine):
+        click.echo("Keys are still stored as text; convert them with `flask migrate-ids`")
+
+@bp.cli.command('migrate-ids')
+@click.option('--phase', 'phases', multiple=True, type=click.Choice(id_migration.PHASES),
+              help='Run only this phase (repeatable); default all of them in order')
+@click.option('--batch-size', type=int, default=id_migration.DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches')
+@click.option('--status', 'show_status', is_flag=True, help='Show what is left to convert and exit')
+def migrate_ids_command(phases, batch_size, pause, show_status):
+    """Convert text keys to native/16-byte UUID columns online, in resumable batches"""
+    if show_status:
+        pending = id_migration.status(db.engine)
+        if not pending:
+            click.echo("All keys are stored as UUIDs")
+        for table, state in pending.items():
+            click.echo(f"{table}: {', '.join(state['columns'])} rows_done={state['rows_done']} "
+                       f"backfilled={'yes' if state['backfilled'] else 'no'}")
+        return
+    try:
+        converted = id_migration.run(db.engine, phases=phases or id_migration.PHASES, batch_size=batch_size,
+                                     pause=pause, echo=click.echo)
+    except id_migration.IdMigrationError as e:
+        raise click.ClickException(str(e))
+    if converted:
+        click.echo(f"Converted {len(converted)} tables")
+    elif not id_migration.pending_tables(db.engine):
+        click.echo("All keys are stored as UUIDs")
+
+@bp.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print the full plan for every query')
+def check_query_plans_command(verbose):
+    """Fail if any route query sequentially scans a large table"""
+    failures = 0
+    for description, (plan, scanned) in check_query_plans().items():
+        if scanned:
+            failures += 1
+            click.echo(f"FAIL {description}: sequential scan on {', '.join(sorted(set(scanned)))}")
+        else:
+            click.echo(f"ok   {description}")
+        if verbose or scanned:
+            click.echo(plan)
+
+    if failures:
+        raise SystemExit(1)
+
+@bp.cli.group('webhooks')
+def webhooks_group():
+    """Queued Paystack webhook processing"""
+
+@webhooks_group.command('worker')
+@click.option('--batch-size', default=webhooks.DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--poll-interval', default=webhooks.DEFAULT_POLL_INTERVAL, show_default=True)
+@click.option('--once', is_flag=True, help='Exit once the queue is drained')
+def webhooks_worker_command(batch_size, poll_interval, once):
+    """Apply queued webhook events in batches"""
+    webhooks.run_worker(batch_size=batch_size, poll_interval=poll_interval, once=once)
+
+@webhooks_group.command('replay')
+@click.argument('event_keys', nargs=-1)
+def webhooks_replay_command(event_keys):
+    """Requeue failed events (all of them, or only EVENT_KEYS)"""
+    count = webhooks.replay_failed(list(event_keys) or None)
+    click.echo(f"Requeued {count} event(s)")
+
+@webhooks_group.command('stats')
+def webhooks_stats_command():
+    """Show queue depth, failed events and lag"""
+    metrics = webhooks.queue_metrics()
+    click.echo(f"pending: {metrics['pending']}")
+    click.echo(f"failed: {metrics['failed']}")
+    click.echo(f"lag_seconds: {metrics['lag_seconds']:.1f}")
+
+@bp.cli.command('import-listings')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--supplier-email', required=True, help='Email of the farmer who owns the listings')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+def import_listings_command(path, supplier_email, file_format, chunk_size):
+    """Bulk import listings from a CSV or NDJSON file"""
+    supplier = User.query.filter_by(email=supplier_email).first()
+    if not supplier:
+        raise click.ClickException(f"No user with email {supplier_email}")
+
+    with open(path, 'rb') as handle:
+        result = import_listings(handle, supplier.id, detect_format(path, file_format), chunk_size=chunk_size)
+
+    click.echo(f"Imported {result.imported} listing(s), {result.failed} row(s) failed")
+    for error in result.errors:
+        click.echo(f"  line {error['line']}: {error['error']}")
+    if result.failed > len(result.errors):
+        click.echo(f"  ... and {result.failed - len(result.errors)} more")
+
+@bp.cli.command('rebuild-facets')
+def rebuild_facets_command():
+    """Recount the feed's currency/unit facets from the listings table"""
+    counts = facets.rebuild()
+    invalidate_listings()
+    for facet, values in counts.items():
+        click.echo(f"{facet}: " + ', '.join(f"{value}={count}" for value, count in values))
+
+@bp.cli.command('rebuild-sales')
+@click.option('--batch-size', type=int, default=sales.BATCH_SIZE, show_default=True, help='Suppliers per transaction')
+def rebuild_sales_command(batch_size):
+    """Recompute the supplier sales rollups from payments and the archive"""
+    totals = sales.rebuild(batch_size=batch_size, echo=click.echo)
+    click.echo(f"Rebuilt {totals['rows']} row(s) for {totals['suppliers']} user(s)")
+
+@bp.cli.command('refresh-rates')
+@click.option('--all', 'recompute_all', is_flag=True, help='Recompute every normalized price, not only changed currencies')
+@click.option('--batch-size', type=int, default=rates.BATCH_SIZE, show_default=True)
+@click.option('--interval', type=float, help='Keep running, refreshing every INTERVAL seconds')
+def refresh_rates_command(recompute_all, batch_size, interval):
+    """Load currency rates from RATES_SOURCE and renormalize listing prices that changed"""
+    while True:
+        try:
+            result = rates.refresh(recompute_all=recompute_all, batch_size=batch_size)
+            click.echo(f"changed={','.join(result['changed']) or '-'} listings_updated={result['listings_updated']}")
+        except rates.RatesUnavailable as e:
+            if interval is None:
+                raise click.ClickException(str(e))
+            click.echo(f"Rates unavailable, keeping the current ones: {str(e)}", err=True)
+        if interval is None:
+            return
+        recompute_all = False
+        time.sleep(interval)
+
+@bp.cli.command('export-payments')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Defaults to stdout')
+@click.option('--format', 'file_format', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--supplier-id')
+@click.option('--buyer-id')
+@click.option('--status')
+@click.option('--start', help='ISO date, inclusive')
+@click.option('--end', help='ISO date, inclusive')
+def export_payments_command(output, file_format, supplier_id, buyer_id, status, start, end):
+    """Stream payments (joined to item names) to CSV or NDJSON"""
+    try:
+        statements = payments_export_statements(supplier_id=supplier_id, buyer_id=buyer_id, status=status,
+                                                start=parse_date(start), end=parse_date(end, end_of_day=True))
+    except ValueError:
+        raise click.ClickException('Invalid date, use YYYY-MM-DD')
+
+    with click.open_file(output or '-', 'w', encoding='utf-8') as handle:
+        for chunk in iter_export(statements, file_format):
+            handle.write(chunk)
+
+@bp.cli.command('archive')
+@click.option('--older-than', type=int, help='Days; defaults to ARCHIVE_AFTER_DAYS')
+@click.option('--batch-size', type=int, default=archive.BATCH_SIZE, show_default=True)
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches')
+@click.option('--limit', type=int, help='Move at most this many rows of each table')
+@click.option('--interval', type=float, help='Keep running, starting a new pass every INTERVAL seconds')
+def archive_command(older_than, batch_size, pause, limit, interval):
+    """Move old settled payments and sold listings to the archive tables"""
+    while True:
+        result = archive.archive(days=older_than, batch_size=batch_size, pause=pause, limit=limit)
+        click.echo(' '.join(f"{key}={value}" for key, value in result.to_dict().items()))
+        if interval is None:
+            return
+        time.sleep(interval)
+
+@bp.cli.command('reconcile-payments')
+@click.option('--older-than', type=int, default=reconcile.DEFAULT_OLDER_THAN_MINUTES, show_default=True,
+              help='Only check payments pending for longer than this many minutes')
+@click.option('--abandon-after', type=int, default=reconcile.DEFAULT_ABANDON_AFTER_MINUTES, show_default=True,
+              help='Fail abandoned or unknown references older than this many minutes')
+@click.option('--concurrency', type=int, default=reconcile.DEFAULT_CONCURRENCY, show_default=True)
+@click.option('--rate', type=float, default=reconcile.DEFAULT_RATE, show_default=True,
+              help='Maximum verify calls per second')
+@click.option('--limit', type=int, help='Check at most this many payments')
+@click.option('--interval', type=float, help='Keep running, starting a new pass every INTERVAL seconds')
+def reconcile_payments_command(older_than, abandon_after, concurrency, rate, limit, interval):
+    """Verify stale pending payments with Paystack and settle them"""
+    while True:
+        result = reconcile.reconcile(older_than_minutes=older_than, abandon_after_minutes=abandon_after,
+                                     concurrency=concurrency, rate=rate, limit=limit)
+        summary = result.to_dict()
+        click.echo(' '.join(f"{key}={value}" for key, value in summary.items()))
+        if interval is None:
+            return
+        time.sleep(interval)
@@ -0,0 +1,118 @@
+"""
+Streaming payment exports (CSV or NDJSON)
+
+Rows are fetched through a server-side cursor in batches of YIELD_PER
+(yield_per) and written out batch by batch, so an export of any size
+never holds more than one batch in memory and the first bytes reach the
+client straight away instead of after the whole query has run.
+
+Archived payments (see archive.py) are read the same way from their own
+table, and the two ordered streams are merged as they are written.
+"""
+import csv
+import heapq
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+from sqlalchemy import func, select
+from app import db
+from models import ArchivedListing, ArchivedPayment, Listing, Payment
+
+YIELD_PER = 1000
+
+EXPORT_COLUMNS = ('transaction_id', 'created_at', 'updated_at', 'status', 'amount', 'currency',
+                  'item_name', 'listing_id', 'supplier_id', 'buyer_id')
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+def parse_date(value, end_of_day=False):
+    """Parse an ISO date or datetime filter; a bare date used as an end bound covers the whole day"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed
+
+def _filtered(statement, model, supplier_id, buyer_id, status, start, end):
+    if supplier_id:
+        statement = statement.where(model.supplier_id == supplier_id)
+    if buyer_id:
+        statement = statement.where(model.buyer_id == buyer_id)
+    if status:
+        statement = statement.where(model.status == status)
+    if start:
+        statement = statement.where(model.created_at >= start)
+    if end:
+        statement = statement.where(model.created_at <= end)
+    # NULLS LAST spelled out: SQLite puts them first by default, Postgres last
+    return statement.order_by(model.created_at.nulls_last(), model.transaction_id)
+
+def payments_export_statements(supplier_id=None, buyer_id=None, status=None, start=None, end=None):
+    """Payments, then archived payments, joined to their listing's item name, each oldest first"""
+    current = select(
+        Payment.transaction_id, Payment.created_at, Payment.updated_at, Payment.status,
+        Payment.amount, Payment.currency, Listing.item_name, Payment.listing_id,
+        Payment.supplier_id, Payment.buyer_id
+    ).outerjoin(Listing, Payment.listing_id == Listing.id)
+
+    # An archived payment's listing may still be in listings or already archived too
+    archived = select(
+        ArchivedPayment.transaction_id, ArchivedPayment.created_at, ArchivedPayment.updated_at,
+        ArchivedPayment.status, ArchivedPayment.amount, ArchivedPayment.currency,
+        func.coalesce(Listing.item_name, ArchivedListing.item_name).label('item_name'),
+        ArchivedPayment.listing_id, ArchivedPayment.supplier_id, ArchivedPayment.buyer_id
+    ).outerjoin(Listing, ArchivedPayment.listing_id == Listing.id).outerjoin(
+        ArchivedListing, ArchivedPayment.listing_id == ArchivedListing.id)
+
+    return (_filtered(current, Payment, supplier_id, buyer_id, status, start, end),
+            _filtered(archived, ArchivedPayment, supplier_id, buyer_id, status, start, end))
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def _export_order(row):
+    """The statements' ORDER BY as a Python key, so heapq.merge keeps the streams in order"""
+    return row.created_at is None, row.created_at or datetime.min, row.transaction_id
+
+def _batches(statements):
+    """Rows of the statements merged in (created_at, transaction_id) order, YIELD_PER at a time"""
+    results = [db.session.execute(statement.execution_options(yield_per=YIELD_PER)) for statement in statements]
+    if len(results) == 1:
+        yield from results[0].partitions()
+        return
+    rows = heapq.merge(*results, key=_export_order)
+    while True:
+        batch = list(islice(rows, YIELD_PER))
+        if not batch:
+            return
+        yield batch
+
+def iter_export(statements, file_format='csv'):
+    """Yield the export as text chunks, one chunk per fetched batch"""
+    batches = _batches(statements)
+
+    if file_format == 'ndjson':
+        for batch in batches:
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, map(_plain, row)))) + '\n' for row in batch)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_plain(value) for value in row] for row in batch)
+        yield buffer.getvalue()
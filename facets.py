@@ -0,0 +1,132 @@
+"""
+Facet counts for the buyer feed
+
+The feed shows how many available listings there are per currency and
+per unit. A GROUP BY over listings on every page view would read the
+whole table, so the counts live in listing_facets and each write adjusts
+them in the same transaction that changes the listing:
+
+- ORM writes (create/update/delete listing, a sale through the webhook)
+  are picked up by a before_flush hook that compares each listing's old
+  and new (is_available, currency, quantity_unit)
+- Core bulk inserts (the bulk importer, benchmark seeding) call
+  count_inserted(rows)
+- rebuild() recounts from scratch (`flask rebuild-facets`) after anything
+  that bypasses both, e.g. a manual SQL update
+
+Each count is one row, so concurrent writes in the same currency queue
+briefly on it until they commit; listing writes are rare next to reads.
+"""
+from collections import Counter
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import Listing, ListingFacet
+from replicas import RoutingSession
+from validation import DEFAULT_CURRENCY
+
+FACETS = ('currency', 'unit')
+# Listing columns facet_values reads, in its argument order
+FACET_COLUMNS = ('is_available', 'currency', 'quantity_unit')
+
+def facet_values(is_available, currency, unit):
+    """The (facet, value) pairs a listing counts towards; none unless it is available"""
+    # is_available defaults to true when the column is left unset
+    if is_available is False:
+        return []
+    values = [('currency', currency or DEFAULT_CURRENCY)]
+    if unit:
+        values.append(('unit', unit))
+    return values
+
+def apply_deltas(deltas):
+    """Add {(facet, value): change} to the stored counts (caller commits)"""
+    table = ListingFacet.__table__
+    dialect = db.engine.dialect.name
+    for (facet, value), change in deltas.items():
+        if not change:
+            continue
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = insert(table).values(facet=facet, value=value, count=change)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['facet', 'value'], set_={'count': table.c.count + change}))
+            continue
+        updated = db.session.execute(table.update().where(table.c.facet == facet, table.c.value == value).values(
+            count=table.c.count + change))
+        if updated.rowcount == 0:
+            db.session.execute(table.insert().values(facet=facet, value=value, count=change))
+
+def count_inserted(rows):
+    """Count listings inserted with Core (dicts of column values) (caller commits)"""
+    deltas = Counter()
+    for row in rows:
+        deltas.update(facet_values(row.get('is_available'), row.get('currency'), row.get('quantity_unit')))
+    apply_deltas(deltas)
+
+def _load_replaced_value(target, value, oldvalue, initiator):
+    """No-op; registered only for its active_history"""
+
+# Setting an expired (e.g. just committed) attribute would leave its old value out of the history;
+# active_history makes the ORM load it first, so the hook below subtracts what the row really counted
+for _name in FACET_COLUMNS:
+    event.listen(getattr(Listing, _name), 'set', _load_replaced_value, active_history=True)
+
+def _before_and_after(state, name):
+    history = state.attrs[name].history
+    if history.added or history.deleted:
+        before = history.deleted[0] if history.deleted else None
+        after = history.added[0] if history.added else None
+        return before, after
+    value = state.attrs[name].value
+    return value, value
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _track_listing_changes(db_session, flush_context, instances):
+    deltas = Counter()
+    for listing in db_session.new:
+        if isinstance(listing, Listing):
+            deltas.update(facet_values(listing.is_available, listing.currency, listing.quantity_unit))
+    for listing in db_session.deleted:
+        if isinstance(listing, Listing):
+            state = inspect(listing)
+            deltas.subtract(facet_values(*(_before_and_after(state, name)[0]
+                                           for name in FACET_COLUMNS)))
+    for listing in db_session.dirty:
+        if isinstance(listing, Listing) and db_session.is_modified(listing):
+            state = inspect(listing)
+            before, after = zip(*(_before_and_after(state, name)
+                                  for name in FACET_COLUMNS))
+            if before != after:
+                deltas.subtract(facet_values(*before))
+                deltas.update(facet_values(*after))
+    if deltas:
+        apply_deltas(deltas)
+
+def facet_counts():
+    """{'currency': [(value, count), ...], 'unit': [...]}, largest first"""
+    counts = {facet: [] for facet in FACETS}
+    rows = ListingFacet.query.filter(ListingFacet.count > 0).order_by(
+        ListingFacet.facet, ListingFacet.count.desc(), ListingFacet.value)
+    for row in rows:
+        if row.facet in counts:
+            counts[row.facet].append((row.value, row.count))
+    return counts
+
+def rebuild():
+    """Recount every facet from the listings table (one GROUP BY per facet) and return the counts"""
+    table = ListingFacet.__table__
+    available = Listing.is_available == True
+    currency = func.coalesce(Listing.currency, DEFAULT_CURRENCY)
+    rows = [{'facet': 'currency', 'value': value, 'count': count}
+            for value, count in db.session.query(currency, func.count()).filter(available).group_by(currency)]
+    rows += [{'facet': 'unit', 'value': value, 'count': count}
+             for value, count in db.session.query(Listing.quantity_unit, func.count()).filter(
+                 available, Listing.quantity_unit.isnot(None)).group_by(Listing.quantity_unit)]
+
+    db.session.execute(table.delete())
+    if rows:
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+    return {facet: sorted(((row['value'], row['count']) for row in rows if row['facet'] == facet),
+                          key=lambda pair: -pair[1]) for facet in FACETS}
@@ -0,0 +1,109 @@
+"""
+Range filters and sort orders for the buyer feed
+
+Query parameters (all optional):
+    unit                    kg, l, bag, crate, ... or any spelling parse_quantity knows
+                            ("tonnes", "lbs"); the quantity bounds are converted with it
+    min_quantity, max_quantity
+    currency                only listings priced in this currency (USD, GHS, ...)
+    price_currency          the buyer's currency for min/max_price and price sorting
+    min_price, max_price
+    sort                    price_asc, price_desc, quantity_asc, quantity_desc;
+                            default newest first (or relevance when searching)
+
+With a currency filter, prices are compared as stored. Otherwise they are
+compared across currencies on price_base (see rates.py), with the buyer's
+bounds converted into the base currency once per request. If no rates
+have been applied yet, stored prices are compared as they are.
+
+Every filter is a plain column comparison on available listings, served by
+the partial (unit, quantity) / (currency, price) / (price_base) indexes.
+Sorting by price or quantity leaves out listings without one, and pages
+with an offset cursor like search results do.
+"""
+import math
+from collections import namedtuple
+from models import Listing
+from validation import UNIT_ALIASES, CURRENCIES
+
+SORTS = ('price_asc', 'price_desc', 'quantity_asc', 'quantity_desc')
+
+ListingFilters = namedtuple('ListingFilters', ['unit', 'min_quantity', 'max_quantity', 'currency',
+                                               'price_currency', 'min_price', 'max_price', 'sort'])
+NO_FILTERS = ListingFilters(None, None, None, None, None, None, None, None)
+
+def _number(value, factor=1):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number) or number < 0:
+        return None
+    return round(number * factor, 3)
+
+def _currency(value, supported=False):
+    value = (value or '').strip().upper()
+    if supported:
+        return value if value in CURRENCIES else None
+    return value if len(value) == 3 and value.isalpha() else None
+
+def parse_filters(args, price_currency=None):
+    """ListingFilters from request args; anything unrecognised is ignored"""
+    unit, factor = UNIT_ALIASES.get((args.get('unit') or '').strip().lower(), (None, 1))
+    sort = args.get('sort')
+
+    return ListingFilters(
+        unit=unit,
+        # Bounds only mean something in a known unit ("at least 500" of what?)
+        min_quantity=_number(args.get('min_quantity'), factor) if unit else None,
+        max_quantity=_number(args.get('max_quantity'), factor) if unit else None,
+        currency=_currency(args.get('currency')),
+        price_currency=_currency(args.get('price_currency'), True) or _currency(price_currency, True),
+        min_price=_number(args.get('min_price')),
+        max_price=_number(args.get('max_price')),
+        sort=sort if sort in SORTS else None
+    )
+
+def filter_args(filters):
+    """The non-empty filters as query-string arguments (for links and the next page)"""
+    return {name: value for name, value in filters._asdict().items() if value is not None}
+
+def display_rate(filters, rates):
+    """(currency, rate from the base currency) to show converted prices in, or None"""
+    if not filters.price_currency:
+        return None
+    rate = rates.rate(filters.price_currency)
+    return (filters.price_currency, rate) if rate else None
+
+def _price_column(filters, rates):
+    """The column to compare prices on and a function converting the buyer's bounds to it"""
+    if filters.currency or rates is None:
+        return Listing.price, lambda bound: bound
+    bound_currency = filters.price_currency or rates.base
+    if not rates.rate(bound_currency):
+        return Listing.price, lambda bound: bound
+    return Listing.price_base, lambda bound: rates.to_base(bound, bound_currency)
+
+def apply_filters(query, filters, rates=None):
+    """Restrict a Listing query to the filters and apply their sort order, if any"""
+    if filters.unit:
+        query = query.filter(Listing.quantity_unit == filters.unit)
+    if filters.min_quantity is not None:
+        query = query.filter(Listing.quantity_amount >= filters.min_quantity)
+    if filters.max_quantity is not None:
+        query = query.filter(Listing.quantity_amount <= filters.max_quantity)
+    if filters.currency:
+        query = query.filter(Listing.currency == filters.currency)
+
+    price, to_column = _price_column(filters, rates)
+    if filters.min_price is not None:
+        query = query.filter(price >= to_column(filters.min_price))
+    if filters.max_price is not None:
+        query = query.filter(price <= to_column(filters.max_price))
+
+    if filters.sort:
+        column = price if filters.sort.startswith('price') else Listing.quantity_amount
+        order = (column.desc(), Listing.id.desc()) if filters.sort.endswith('desc') else (column.asc(), Listing.id.asc())
+        # Replaces the relevance order of a search
+        query = query.filter(column.isnot(None)).order_by(None).order_by(*order)
+    return query
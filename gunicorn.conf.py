@@ -0,0 +1,40 @@
+"""
+Gunicorn settings (gunicorn reads this file from the working directory)
+
+Paystack calls in /paystack/initiate can take seconds, and the transaction
+status stream stays open for up to a minute. With sync workers each of those
+holds a whole worker, so a slow provider stops dashboards being served.
+Pick the worker type with GUNICORN_WORKER_CLASS:
+
+    gthread (default)  GUNICORN_THREADS threads per worker; a slow call
+                       holds one thread, not the worker
+    gevent             cooperative greenlets: thousands of waiting calls
+                       and open streams per worker. Needs `pip install
+                       gevent`, and `psycogreen` on Postgres so database
+                       calls yield too
+    sync               one request at a time per worker
+
+    gunicorn                                # uses main:app and this file
+    GUNICORN_WORKER_CLASS=gevent gunicorn
+"""
+import os
+
+wsgi_app = 'main:app'
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# gunicorn turns sync workers into gthread ones when threads > 1
+threads = int(os.environ.get('GUNICORN_THREADS', 16)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+
+def post_fork(server, worker):
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("gevent workers without psycogreen: Postgres queries will block the whole worker")
+        return
+    patch_psycopg()
@@ -0,0 +1,367 @@
+"""
+Online conversion of text keys to compact UUID columns (`flask migrate-ids`)
+
+Databases created before ids.UUIDKey store every key (users.id,
+listings.id, payments.listing_id, ...) as 36-character text. This converts
+every UUIDKey column in the models to the new storage. The values stay the
+same; only the storage changes. The app keeps serving throughout, and the
+work is split so that no step holds a long lock:
+
+Postgres
+    prepare   add a <column>__uuid shadow column next to each key column,
+              and a trigger that fills the shadow columns on every insert
+              and update
+    backfill  fill the shadow columns of existing rows in primary key
+              order, batch_size rows per transaction
+    index     build a copy of every index on a key column on its shadow
+              column (CREATE INDEX CONCURRENTLY), and validate NOT NULL
+              checks so that SET NOT NULL later needs no table scan
+    swap      one short transaction: drop the old columns, rename the
+              shadow columns and their indexes into place, and re-add the
+              primary keys (from the prebuilt indexes) and foreign keys
+              (NOT VALID; they are validated after the commit without
+              blocking writes). Only the catalog changes; nothing is
+              rewritten under the lock
+
+SQLite (no column type changes, so each table is rebuilt)
+    prepare   create <table>__uuid with the new schema, and triggers that
+              record rows changed on the old table while it is copied
+    backfill  copy rows in rowid order, batch_size rows per transaction
+    swap      one transaction: copy the rows changed since, replace the
+              old tables and recreate their indexes and triggers. Index
+              builds make this the slow step on large tables
+
+Every step is idempotent and progress is kept in the database, so an
+interrupted run continues where it stopped when started again.
+`--phase` runs one step at a time, e.g. the backfill during the day and
+the swap in a quiet moment.
+"""
+import logging
+import re
+import time
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.types import String
+from app import db
+from ids import UUIDKey, parse_id
+
+DEFAULT_BATCH_SIZE = 1000
+PHASES = ('prepare', 'backfill', 'index', 'swap')
+SUFFIX = '__uuid'
+PROGRESS_TABLE = 'id_migration_progress'
+SWAP_LOCK_TIMEOUT = '5s'
+SWAP_ATTEMPTS = 5
+
+class IdMigrationError(Exception):
+    """The conversion cannot continue (e.g. a key that is not a UUID)"""
+
+def key_columns():
+    """{table: [UUIDKey column names]} for every model table, parents before children"""
+    return {table.name: [column.name for column in table.columns if isinstance(column.type, UUIDKey)]
+            for table in db.metadata.sorted_tables
+            if any(isinstance(column.type, UUIDKey) for column in table.columns)}
+
+def pending_tables(engine):
+    """{table: [columns]} for the tables whose key columns are still stored as text"""
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    pending = {}
+    for table, columns in key_columns().items():
+        if table not in existing:
+            continue
+        types = {column['name']: column['type'] for column in inspector.get_columns(table)}
+        if any(isinstance(types.get(column), String) for column in columns):
+            pending[table] = columns
+    return pending
+
+def _ensure_progress_table(conn):
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} ("
+                      "table_name TEXT PRIMARY KEY, last_key TEXT, rows_done INTEGER NOT NULL DEFAULT 0, "
+                      "done INTEGER NOT NULL DEFAULT 0)"))
+
+def _progress(conn, table):
+    row = conn.execute(text(f"SELECT last_key, rows_done, done FROM {PROGRESS_TABLE} WHERE table_name = :table"),
+                       {'table': table}).first()
+    if row is None:
+        conn.execute(text(f"INSERT INTO {PROGRESS_TABLE} (table_name) VALUES (:table)"), {'table': table})
+        return None, 0, False
+    return row[0], row[1], bool(row[2])
+
+def _save_progress(conn, table, last_key, rows_done, done=False):
+    conn.execute(text(f"UPDATE {PROGRESS_TABLE} SET last_key = :last_key, rows_done = :rows_done, done = :done "
+                      "WHERE table_name = :table"),
+                 {'table': table, 'last_key': last_key, 'rows_done': rows_done, 'done': int(done)})
+
+def status(engine):
+    """{table: {'columns', 'rows_done', 'backfilled'}} for the tables still to convert"""
+    pending = pending_tables(engine)
+    progress = {}
+    if PROGRESS_TABLE in inspect(engine).get_table_names():
+        with engine.connect() as conn:
+            progress = {row[0]: (row[1], bool(row[2])) for row in conn.execute(
+                text(f"SELECT table_name, rows_done, done FROM {PROGRESS_TABLE}"))}
+    return {table: {'columns': columns, 'rows_done': progress.get(table, (0, False))[0],
+                    'backfilled': progress.get(table, (0, False))[1]}
+            for table, columns in pending.items()}
+
+def run(engine, phases=PHASES, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, echo=logging.info):
+    """Run the given phases for every table still stored as text; returns the tables converted"""
+    pending = pending_tables(engine)
+    if not pending:
+        return []
+    import migrations
+    if migrations.pending(engine):
+        raise IdMigrationError('Apply the pending schema migrations first (flask migrate)')
+
+    converter = _Postgres(engine, echo) if engine.dialect.name == 'postgresql' else _SQLite(engine, echo)
+    for phase in PHASES:
+        if phase not in phases:
+            continue
+        if phase == 'backfill':
+            for table, columns in pending.items():
+                converter.backfill(table, columns, batch_size, pause)
+        elif phase == 'swap':
+            converter.swap(pending)
+            return list(pending)
+        else:
+            getattr(converter, phase)(pending)
+    return []
+
+class _Postgres:
+
+    def __init__(self, engine, echo):
+        self.engine = engine
+        self.echo = echo
+
+    def prepare(self, pending):
+        with self.engine.begin() as conn:
+            _ensure_progress_table(conn)
+            for table, columns in pending.items():
+                for column in columns:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}{SUFFIX} uuid"))
+                assignments = ' '.join(f"NEW.{column}{SUFFIX} := NULLIF(NEW.{column}, '')::uuid;"
+                                       for column in columns)
+                conn.execute(text(f"CREATE OR REPLACE FUNCTION {table}{SUFFIX}_sync() RETURNS trigger "
+                                  f"LANGUAGE plpgsql AS $$ BEGIN {assignments} RETURN NEW; END $$"))
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {table}{SUFFIX}_sync ON {table}"))
+                conn.execute(text(f"CREATE TRIGGER {table}{SUFFIX}_sync BEFORE INSERT OR UPDATE ON {table} "
+                                  f"FOR EACH ROW EXECUTE FUNCTION {table}{SUFFIX}_sync()"))
+        self.echo(f"Prepared shadow columns on {', '.join(pending)}")
+
+    def backfill(self, table, columns, batch_size, pause):
+        assignments = ', '.join(f"{column}{SUFFIX} = NULLIF({column}, '')::uuid" for column in columns)
+        update = text(f"UPDATE {table} SET {assignments} WHERE id >= :low AND id <= :high")
+        with self.engine.begin() as conn:
+            _ensure_progress_table(conn)
+            after, rows_done, done = _progress(conn, table)
+        while not done:
+            with self.engine.begin() as conn:
+                if after is None:
+                    keys = conn.execute(text(f"SELECT id FROM {table} ORDER BY id LIMIT :limit"),
+                                        {'limit': batch_size}).scalars().all()
+                else:
+                    keys = conn.execute(text(f"SELECT id FROM {table} WHERE id > :after ORDER BY id LIMIT :limit"),
+                                        {'after': after, 'limit': batch_size}).scalars().all()
+                if keys:
+                    conn.execute(update, {'low': keys[0], 'high': keys[-1]})
+                    after, rows_done = keys[-1], rows_done + len(keys)
+                done = len(keys) < batch_size
+                _save_progress(conn, table, after, rows_done, done)
+            self.echo(f"{table}: {rows_done} rows backfilled")
+            if pause and not done:
+                time.sleep(pause)
+
+    def _shadow_indexes(self, conn, table, columns):
+        """(original name, CREATE statement on the shadow columns) for every index on a key column"""
+        pattern = re.compile(r'\b(' + '|'.join(re.escape(column) for column in columns) + r')\b')
+        found = []
+        for name, definition in conn.execute(text("SELECT indexname, indexdef FROM pg_indexes "
+                                                  "WHERE schemaname = current_schema() AND tablename = :table"),
+                                             {'table': table}):
+            if name.endswith(SUFFIX):
+                continue
+            head, _, body = definition.partition(' USING ')
+            if not pattern.search(body):
+                continue
+            head = head.replace(f'INDEX {name} ON', f'INDEX CONCURRENTLY IF NOT EXISTS {name}{SUFFIX} ON', 1)
+            found.append((name, f"{head} USING {pattern.sub(lambda match: match.group(1) + SUFFIX, body)}"))
+        return found
+
+    def index(self, pending):
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # A CONCURRENTLY build that was interrupted leaves an invalid index behind; start it again
+            for name in conn.execute(text(
+                    "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE NOT i.indisvalid AND c.relname LIKE :pattern"), {'pattern': f'%{SUFFIX}'}).scalars():
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+            for table, columns in pending.items():
+                for name, statement in self._shadow_indexes(conn, table, columns):
+                    self.echo(f"{table}: building {name}{SUFFIX}")
+                    conn.execute(text(statement))
+                for column in columns:
+                    if db.metadata.tables[table].c[column].nullable:
+                        continue
+                    check = f"{table}_{column}{SUFFIX}_not_null"
+                    exists = conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :name"),
+                                          {'name': check}).first()
+                    if not exists:
+                        conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {check} "
+                                          f"CHECK ({column}{SUFFIX} IS NOT NULL) NOT VALID"))
+                    conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}"))
+
+    def swap(self, pending):
+        inspector = inspect(self.engine)
+        foreign_keys = [(table, fk) for table in inspector.get_table_names()
+                        for fk in inspector.get_foreign_keys(table)
+                        if fk['referred_table'] in pending or table in pending]
+        primary_keys = {table: inspector.get_pk_constraint(table)['name'] for table in pending}
+        with self.engine.connect() as conn:
+            indexes = {table: [name for name, _ in self._shadow_indexes(conn, table, columns)]
+                       for table, columns in pending.items()}
+        for table, columns in pending.items():
+            with self.engine.connect() as conn:
+                missing = [name for name in indexes[table] if not conn.execute(
+                    text("SELECT 1 FROM pg_class WHERE relname = :name"), {'name': name + SUFFIX}).first()]
+                _, _, done = _progress(conn, table)
+            if missing or not done:
+                raise IdMigrationError(f'{table} is not ready to swap; run the backfill and index phases first')
+
+        for attempt in range(1, SWAP_ATTEMPTS + 1):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+                    conn.execute(text(f"LOCK TABLE {', '.join(pending)} IN ACCESS EXCLUSIVE MODE"))
+                    self._swap(conn, pending, foreign_keys, primary_keys, indexes)
+                break
+            except Exception as e:
+                if 'lock timeout' not in str(e) or attempt == SWAP_ATTEMPTS:
+                    raise
+                self.echo(f"Swap could not get its locks within {SWAP_LOCK_TIMEOUT}, retrying ({attempt})")
+
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for table, fk in foreign_keys:
+                conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {fk['name']}"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {PROGRESS_TABLE}"))
+        self.echo(f"Converted {', '.join(pending)}")
+
+    def _swap(self, conn, pending, foreign_keys, primary_keys, indexes):
+        for table, fk in foreign_keys:
+            conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {fk['name']}"))
+        for table, columns in pending.items():
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {table}{SUFFIX}_sync ON {table}"))
+            conn.execute(text(f"DROP FUNCTION IF EXISTS {table}{SUFFIX}_sync()"))
+            conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {primary_keys[table]}"))
+            for column in columns:
+                conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+                conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN {column}{SUFFIX} TO {column}"))
+                if not db.metadata.tables[table].c[column].nullable:
+                    # The validated check constraint lets Postgres skip the scan
+                    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"))
+                    conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}{SUFFIX}_not_null"))
+            for name in indexes[table]:
+                if name == primary_keys[table]:
+                    conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} PRIMARY KEY USING INDEX {name}{SUFFIX}"))
+                else:
+                    conn.execute(text(f"ALTER INDEX {name}{SUFFIX} RENAME TO {name}"))
+        for table, fk in foreign_keys:
+            conn.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {fk['name']} FOREIGN KEY ({', '.join(fk['constrained_columns'])}) "
+                f"REFERENCES {fk['referred_table']} ({', '.join(fk['referred_columns'])}) NOT VALID"))
+
+class _SQLite:
+
+    def __init__(self, engine, echo):
+        self.engine = engine
+        self.echo = echo
+
+    def prepare(self, pending):
+        with self.engine.begin() as conn:
+            _ensure_progress_table(conn)
+            existing = set(inspect(conn).get_table_names())
+            for table in pending:
+                if table + SUFFIX not in existing:
+                    create = str(CreateTable(db.metadata.tables[table]).compile(dialect=self.engine.dialect))
+                    conn.execute(text(create.replace(f'CREATE TABLE {table} ', f'CREATE TABLE {table}{SUFFIX} ', 1)))
+                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}{SUFFIX}_changed (row_id INTEGER PRIMARY KEY)"))
+                for operation, row in (('INSERT', 'new'), ('UPDATE', 'old'), ('DELETE', 'old')):
+                    conn.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS {table}{SUFFIX}_{operation.lower()} AFTER {operation} ON {table} "
+                        f"BEGIN INSERT OR IGNORE INTO {table}{SUFFIX}_changed VALUES ({row}.rowid); END"))
+        self.echo(f"Prepared copies of {', '.join(pending)}")
+
+    def _columns(self, conn, table):
+        existing = {column['name'] for column in inspect(conn).get_columns(table)}
+        return [column.name for column in db.metadata.tables[table].columns if column.name in existing]
+
+    def _copy(self, conn, table, columns, rows):
+        keys = set(key_columns()[table])
+        values = []
+        for row in rows:
+            item = {'row_id': row[0]}
+            for column, value in zip(columns, row[1:]):
+                if column in keys and value is not None:
+                    parsed = parse_id(value)
+                    if parsed is None:
+                        raise IdMigrationError(f'{table}.{column} holds {value!r}, which is not a UUID')
+                    value = parsed.bytes
+                item[column] = value
+            values.append(item)
+        if values:
+            conn.execute(text(f"INSERT OR REPLACE INTO {table}{SUFFIX} (rowid, {', '.join(columns)}) "
+                              f"VALUES (:row_id, {', '.join(':' + column for column in columns)})"), values)
+
+    def backfill(self, table, key_names, batch_size, pause):
+        with self.engine.begin() as conn:
+            _ensure_progress_table(conn)
+            after, rows_done, done = _progress(conn, table)
+            columns = self._columns(conn, table)
+        select = text(f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE rowid > :after ORDER BY rowid LIMIT :limit")
+        after = int(after or 0)
+        while not done:
+            with self.engine.begin() as conn:
+                rows = conn.execute(select, {'after': after, 'limit': batch_size}).all()
+                self._copy(conn, table, columns, rows)
+                if rows:
+                    after, rows_done = rows[-1][0], rows_done + len(rows)
+                done = len(rows) < batch_size
+                _save_progress(conn, table, str(after), rows_done, done)
+            self.echo(f"{table}: {rows_done} rows copied")
+            if pause and not done:
+                time.sleep(pause)
+
+    def index(self, pending):
+        """Indexes can only be built after the swap on SQLite"""
+
+    def swap(self, pending):
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.commit()
+            with conn.begin():
+                for table in pending:
+                    _, _, done = _progress(conn, table)
+                    if not done:
+                        raise IdMigrationError(f'{table} is not ready to swap; run the backfill phase first')
+                for table in pending:
+                    self._swap_table(conn, table)
+                conn.execute(text(f"DROP TABLE IF EXISTS {PROGRESS_TABLE}"))
+        self.echo(f"Converted {', '.join(pending)}")
+
+    def _swap_table(self, conn, table):
+        columns = self._columns(conn, table)
+        after = conn.execute(text(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}{SUFFIX}")).scalar()
+        changed = text(f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE rowid > :after "
+                       f"OR rowid IN (SELECT row_id FROM {table}{SUFFIX}_changed)")
+        conn.execute(text(f"DELETE FROM {table}{SUFFIX} WHERE rowid IN (SELECT row_id FROM {table}{SUFFIX}_changed)"))
+        self._copy(conn, table, columns, conn.execute(changed, {'after': after}).all())
+
+        # Indexes and triggers (the search index's among them) go with the old table; recreate them as they were
+        schema = conn.execute(text("SELECT type, sql FROM sqlite_master WHERE tbl_name = :table "
+                                   "AND type IN ('index', 'trigger') AND sql IS NOT NULL AND instr(name, :ours) = 0"),
+                              {'table': table, 'ours': SUFFIX}).all()
+        conn.execute(text(f"DROP TABLE {table}"))
+        conn.execute(text(f"DROP TABLE {table}{SUFFIX}_changed"))
+        conn.execute(text(f"ALTER TABLE {table}{SUFFIX} RENAME TO {table}"))
+        for kind, sql in sorted(schema, key=lambda item: item[0] != 'index'):
+            self.echo(f"{table}: recreating {kind}")
+            conn.execute(text(sql))
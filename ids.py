@@ -0,0 +1,103 @@
+"""
+Primary keys: time-ordered UUIDv7, stored compactly
+
+New rows get UUIDv7 ids (RFC 9562): a 48-bit millisecond timestamp
+followed by random bits. Keys created close together in time sort close
+together, so inserts append to the right edge of the primary key index
+instead of landing on random pages as uuid4 did. Within a process, ids are
+strictly increasing even inside one millisecond.
+
+UUIDKey stores them as a native uuid on Postgres and as 16 bytes
+elsewhere (36 characters before). The application still handles ids as
+canonical strings ('0190c1d2-...'), as it always has, so sessions, URLs,
+JSON and cache keys are unchanged. A string that is not a UUID binds as
+NULL and matches no row, so a mangled id in a URL gives a 404 rather than
+a database error.
+
+Existing databases are converted with `flask migrate-ids` (id_migration.py).
+Ids already issued keep their value; only the storage changes.
+"""
+import os
+import threading
+import time
+import uuid
+from sqlalchemy import BINARY, LargeBinary, Uuid
+from sqlalchemy.types import TypeDecorator
+
+_RAND_BITS = 74
+_lock = threading.Lock()
+_last = (0, 0)
+
+def uuid7_from(ms, rand):
+    """UUIDv7 from a millisecond timestamp and 74 random bits"""
+    value = (ms & 0xFFFFFFFFFFFF) << 80
+    value |= 0x7 << 76
+    value |= (rand >> 62 & 0xFFF) << 64
+    value |= 0b10 << 62
+    value |= rand & 0x3FFFFFFFFFFFFFFF
+    return uuid.UUID(int=value)
+
+def uuid7():
+    """A new UUIDv7, greater than every one this process issued before"""
+    global _last
+    ms = time.time_ns() // 1_000_000
+    with _lock:
+        last_ms, last_rand = _last
+        if ms > last_ms:
+            # Leave headroom so a burst within one millisecond does not run out of counter
+            rand = int.from_bytes(os.urandom(10), 'big') >> 7
+        else:
+            ms, rand = last_ms, last_rand + 1
+            if rand >> _RAND_BITS:
+                ms, rand = last_ms + 1, int.from_bytes(os.urandom(10), 'big') >> 7
+        _last = (ms, rand)
+    return uuid7_from(ms, rand)
+
+def new_id():
+    """A new primary key in the application's string form"""
+    return str(uuid7())
+
+def parse_id(value):
+    """uuid.UUID from a UUID, its string form or 16 bytes; None if it is not one"""
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return uuid.UUID(bytes=bytes(value))
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+class UUIDKey(TypeDecorator):
+    """UUID key column: native uuid on Postgres, 16 bytes elsewhere, a str in Python"""
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(Uuid(as_uuid=False))
+        if dialect.name == 'sqlite':
+            return dialect.type_descriptor(LargeBinary())
+        return dialect.type_descriptor(BINARY(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name != 'postgresql' and isinstance(value, str) and len(value) == 36:
+            # Fast path for the canonical form, which is what the app passes around
+            try:
+                raw = bytes.fromhex(value.replace('-', ''))
+            except ValueError:
+                return None
+            return raw if len(raw) == 16 else None
+        parsed = parse_id(value)
+        if parsed is None:
+            return None
+        return str(parsed) if dialect.name == 'postgresql' else parsed.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        digits = bytes(value).hex()
+        return f'{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}'
@@ -0,0 +1,341 @@
+"""
+Per-request instrumentation
+
+Records latency per endpoint and the number of SQL queries (and the time
+spent in them) per request, flags N+1 patterns, and renders everything in
+the Prometheus text format for /metrics, which is off unless METRICS_TOKEN
+is set (scrapers send it as a bearer token). Metrics live in process
+memory, so under gunicorn each worker reports its own series; scrape every
+worker or run a single worker per container.
+
+With SERVER_TIMING on (the default only in development) every response
+also carries a Server-Timing header with its DB time and query count.
+
+N+1 detection: a request that runs the same SQL statement at least
+N_PLUS_ONE_THRESHOLD times (e.g. a lazy `listing.supplier` or
+`db.session.get(Listing, ...)` inside a loop) is logged with the
+statement and counted in foodbridge_n_plus_one_total.
+
+Opt-in profiling, configured from the environment:
+    PROFILE_SAMPLE_RATE  fraction of requests to profile (default 0, off)
+    PROFILE_SLOW_MS      only keep profiles of requests slower than this (default 500)
+    PROFILE_DIR          where profiles are written (default ./profiles)
+    PROFILER             'cprofile' (.prof, open with snakeviz or flameprof)
+                         or 'pyinstrument' (.html, requires pyinstrument)
+"""
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+import collections
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, ("le", le))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {count}'
+
+class Registry:
+    """Metrics plus callbacks that report current values at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback):
+        """
+        callback() returns a list of (name, help, kind, labelnames, [(label values, value), ...]);
+        failures are logged and skipped
+        """
+        self.collectors.append(callback)
+
+    def add_gauges(self, callback):
+        """callback() returns a list of (name, help, value)"""
+        self.add_collector(lambda: [(name, help_text, 'gauge', (), [((), value)])
+                                    for name, help_text, value in callback()])
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        for callback in self.collectors:
+            try:
+                families = callback()
+            except Exception as e:
+                logging.error(f"Error collecting metrics: {str(e)}")
+                continue
+            for name, help_text, kind, labelnames, samples in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{_labels(labelnames, labels)} {value}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    'foodbridge_request_duration_seconds', 'Time to produce a response', ('endpoint', 'method', 'status')))
+REQUEST_QUERIES = registry.register(Histogram(
+    'foodbridge_request_db_queries', 'SQL statements executed per request', ('endpoint',), QUERY_COUNT_BUCKETS))
+REQUEST_DB_TIME = registry.register(Histogram(
+    'foodbridge_request_db_duration_seconds', 'Time spent in SQL per request', ('endpoint',)))
+N_PLUS_ONE = registry.register(Counter(
+    'foodbridge_n_plus_one_total', 'Requests that repeated one SQL statement N_PLUS_ONE_THRESHOLD+ times',
+    ('endpoint',)))
+PROFILES = registry.register(Counter(
+    'foodbridge_profiles_written_total', 'Slow request profiles written to PROFILE_DIR', ('endpoint',)))
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if not has_request_context():
+        return
+    stats = g.get('_db_stats')
+    if stats is not None:
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+        stats['statements'][statement] += 1
+
+class Profiler:
+    """Samples a fraction of requests; one profile at a time (profilers are process-wide since 3.12)"""
+
+    def __init__(self, sample_rate, slow_ms, directory, backend='cprofile'):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_ms / 1000.0
+        self.directory = directory
+        self.backend = backend
+        self._busy = threading.Lock()
+        if backend == 'pyinstrument':
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                raise RuntimeError("PROFILER is 'pyinstrument' but the 'pyinstrument' package is not installed")
+
+    def start(self):
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return None
+        try:
+            if self.backend == 'pyinstrument':
+                from pyinstrument import Profiler as PyinstrumentProfiler
+                profile = PyinstrumentProfiler()
+                profile.start()
+            else:
+                import cProfile
+                profile = cProfile.Profile()
+                profile.enable()
+            return profile
+        except Exception as e:
+            self._busy.release()
+            logging.error(f"Could not start profiler: {str(e)}")
+            return None
+
+    def finish(self, profile, endpoint, elapsed):
+        try:
+            if self.backend == 'pyinstrument':
+                profile.stop()
+            else:
+                profile.disable()
+            if elapsed < self.slow_seconds:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            base = os.path.join(self.directory, f'{stamp}-{endpoint}-{int(elapsed * 1000)}ms-{os.getpid()}')
+            if self.backend == 'pyinstrument':
+                with open(base + '.html', 'w', encoding='utf-8') as handle:
+                    handle.write(profile.output_html())
+            else:
+                profile.dump_stats(base + '.prof')
+            PROFILES.inc(endpoint)
+            logging.warning(f"Slow request profiled: {endpoint} took {elapsed * 1000:.0f}ms -> {base}")
+        except Exception as e:
+            logging.error(f"Could not write profile: {str(e)}")
+        finally:
+            self._busy.release()
+
+def _profiler_from_env():
+    sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    if sample_rate <= 0:
+        return None
+    return Profiler(sample_rate,
+                    float(os.environ.get('PROFILE_SLOW_MS', 500)),
+                    os.environ.get('PROFILE_DIR', 'profiles'),
+                    os.environ.get('PROFILER', 'cprofile'))
+
+def _endpoint():
+    return request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+
+def init_app(app):
+    """Install the request hooks and SQL event listeners"""
+    profiler = _profiler_from_env()
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_instrumentation():
+        g._db_stats = {'count': 0, 'seconds': 0.0, 'statements': collections.Counter()}
+        g._profile = profiler.start() if profiler else None
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def record_instrumentation(response):
+        started = g.pop('_request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = _endpoint()
+        stats = g.pop('_db_stats')
+
+        REQUEST_LATENCY.observe(elapsed, endpoint, request.method, str(response.status_code))
+        REQUEST_QUERIES.observe(stats['count'], endpoint)
+        REQUEST_DB_TIME.observe(stats['seconds'], endpoint)
+
+        if stats['statements']:
+            statement, repeats = stats['statements'].most_common(1)[0]
+            if repeats >= N_PLUS_ONE_THRESHOLD:
+                N_PLUS_ONE.inc(endpoint)
+                logging.warning(f"Possible N+1 in {endpoint}: statement ran {repeats} times "
+                                f"({stats['count']} queries total): {' '.join(statement.split())[:300]}")
+
+        if app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = (f'db;dur={stats["seconds"] * 1000:.1f};'
+                                                 f'desc="{stats["count"]} queries", app;dur={elapsed * 1000:.1f}')
+
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profiler.finish(profile, endpoint, elapsed)
+        return response
+
+    @app.teardown_request
+    def release_profiler(error=None):
+        # after_request is skipped when an exception escapes; never leave the profiler running
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profiler.finish(profile, _endpoint(), float('-inf'))
+
+def webhook_queue_gauges():
+    from webhooks import queue_metrics
+    metrics = queue_metrics()
+    return [
+        ('foodbridge_webhook_queue_pending', 'Webhook events waiting for the worker', metrics['pending']),
+        ('foodbridge_webhook_queue_failed', 'Webhook events that failed and need a replay', metrics['failed']),
+        ('foodbridge_webhook_queue_lag_seconds', 'Age of the oldest pending webhook event', metrics['lag_seconds'])
+    ]
+
+def log_queue_metrics():
+    from logs import queue_stats
+    stats = queue_stats()
+    return [
+        ('foodbridge_log_queue_depth', 'Log records waiting for the writer thread', 'gauge', (),
+         [((), stats['queued'])]),
+        ('foodbridge_log_records_dropped_total', 'Log records dropped because the queue was full', 'counter', (),
+         [((), stats['dropped'])]),
+        ('foodbridge_log_records_sampled_out_total', 'Log records skipped by LOG_SAMPLING', 'counter', (),
+         [((), stats['sampled_out'])])
+    ]
+
+def rate_limit_metrics():
+    from ratelimit import stats
+    current = stats()
+    caps = sorted(current['caps'].items())
+    return [
+        ('foodbridge_rate_limited_total', 'Requests refused with 429 by a rate limit bucket', 'counter',
+         ('policy', 'scope'), sorted(current['limited'].items())),
+        ('foodbridge_requests_shed_total', 'Requests refused with 503 at a concurrency cap', 'counter',
+         ('group',), [((group,), shed) for group, (in_flight, limit, shed) in caps]),
+        ('foodbridge_requests_in_flight', 'Requests in flight per concurrency group', 'gauge',
+         ('group',), [((group,), in_flight) for group, (in_flight, limit, shed) in caps]),
+        ('foodbridge_requests_in_flight_limit', 'Concurrency cap per group', 'gauge',
+         ('group',), [((group,), limit) for group, (in_flight, limit, shed) in caps])
+    ]
+
+registry.add_gauges(webhook_queue_gauges)
+registry.add_collector(log_queue_metrics)
+registry.add_collector(rate_limit_metrics)
+
+def render_metrics():
+    """Prometheus text exposition of every metric"""
+    return registry.render()
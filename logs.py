@@ -0,0 +1,278 @@
+"""
+Logging: queued, structured and sampled
+
+Request threads never write log output themselves. A QueueHandler on the
+root logger stamps each record with the current request id, applies the
+sampling rules and puts the record on a bounded in-memory queue. A
+QueueListener thread formats it (JSON or text) and writes it to stderr.
+When the queue is full, records are dropped and counted
+(foodbridge_log_records_dropped_total on /metrics) rather than blocking
+the request.
+
+Every request gets an id: the incoming X-Request-ID header when it looks
+sane, a fresh one otherwise. The id is echoed in the X-Request-ID response
+header and added to every record logged while the request is handled.
+
+APP_ENV picks the defaults (production when unset, or development when
+FLASK_DEBUG is on):
+
+    development   DEBUG, text, nothing sampled
+    staging       INFO, JSON, webhook receipts sampled at 10%
+    production    WARNING, JSON, webhook receipts sampled at 1%
+
+and these override them:
+    LOG_LEVEL       root level (DEBUG, INFO, WARNING, ...)
+    LOG_LEVELS      per-logger levels, "werkzeug=ERROR,sqlalchemy.engine=INFO"
+    LOG_FORMAT      json or text
+    LOG_SAMPLING    rules "target=rate" keeping that fraction of the matching
+                    records, where target is a logger name (a prefix counts,
+                    "webhooks" matches "webhooks.received"), a module name
+                    (most code logs through the root logger), a level, or
+                    "logger:LEVEL". "webhooks.received=0.05,routes:INFO=0.5,DEBUG=0.1"
+                    The most specific rule wins. Rules without a level only
+                    apply below WARNING, so warnings and errors are kept
+                    unless a rule names their level.
+    LOG_QUEUE_SIZE  records held for the writer thread (default 10000)
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+ENVIRONMENTS = {
+    'development': {'level': 'DEBUG', 'format': 'text', 'sampling': '', 'levels': ''},
+    'staging': {'level': 'INFO', 'format': 'json', 'sampling': 'webhooks.received=0.1',
+                'levels': 'werkzeug=WARNING,urllib3=WARNING'},
+    'production': {'level': 'WARNING', 'format': 'json', 'sampling': 'webhooks.received=0.01',
+                   'levels': 'werkzeug=WARNING,urllib3=WARNING'},
+}
+DEFAULT_QUEUE_SIZE = 10000
+REQUEST_ID_HEADER = 'X-Request-ID'
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+def environment():
+    """The configured environment name (APP_ENV)"""
+    configured = os.environ.get('APP_ENV', '').strip().lower()
+    if configured in ENVIRONMENTS:
+        return configured
+    if not configured and os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes'):
+        return 'development'
+    return 'production'
+
+def _level(name):
+    level = logging.getLevelName(name.strip().upper())
+    return level if isinstance(level, int) else None
+
+def _pairs(spec):
+    for item in spec.split(','):
+        key, sep, value = item.partition('=')
+        if sep and key.strip():
+            yield key.strip(), value.strip()
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records matching each rule (see LOG_SAMPLING)"""
+
+    def __init__(self, spec=''):
+        super().__init__()
+        # (target or None, levelno or None) -> rate
+        self.rules = {}
+        for key, value in _pairs(spec):
+            try:
+                rate = min(max(float(value), 0.0), 1.0)
+            except ValueError:
+                continue
+            target, _, level_name = key.partition(':')
+            if not level_name and _level(target) is not None:
+                target, level_name = '', target
+            level = _level(level_name) if level_name else None
+            if level_name and level is None:
+                continue
+            self.rules[(target or None, level)] = rate
+        self._rates = {}
+        self.sampled_out = 0
+
+    def _rate(self, name, module, levelno):
+        best, best_rank = 1.0, -1
+        for (target, level), rate in self.rules.items():
+            if level is None and levelno >= logging.WARNING:
+                continue
+            if level is not None and level != levelno:
+                continue
+            if target is not None and not (target == module or name == target or name.startswith(target + '.')):
+                continue
+            # Logger/module beats level alone; a longer logger prefix beats a shorter one
+            rank = (len(target) + 1 if target else 0) * 2 + (level is not None)
+            if rank > best_rank:
+                best, best_rank = rate, rank
+        return best
+
+    def filter(self, record):
+        if not self.rules:
+            return True
+        key = (record.name, record.module, record.levelno)
+        rate = self._rates.get(key)
+        if rate is None:
+            rate = self._rates[key] = self._rate(*key)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+class RequestIdFilter(logging.Filter):
+    """Adds request_id to every record (None outside a request)"""
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread; never waits for it"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only resolve what cannot cross threads (args, the live traceback); formatting happens on the writer
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request_id, extras, exception"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = '-'
+        return super().format(record)
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+_sampling = None
+
+def _start_listener(output):
+    global _listener
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+def _restart_after_fork():
+    # The writer thread does not survive a fork (gunicorn --preload); give the child its own
+    if _listener is None:
+        return
+    output = _listener.handlers[0]
+    _handler.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+    _start_listener(output)
+
+def configure_logging(env=None):
+    """Install the queued root handler for this process (once); returns the environment used"""
+    global _handler, _sampling
+    env = env or environment()
+    settings = ENVIRONMENTS[env]
+    with _lock:
+        if _handler is not None:
+            return env
+
+        root = logging.getLogger()
+        root.setLevel(_level(os.environ.get('LOG_LEVEL', '')) or _level(settings['level']))
+        for name, level_name in _pairs(','.join(filter(None, (settings['levels'], os.environ.get('LOG_LEVELS', ''))))):
+            level = _level(level_name)
+            if level is not None:
+                logging.getLogger(name).setLevel(level)
+
+        output = logging.StreamHandler(sys.stderr)
+        if os.environ.get('LOG_FORMAT', settings['format']).lower() == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(_TextFormatter(TEXT_FORMAT))
+
+        _sampling = SamplingFilter(os.environ.get('LOG_SAMPLING', settings['sampling']))
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))))
+        _handler.addFilter(_sampling)
+        _handler.addFilter(RequestIdFilter())
+        root.addHandler(_handler)
+
+        _start_listener(output)
+        atexit.register(stop_logging)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+    return env
+
+def stop_logging():
+    """Write out whatever is still queued and stop the writer thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def queue_stats():
+    """{'queued', 'dropped', 'sampled_out'} for this process"""
+    if _handler is None:
+        return {'queued': 0, 'dropped': 0, 'sampled_out': 0}
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped, 'sampled_out': _sampling.sampled_out}
+
+def _request_id():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    return incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+
+def init_app(app):
+    """Configure process logging and give every request an id"""
+    app.config.setdefault('APP_ENV', configure_logging())
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = _request_id()
+
+    @app.after_request
+    def echo_request_id(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
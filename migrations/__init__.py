@@ -0,0 +1,74 @@
+"""
+Versioned schema migrations
+
+Each migration is a module in this package named vNNNN_description.py that
+defines upgrade(engine). Applied versions are recorded in schema_migrations,
+so running upgrade() again only applies migrations that are new.
+"""
+import importlib
+import logging
+import pkgutil
+from datetime import datetime
+from sqlalchemy import text
+
+def discover():
+    """Return (version, module name) pairs for every migration, oldest first"""
+    found = []
+    for module_info in pkgutil.iter_modules(__path__):
+        name = module_info.name
+        if name.startswith('v') and name[1:5].isdigit():
+            found.append((int(name[1:5]), name))
+    return sorted(found)
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+
+def applied_versions(engine):
+    """Versions already recorded in schema_migrations"""
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def pending(engine):
+    """Migrations that have not been applied yet"""
+    done = applied_versions(engine)
+    return [(version, name) for version, name in discover() if version not in done]
+
+def upgrade(engine):
+    """Apply all pending migrations in order and return the names applied"""
+    applied = []
+    for version, name in pending(engine):
+        module = importlib.import_module(f'{__name__}.{name}')
+        logging.info(f"Applying migration {name}")
+        module.upgrade(engine)
+
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {'version': version, 'name': name, 'applied_at': datetime.utcnow()}
+            )
+        applied.append(name)
+    return applied
+
+def drop_invalid_index(conn, name):
+    """
+    Drop an index an interrupted CREATE INDEX CONCURRENTLY left INVALID (Postgres)
+
+    Such an index is never used and still makes IF NOT EXISTS skip the
+    build, so a rerun would succeed without it; call this right before
+    creating it.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :name AND n.nspname = current_schema() AND NOT i.indisvalid"
+    ), {'name': name}).first()
+    if invalid:
+        logging.warning(f"Dropping invalid index {name} left by an earlier build")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
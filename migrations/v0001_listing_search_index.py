@@ -0,0 +1,5 @@
+"""Full-text search index for listings (tsvector/pg_trgm on Postgres, FTS5 on SQLite)"""
+import search
+
+def upgrade(engine):
+    search.ensure_search_index()
@@ -0,0 +1,40 @@
+"""
+Indexes for the hot query paths
+
+- payments.transaction_id: looked up on every webhook, callback and status poll
+- available listings ordered by (created_at, id): buyer dashboard feed
+- listings by supplier ordered by (created_at, id): farmer dashboard
+- payments by supplier/buyer/listing and pending payments by age
+"""
+from sqlalchemy import text
+from migrations import drop_invalid_index
+
+# (name, table, columns, unique, where) - where is keyed by dialect
+INDEXES = [
+    ('ux_payments_transaction_id', 'payments', 'transaction_id', True, None),
+    ('ix_listings_available_created', 'listings', 'created_at DESC, id DESC', False,
+     {'postgresql': 'is_available', 'sqlite': 'is_available = 1'}),
+    ('ix_listings_supplier_created', 'listings', 'supplier_id, created_at DESC, id DESC', False, None),
+    ('ix_payments_supplier_created', 'payments', 'supplier_id, created_at', False, None),
+    ('ix_payments_buyer_created', 'payments', 'buyer_id, created_at', False, None),
+    ('ix_payments_listing', 'payments', 'listing_id', False, None),
+    ('ix_payments_pending_created', 'payments', 'created_at', False,
+     {'postgresql': "status = 'pending'", 'sqlite': "status = 'pending'"}),
+    ('ix_waiting_list_buyer', 'waiting_list', 'buyer_id', False, None),
+]
+
+def upgrade(engine):
+    dialect = engine.dialect.name
+
+    # Build indexes without blocking writes on Postgres (CONCURRENTLY cannot run in a transaction)
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    options = {'isolation_level': 'AUTOCOMMIT'} if dialect == 'postgresql' else {}
+
+    with engine.connect().execution_options(**options) as conn:
+        for name, table, columns, unique, where in INDEXES:
+            statement = f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})"
+            if where and dialect in where:
+                statement += f" WHERE {where[dialect]}"
+            drop_invalid_index(conn, name)
+            conn.execute(text(statement))
+        conn.commit()
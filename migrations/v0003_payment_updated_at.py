@@ -0,0 +1,12 @@
+"""Add payments.updated_at (read by the transaction status page and API but never created)"""
+from sqlalchemy import inspect, text
+
+def upgrade(engine):
+    columns = {column['name'] for column in inspect(engine).get_columns('payments')}
+    if 'updated_at' in columns:
+        return
+
+    column_type = 'TIMESTAMP WITHOUT TIME ZONE' if engine.dialect.name == 'postgresql' else 'DATETIME'
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE payments ADD COLUMN updated_at {column_type}"))
+        conn.execute(text("UPDATE payments SET updated_at = created_at WHERE updated_at IS NULL"))
@@ -0,0 +1,13 @@
+"""Keyset index on waiting_list (created_at, id) for incremental loading of the match index"""
+from sqlalchemy import text
+from migrations import drop_invalid_index
+
+def upgrade(engine):
+    dialect = engine.dialect.name
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    options = {'isolation_level': 'AUTOCOMMIT'} if dialect == 'postgresql' else {}
+
+    with engine.connect().execution_options(**options) as conn:
+        drop_invalid_index(conn, 'ix_waiting_list_created')
+        conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS ix_waiting_list_created ON waiting_list (created_at, id)"))
+        conn.commit()
@@ -0,0 +1,16 @@
+"""Add the checkout hold columns to listings (reserved_by, reserved_until, reservation_reference)"""
+from sqlalchemy import inspect, text
+
+def upgrade(engine):
+    columns = {column['name'] for column in inspect(engine).get_columns('listings')}
+    timestamp_type = 'TIMESTAMP WITHOUT TIME ZONE' if engine.dialect.name == 'postgresql' else 'DATETIME'
+    added = (
+        ('reserved_by', 'VARCHAR(36)'),
+        ('reserved_until', timestamp_type),
+        ('reservation_reference', 'TEXT')
+    )
+
+    with engine.begin() as conn:
+        for name, column_type in added:
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE listings ADD COLUMN {name} {column_type}"))
@@ -0,0 +1,88 @@
+"""
+Parsed quantities, range/sort indexes and facet counts for the buyer feed
+
+- listings.quantity_amount / quantity_unit, backfilled from the free-text
+  quantity in id order, BATCH_SIZE rows per transaction
+- partial indexes on available listings for the unit/quantity and
+  currency/price filters and the price sort
+- listing_facets (created by create_all) filled with the initial counts
+"""
+from sqlalchemy import bindparam, inspect, text
+from migrations import drop_invalid_index
+from validation import parse_quantity, DEFAULT_CURRENCY
+
+BATCH_SIZE = 1000
+
+INDEXES = [
+    ('ix_listings_available_unit_quantity', 'quantity_unit, quantity_amount, id'),
+    ('ix_listings_available_currency_price', 'currency, price, id'),
+    ('ix_listings_available_price', 'price, id'),
+]
+AVAILABLE = {'postgresql': 'is_available', 'sqlite': 'is_available = 1'}
+
+def _add_columns(engine):
+    columns = {column['name'] for column in inspect(engine).get_columns('listings')}
+    with engine.begin() as conn:
+        if 'quantity_amount' not in columns:
+            conn.execute(text("ALTER TABLE listings ADD COLUMN quantity_amount NUMERIC(14, 3)"))
+        if 'quantity_unit' not in columns:
+            conn.execute(text("ALTER TABLE listings ADD COLUMN quantity_unit TEXT"))
+
+def _backfill(engine):
+    update = text("UPDATE listings SET quantity_amount = :amount, quantity_unit = :unit WHERE id = :listing_id")
+    first = text("SELECT id, quantity FROM listings "
+                 "WHERE quantity_amount IS NULL AND quantity_unit IS NULL ORDER BY id LIMIT :limit")
+    select = text("SELECT id, quantity FROM listings WHERE id > :after "
+                  "AND quantity_amount IS NULL AND quantity_unit IS NULL ORDER BY id LIMIT :limit")
+    after = None
+    while True:
+        with engine.begin() as conn:
+            if after is None:
+                rows = conn.execute(first, {'limit': BATCH_SIZE}).all()
+            else:
+                rows = conn.execute(select, {'after': after, 'limit': BATCH_SIZE}).all()
+            if not rows:
+                return
+            values = []
+            for listing_id, quantity in rows:
+                amount, unit = parse_quantity(quantity)
+                if amount is not None:
+                    values.append({'listing_id': listing_id, 'amount': amount, 'unit': unit})
+            if values:
+                conn.execute(update, values)
+        after = rows[-1][0]
+
+def _create_indexes(engine):
+    dialect = engine.dialect.name
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    options = {'isolation_level': 'AUTOCOMMIT'} if dialect == 'postgresql' else {}
+
+    with engine.connect().execution_options(**options) as conn:
+        for name, columns in INDEXES:
+            statement = f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON listings ({columns})"
+            if dialect in AVAILABLE:
+                statement += f" WHERE {AVAILABLE[dialect]}"
+            drop_invalid_index(conn, name)
+            conn.execute(text(statement))
+        conn.commit()
+
+def _count_facets(engine):
+    available = AVAILABLE.get(engine.dialect.name, 'is_available = true')
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM listing_facets"))
+        conn.execute(text(
+            "INSERT INTO listing_facets (facet, value, count) "
+            f"SELECT 'currency', COALESCE(currency, :default_currency), COUNT(*) FROM listings WHERE {available} "
+            "GROUP BY COALESCE(currency, :default_currency)"
+        ).bindparams(bindparam('default_currency', DEFAULT_CURRENCY)))
+        conn.execute(text(
+            "INSERT INTO listing_facets (facet, value, count) "
+            f"SELECT 'unit', quantity_unit, COUNT(*) FROM listings WHERE {available} AND quantity_unit IS NOT NULL "
+            "GROUP BY quantity_unit"
+        ))
+
+def upgrade(engine):
+    _add_columns(engine)
+    _backfill(engine)
+    _create_indexes(engine)
+    _count_facets(engine)
@@ -0,0 +1,24 @@
+"""
+Normalized listing prices for cross-currency filtering and sorting
+
+Adds listings.price_base and its partial index. currency_rates is created
+by create_all; price_base stays NULL until `flask refresh-rates` first runs.
+"""
+from sqlalchemy import inspect, text
+from migrations import drop_invalid_index
+
+def upgrade(engine):
+    dialect = engine.dialect.name
+    columns = {column['name'] for column in inspect(engine).get_columns('listings')}
+    if 'price_base' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE listings ADD COLUMN price_base NUMERIC(14, 4)"))
+
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    options = {'isolation_level': 'AUTOCOMMIT'} if dialect == 'postgresql' else {}
+    where = {'postgresql': ' WHERE is_available', 'sqlite': ' WHERE is_available = 1'}.get(dialect, '')
+    with engine.connect().execution_options(**options) as conn:
+        drop_invalid_index(conn, 'ix_listings_available_price_base')
+        conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS ix_listings_available_price_base "
+                          f"ON listings (price_base, id){where}"))
+        conn.commit()
@@ -0,0 +1,31 @@
+"""
+Indexes for archival (see archive.py)
+
+listings_archive and payments_archive are created by create_all; these
+let the archive job find old settled payments and unavailable listings
+without scanning the hot tables.
+"""
+from sqlalchemy import text
+from migrations import drop_invalid_index
+
+# (name, table, columns, where) - where is keyed by dialect
+INDEXES = [
+    ('ix_payments_settled_created', 'payments', 'created_at, id',
+     {'postgresql': "status <> 'pending'", 'sqlite': "status <> 'pending'"}),
+    ('ix_listings_unavailable_created', 'listings', 'created_at, id',
+     {'postgresql': 'NOT is_available', 'sqlite': 'is_available = 0'}),
+]
+
+def upgrade(engine):
+    dialect = engine.dialect.name
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    options = {'isolation_level': 'AUTOCOMMIT'} if dialect == 'postgresql' else {}
+
+    with engine.connect().execution_options(**options) as conn:
+        for name, table, columns, where in INDEXES:
+            statement = f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})"
+            if dialect in where:
+                statement += f" WHERE {where[dialect]}"
+            drop_invalid_index(conn, name)
+            conn.execute(text(statement))
+        conn.commit()
@@ -0,0 +1,25 @@
+"""
+Partial index on failed webhook events
+
+webhook_events is never pruned; /metrics counts failed events on every
+scrape and `flask webhooks replay` selects them, which without this index
+scans every processed event. Pending events already have
+ix_webhook_events_pending_received.
+"""
+from sqlalchemy import text
+from migrations import drop_invalid_index
+
+WHERE = {'postgresql': "status = 'failed'", 'sqlite': "status = 'failed'"}
+
+def upgrade(engine):
+    dialect = engine.dialect.name
+    concurrently = 'CONCURRENTLY ' if dialect == 'postgresql' else ''
+    options = {'isolation_level': 'AUTOCOMMIT'} if dialect == 'postgresql' else {}
+
+    with engine.connect().execution_options(**options) as conn:
+        statement = f"CREATE INDEX {concurrently}IF NOT EXISTS ix_webhook_events_failed_received ON webhook_events (received_at)"
+        if dialect in WHERE:
+            statement += f" WHERE {WHERE[dialect]}"
+        drop_invalid_index(conn, 'ix_webhook_events_failed_received')
+        conn.execute(text(statement))
+        conn.commit()
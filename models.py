@@ -1,12 +1,12 @@
-import uuid
 from datetime import datetime
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from ids import UUIDKey, new_id
+from passwords import get_policy
 
 class User(db.Model):
     __tablename__ = 'users'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
     email = db.Column(db.Text, unique=True, nullable=False)
     role = db.Column(db.Text, nullable=False)
     name = db.Column(db.Text, nullable=False)
@@ -20,48 +20,191 @@ class User(db.Model):
     waiting_list_items = db.relationship('WaitingList', backref='buyer', lazy=True)
     
     def set_password(self, password):
-        """Set password hash"""
-        self.password_hash = generate_password_hash(password)
+        """Set password hash (may raise PasswordHashingBusy)"""
+        self.password_hash = get_policy().hash(password)
     
     def check_password(self, password):
-        """Check password against hash"""
-        return check_password_hash(self.password_hash, password)
+        """Check password against hash (may raise PasswordHashingBusy)"""
+        return get_policy().verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True if the stored hash predates the current hashing policy"""
+        return get_policy().needs_rehash(self.password_hash)
 
 class Listing(db.Model):
     __tablename__ = 'listings'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
     item_name = db.Column(db.Text, nullable=False)
     quantity = db.Column(db.Text, nullable=False)
+    # Parsed from quantity by validation.parse_quantity (kg for weights, l for volumes); NULL if unreadable
+    quantity_amount = db.Column(db.Numeric(14, 3), nullable=True)
+    quantity_unit = db.Column(db.Text, nullable=True)
     price = db.Column(db.Numeric(10, 2), nullable=True)
     currency = db.Column(db.Text, nullable=True)
+    # price in rates.BASE_CURRENCY at the applied rate (see rates.py); NULL without a price or rate
+    price_base = db.Column(db.Numeric(14, 4), nullable=True)
     is_available = db.Column(db.Boolean, default=True)
     contact = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    supplier_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    supplier_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    
+    # Checkout hold (see reservations.py; existing databases get these from migrations/v0005_listing_reservations.py)
+    reserved_by = db.Column(UUIDKey, nullable=True)
+    reserved_until = db.Column(db.DateTime, nullable=True)
+    reservation_reference = db.Column(db.Text, nullable=True)
     
     # Relationships
     payments = db.relationship('Payment', backref='listing', lazy=True)
+    
+    # Indexes (existing databases get these from migrations/v0002_hot_path_indexes.py)
+    __table_args__ = (
+        db.Index('ix_listings_available_created', created_at.desc(), id.desc(),
+                 postgresql_where=db.text('is_available'), sqlite_where=db.text('is_available = 1')),
+        db.Index('ix_listings_supplier_created', supplier_id, created_at.desc(), id.desc()),
+        # Range filters and sorts on the feed (migrations/v0006_listing_quantities.py)
+        db.Index('ix_listings_available_unit_quantity', quantity_unit, quantity_amount, id,
+                 postgresql_where=db.text('is_available'), sqlite_where=db.text('is_available = 1')),
+        db.Index('ix_listings_available_currency_price', currency, price, id,
+                 postgresql_where=db.text('is_available'), sqlite_where=db.text('is_available = 1')),
+        db.Index('ix_listings_available_price', price, id,
+                 postgresql_where=db.text('is_available'), sqlite_where=db.text('is_available = 1')),
+        # Cross-currency price filter and sort (migrations/v0007_price_normalization.py)
+        db.Index('ix_listings_available_price_base', price_base, id,
+                 postgresql_where=db.text('is_available'), sqlite_where=db.text('is_available = 1')),
+        # Unavailable listings by age, for archive.py (migrations/v0008_archive_indexes.py)
+        db.Index('ix_listings_unavailable_created', created_at, id,
+                 postgresql_where=db.text('NOT is_available'), sqlite_where=db.text('is_available = 0')),
+    )
 
 class Payment(db.Model):
     __tablename__ = 'payments'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    currency = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Text, nullable=False)
+    transaction_id = db.Column(db.Text, nullable=False)
+    supplier_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    buyer_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    listing_id = db.Column(UUIDKey, db.ForeignKey('listings.id'), nullable=False)
+    
+    # Indexes (existing databases get these from migrations/v0002_hot_path_indexes.py)
+    __table_args__ = (
+        db.Index('ux_payments_transaction_id', transaction_id, unique=True),
+        db.Index('ix_payments_supplier_created', supplier_id, created_at),
+        db.Index('ix_payments_buyer_created', buyer_id, created_at),
+        db.Index('ix_payments_listing', listing_id),
+        db.Index('ix_payments_pending_created', created_at,
+                 postgresql_where=db.text("status = 'pending'"), sqlite_where=db.text("status = 'pending'")),
+        # Settled payments by age, for archive.py (migrations/v0008_archive_indexes.py)
+        db.Index('ix_payments_settled_created', created_at, id,
+                 postgresql_where=db.text("status <> 'pending'"), sqlite_where=db.text("status <> 'pending'")),
+    )
+
+class ArchivedListing(db.Model):
+    """Sold listing moved out of listings by archive.py; same ids and columns, no checkout hold"""
+    __tablename__ = 'listings_archive'
+    
+    id = db.Column(UUIDKey, primary_key=True)
+    item_name = db.Column(db.Text, nullable=False)
+    quantity = db.Column(db.Text, nullable=False)
+    quantity_amount = db.Column(db.Numeric(14, 3), nullable=True)
+    quantity_unit = db.Column(db.Text, nullable=True)
+    price = db.Column(db.Numeric(10, 2), nullable=True)
+    currency = db.Column(db.Text, nullable=True)
+    price_base = db.Column(db.Numeric(14, 4), nullable=True)
+    is_available = db.Column(db.Boolean, default=False)
+    contact = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    supplier_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+class ArchivedPayment(db.Model):
+    """Settled payment moved out of payments by archive.py; listing_id may point at either listings table"""
+    __tablename__ = 'payments_archive'
+    
+    id = db.Column(UUIDKey, primary_key=True)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     currency = db.Column(db.Text, nullable=False)
     status = db.Column(db.Text, nullable=False)
     transaction_id = db.Column(db.Text, nullable=False)
-    supplier_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
-    buyer_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
-    listing_id = db.Column(db.String(36), db.ForeignKey('listings.id'), nullable=False)
+    supplier_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    buyer_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    listing_id = db.Column(UUIDKey, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    
+    # Only what the fallback lookups and exports need
+    __table_args__ = (
+        db.Index('ux_payments_archive_transaction_id', transaction_id, unique=True),
+        db.Index('ix_payments_archive_supplier_created', supplier_id, created_at),
+        db.Index('ix_payments_archive_buyer_created', buyer_id, created_at),
+        db.Index('ix_payments_archive_listing', listing_id),
+    )
+
+class SupplierDailySales(db.Model):
+    """Settled checkouts per supplier, day (of the checkout) and currency, maintained by sales.py"""
+    __tablename__ = 'supplier_daily_sales'
+    
+    supplier_id = db.Column(UUIDKey, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    currency = db.Column(db.Text, primary_key=True)
+    sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
 
 class WaitingList(db.Model):
     __tablename__ = 'waiting_list'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     item_requested = db.Column(db.Text, nullable=False)
     contact = db.Column(db.Text, nullable=False)
     is_notified = db.Column(db.Text, default='no')
-    buyer_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    buyer_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
+    
+    # Indexes (existing databases get these from migrations/v0002_hot_path_indexes.py)
+    __table_args__ = (
+        db.Index('ix_waiting_list_buyer', buyer_id),
+        db.Index('ix_waiting_list_created', created_at, id),
+    )
+
+class WebhookEvent(db.Model):
+    __tablename__ = 'webhook_events'
+    
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
+    event_key = db.Column(db.Text, unique=True, nullable=False)
+    event_type = db.Column(db.Text, nullable=False)
+    reference = db.Column(db.Text, nullable=True)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Text, nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_webhook_events_pending_received', received_at,
+                 postgresql_where=db.text("status = 'pending'"), sqlite_where=db.text("status = 'pending'")),
+        # Failed events for /metrics and replays (migrations/v0009_webhook_failed_index.py)
+        db.Index('ix_webhook_events_failed_received', received_at,
+                 postgresql_where=db.text("status = 'failed'"), sqlite_where=db.text("status = 'failed'")),
+    )
+
+class ListingFacet(db.Model):
+    __tablename__ = 'listing_facets'
+    
+    facet = db.Column(db.Text, primary_key=True)
+    value = db.Column(db.Text, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)  # available listings, maintained by facets.py
+
+class CurrencyRate(db.Model):
+    __tablename__ = 'currency_rates'
+    
+    currency = db.Column(db.Text, primary_key=True)
+    rate = db.Column(db.Numeric(18, 8), nullable=False)  # units of this currency per one rates.BASE_CURRENCY
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
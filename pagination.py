@@ -0,0 +1,139 @@
+import base64
+from collections import namedtuple
+from types import SimpleNamespace
+from datetime import datetime
+from sqlalchemy import tuple_
+from models import Listing
+from cache import cached_type
+
+# Default and maximum number of listings per page
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Registered so the shared cache can store pages of the feed
+Page = cached_type(namedtuple('Page', ['items', 'next_cursor']))
+
+def page_size(value):
+    """Clamp a requested page size to a sane range"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+def encode_cursor(created_at, listing_id):
+    """Encode a (created_at, id) keyset position as an opaque URL-safe string"""
+    raw = f"{created_at.isoformat()}|{listing_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def encode_offset_cursor(offset):
+    """Encode an offset position (used for relevance-ranked search results)"""
+    raw = f"offset|{offset}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor or encode_offset_cursor
+    Returns ('keyset', (created_at, id)), ('offset', n) or None for a missing/invalid cursor
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        head, tail = raw.split('|', 1)
+        if head == 'offset':
+            return 'offset', max(0, int(tail))
+        return 'keyset', (datetime.fromisoformat(head), tail)
+    except (ValueError, UnicodeError):
+        return None
+
+def _listing_of(row):
+    """Rows are either a Listing or a (Listing, User) tuple"""
+    return row[0] if isinstance(row, tuple) or hasattr(row, '_mapping') else row
+
+def keyset_query(query, cursor=None, limit=PAGE_SIZE):
+    """Order a Listing query newest first on (created_at, id) and seek past the cursor"""
+    query = query.order_by(Listing.created_at.desc(), Listing.id.desc())
+
+    decoded = decode_cursor(cursor)
+    if decoded and decoded[0] == 'keyset':
+        created_at, listing_id = decoded[1]
+        query = query.filter(tuple_(Listing.created_at, Listing.id) < tuple_(
+            created_at, listing_id, types=(Listing.created_at.type, Listing.id.type)))
+
+    # One extra row tells us whether there is a next page
+    return query.limit(limit + 1)
+
+def keyset_page(query, cursor=None, limit=PAGE_SIZE):
+    """
+    Fetch one page of a Listing query ordered newest first on (created_at, id)
+    Only limit + 1 rows are read no matter how large the table is
+    """
+    rows = keyset_query(query, cursor, limit).all()
+    items = rows[:limit]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = _listing_of(items[-1])
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return Page(items, next_cursor)
+
+def offset_page(query, cursor=None, limit=PAGE_SIZE):
+    """
+    Fetch one page of an already-ordered query (e.g. ranked search results)
+    Relevance order has no stable keyset, so the cursor carries an offset
+    """
+    decoded = decode_cursor(cursor)
+    offset = decoded[1] if decoded and decoded[0] == 'offset' else 0
+
+    rows = query.offset(offset).limit(limit + 1).all()
+    items = rows[:limit]
+
+    next_cursor = encode_offset_cursor(offset + limit) if len(rows) > limit else None
+    return Page(items, next_cursor)
+
+def serialize_listing(listing, supplier=None, display=None):
+    """
+    JSON representation of a listing for the /api/listings feed
+    display is an optional (currency, rate from the base currency) to add a converted price in
+    """
+    data = {
+        'id': listing.id,
+        'item_name': listing.item_name,
+        'quantity': listing.quantity,
+        'quantity_amount': float(listing.quantity_amount) if listing.quantity_amount is not None else None,
+        'quantity_unit': listing.quantity_unit,
+        'price': float(listing.price) if listing.price is not None else None,
+        'currency': listing.currency or 'USD',
+        'contact': listing.contact,
+        'is_available': bool(listing.is_available),
+        'created_at': listing.created_at.isoformat() if listing.created_at else None,
+        'supplier_name': supplier.name if supplier else None
+    }
+    price_base = getattr(listing, 'price_base', None)
+    if display and price_base is not None and listing.currency != display[0]:
+        data['converted_price'] = {'amount': round(float(price_base * display[1]), 2), 'currency': display[0]}
+    return data
+
+def listing_snapshot(listing):
+    """Detached copy of a listing's columns, safe to cache and share between requests"""
+    return SimpleNamespace(
+        id=listing.id,
+        item_name=listing.item_name,
+        quantity=listing.quantity,
+        quantity_amount=listing.quantity_amount,
+        quantity_unit=listing.quantity_unit,
+        price=listing.price,
+        currency=listing.currency,
+        price_base=listing.price_base,
+        contact=listing.contact,
+        is_available=listing.is_available,
+        created_at=listing.created_at,
+        supplier_id=listing.supplier_id
+    )
+
+def supplier_snapshot(user):
+    """Detached copy of the supplier fields shown next to a listing"""
+    return SimpleNamespace(id=user.id, name=user.name)
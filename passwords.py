@@ -0,0 +1,94 @@
+"""
+Password hashing policy
+
+Hashing is deliberately CPU-heavy, so during a login burst it could take
+every worker thread and starve the rest of the site. All hashing goes
+through a gate that allows at most PASSWORD_HASH_CONCURRENCY hashes per
+process at once; a caller that cannot get a slot within
+PASSWORD_HASH_QUEUE_TIMEOUT seconds gets PasswordHashingBusy (the login
+route answers 503 with Retry-After) instead of piling up. hashlib's scrypt
+and pbkdf2 release the GIL, so waiting threads keep serving other routes.
+Under gunicorn the cap is per worker process.
+
+Under gevent workers the hash itself runs on gevent's OS thread pool so it
+does not stall the other greenlets.
+
+PASSWORD_HASH_METHOD takes any Werkzeug method string ('scrypt',
+'scrypt:16384:8:1', 'pbkdf2:sha256:600000', ...). Hashes made under an
+older policy still verify and are upgraded on the next successful login.
+"""
+import os
+import sys
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt'
+DEFAULT_CONCURRENCY = 2
+DEFAULT_QUEUE_TIMEOUT = 2.0
+
+class PasswordHashingBusy(Exception):
+    """No hashing slot became free within the queue timeout"""
+
+class HashingPolicy:
+    """Hash method plus the concurrency gate every hash and verification passes through"""
+
+    def __init__(self, method=DEFAULT_METHOD, concurrency=DEFAULT_CONCURRENCY, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.method = method
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._prefix = None
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHashingBusy(f'No password hashing slot free within {self.queue_timeout}s')
+        try:
+            if _gevent_patched():
+                # Under gevent workers a hash would stall every greenlet; run it on a real OS thread
+                from gevent import get_hub
+                return get_hub().threadpool.apply(function, args)
+            return function(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different method or cost than the policy's"""
+        return password_hash.split('$', 1)[0] != self.prefix()
+
+    def prefix(self):
+        # Werkzeug fills in default costs ('scrypt' -> 'scrypt:32768:8:1'); let it tell us the full form once
+        if self._prefix is None:
+            self._prefix = self.hash('').split('$', 1)[0]
+        return self._prefix
+
+def _gevent_patched():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+_policy = None
+_policy_lock = threading.Lock()
+
+def get_policy():
+    """Return the process-wide policy, creating it from the environment on first use"""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = HashingPolicy(
+                    method=os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+                    concurrency=int(os.environ.get('PASSWORD_HASH_CONCURRENCY', DEFAULT_CONCURRENCY)),
+                    queue_timeout=float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT))
+                )
+    return _policy
+
+def set_policy(policy):
+    """Replace the process-wide policy (e.g. a cheaper method for local tooling)"""
+    global _policy
+    with _policy_lock:
+        _policy = policy
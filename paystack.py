@@ -0,0 +1,215 @@
+"""
+Paystack API client
+
+Keeps one pooled requests.Session per process (no TLS handshake per checkout),
+bounds every call with connect/read timeouts, retries idempotent calls with
+jittered backoff and trips a circuit breaker when Paystack is degraded so
+callers fail fast instead of pinning workers.
+
+Configured from the environment:
+    PAYSTACK_SECRET_KEY, PAYSTACK_BASE_URL (point at a local fake for testing),
+    PAYSTACK_CONNECT_TIMEOUT, PAYSTACK_READ_TIMEOUT, PAYSTACK_MAX_RETRIES,
+    PAYSTACK_POOL_SIZE, PAYSTACK_BREAKER_THRESHOLD, PAYSTACK_BREAKER_RESET
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+DEFAULT_BASE_URL = 'https://api.paystack.co'
+
+# Statuses worth retrying on an idempotent call
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+PaystackResponse = namedtuple('PaystackResponse', ['status_code', 'data'])
+
+class PaystackError(Exception):
+    """Base class for Paystack client errors"""
+
+class PaystackUnavailable(PaystackError):
+    """Paystack could not be reached, timed out, returned a 5xx or the circuit is open"""
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. After `threshold` consecutive failures it opens
+    and rejects calls for `reset_timeout` seconds, then lets one trial call
+    through (half-open); success closes it again, failure re-opens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Return True if a call may proceed right now"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def is_open(self):
+        """True while calls would be rejected, without consuming the half-open trial"""
+        with self._lock:
+            return self._state() == 'open' or (self._state() == 'half-open' and self._trial_in_flight)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+class PaystackClient:
+    """Thread-safe client for the Paystack REST API"""
+
+    def __init__(self, secret_key, base_url=DEFAULT_BASE_URL, connect_timeout=3.05, read_timeout=10.0,
+                 max_retries=2, backoff=0.25, backoff_cap=2.0, pool_size=20, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+
+        # requests is imported on first use so app start-up (and cold starts) don't pay for it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {secret_key}',
+            'Content-Type': 'application/json'
+        })
+
+    def is_available(self):
+        """False while the circuit breaker is open (Paystack considered degraded)"""
+        return not self.breaker.is_open()
+
+    def initialize_transaction(self, payload):
+        """POST /transaction/initialize (not idempotent: only retried if the connection was never made)"""
+        return self._request('POST', '/transaction/initialize', idempotent=False, json=payload)
+
+    def verify_transaction(self, reference):
+        """GET /transaction/verify/<reference>"""
+        return self._request('GET', f'/transaction/verify/{quote(reference, safe="")}', idempotent=True)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spreads retries from many workers so they don't arrive together
+        time.sleep(random.uniform(0, min(self.backoff_cap, self.backoff * (2 ** attempt))))
+
+    def _request(self, method, path, idempotent, **kwargs):
+        if not self.breaker.allow():
+            raise PaystackUnavailable('Paystack circuit breaker is open')
+        try:
+            return self._send(method, path, idempotent, **kwargs)
+        except PaystackUnavailable:
+            # Already recorded by _send
+            raise
+        except BaseException:
+            # Anything else (a bug, an unexpected error from requests, a worker timeout) still
+            # counts, so a half-open trial can't stay taken and reject every later call
+            self.breaker.record_failure()
+            raise
+
+    def _send(self, method, path, idempotent, **kwargs):
+        import requests
+
+        url = f'{self.base_url}{path}'
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.ConnectTimeout as e:
+                # The request never reached Paystack, so even a POST is safe to retry
+                error = e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent:
+                    self.breaker.record_failure()
+                    raise PaystackUnavailable(f'Paystack request failed: {e}') from e
+                error = e
+            else:
+                if response.status_code in RETRY_STATUSES and idempotent and attempt < self.max_retries:
+                    error = PaystackUnavailable(f'Paystack returned {response.status_code}')
+                elif response.status_code >= 500:
+                    self.breaker.record_failure()
+                    raise PaystackUnavailable(f'Paystack returned {response.status_code}: {response.text[:200]}')
+                else:
+                    self.breaker.record_success()
+                    return PaystackResponse(response.status_code, _json_or_empty(response))
+
+            if attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise PaystackUnavailable(f'Paystack request failed after {attempt + 1} attempts: {error}') from error
+
+            logging.warning(f"Retrying Paystack {method} {path} after error: {error}")
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+def _json_or_empty(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide Paystack client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaystackClient(
+                    secret_key=os.environ.get('PAYSTACK_SECRET_KEY', ''),
+                    base_url=os.environ.get('PAYSTACK_BASE_URL', DEFAULT_BASE_URL),
+                    connect_timeout=float(os.environ.get('PAYSTACK_CONNECT_TIMEOUT', 3.05)),
+                    read_timeout=float(os.environ.get('PAYSTACK_READ_TIMEOUT', 10)),
+                    max_retries=int(os.environ.get('PAYSTACK_MAX_RETRIES', 2)),
+                    pool_size=int(os.environ.get('PAYSTACK_POOL_SIZE', 20)),
+                    breaker=CircuitBreaker(
+                        threshold=int(os.environ.get('PAYSTACK_BREAKER_THRESHOLD', 5)),
+                        reset_timeout=float(os.environ.get('PAYSTACK_BREAKER_RESET', 30))
+                    )
+                )
+    return _client
+
+def reset_client():
+    """Drop the process-wide client so the next call picks up new settings"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
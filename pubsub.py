@@ -0,0 +1,144 @@
+"""
+Publish/subscribe for pushing payment status changes to waiting clients
+
+The default broker is in-process: fine for a single worker. Set PUBSUB_URL to
+a redis:// URL to fan messages out across workers and hosts (requires the
+optional `redis` package).
+"""
+import json
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+
+# Bound per-subscriber buffers so a stalled client can't grow memory without limit
+SUBSCRIBER_QUEUE_SIZE = 16
+
+class Subscription:
+    """A single subscriber's view of one channel"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        """Wait for the next message, returning None on timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class InProcessBroker:
+    """Fan messages out to subscribers in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                logging.warning(f"Dropping message for slow subscriber on {channel}")
+        return len(subscribers)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is None:
+                return sum(len(subscribers) for subscribers in self._subscribers.values())
+            return len(self._subscribers.get(channel, ()))
+
+class RedisBroker(InProcessBroker):
+    """
+    Publish through Redis so every worker sees every message
+    One listener thread per process forwards Redis messages to local subscribers
+    """
+
+    def __init__(self, url, pattern='*'):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("PUBSUB_URL points at Redis but the 'redis' package is not installed")
+
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(**{pattern: self._forward})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def _forward(self, raw):
+        channel = raw['channel'].decode('utf-8')
+        try:
+            message = json.loads(raw['data'])
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring malformed pub/sub message on {channel}")
+            return
+        super().publish(channel, message)
+
+    def publish(self, channel, message):
+        return self._client.publish(channel, json.dumps(message))
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    """Return the process-wide broker, creating it on first use"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = os.environ.get('PUBSUB_URL', '')
+                if url.startswith(('redis://', 'rediss://')):
+                    _broker = RedisBroker(url)
+                else:
+                    _broker = InProcessBroker()
+    return _broker
+
+def set_broker(broker):
+    """Replace the process-wide broker (e.g. with a custom implementation)"""
+    global _broker
+    with _broker_lock:
+        _broker = broker
+
+def payment_channel(reference):
+    return f"payment:{reference}"
+
+def publish_payment_status(payment):
+    """Notify clients waiting on a payment that its status changed"""
+    message = {
+        'status': payment.status,
+        'updated_at': payment.updated_at.isoformat() if payment.updated_at else None
+    }
+    try:
+        get_broker().publish(payment_channel(payment.transaction_id), message)
+    except Exception as e:
+        # Clients fall back to re-checking the database, so a broker outage is not fatal
+        logging.error(f"Error publishing payment status: {str(e)}")
@@ -0,0 +1,125 @@
+"""
+Query plan check for the hot route queries
+
+Runs EXPLAIN on a representative query for each route and reports any
+sequential scan over a large table. Used by `flask check-query-plans`.
+"""
+import json
+import re
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from app import db
+from models import User, Listing, Payment, ArchivedPayment, SupplierDailySales, WebhookEvent
+from pagination import PAGE_SIZE, keyset_query, encode_cursor
+
+# Tables that grow with usage and must never be scanned in full
+LARGE_TABLES = ('users', 'listings', 'payments', 'waiting_list', 'listings_archive', 'payments_archive',
+                'supplier_daily_sales', 'webhook_events')
+
+_SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN wrapper that keeps the wrapped statement's bound parameters"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == 'postgresql':
+        prefix = 'EXPLAIN (FORMAT JSON) '
+    else:
+        prefix = 'EXPLAIN QUERY PLAN '
+    sql = prefix + compiler.process(element.statement, **kw)
+    # The rows are plan lines, not the statement's columns; don't run its result processors on them
+    compiler._result_columns = []
+    return sql
+
+def route_queries():
+    """Representative query for every route, keyed by a description of where it runs"""
+    from routes import buyer_listings_query, farmer_listings_query
+    from filters import NO_FILTERS
+    from rates import RateTable
+    from exports import payments_export_statements
+    import archive
+    import sales
+
+    probe_id = '00000000-0000-0000-0000-000000000000'
+    probe_cursor = encode_cursor(datetime.utcnow(), probe_id)
+    probe_rates = RateTable({'USD': Decimal(1), 'GHS': Decimal(15)})
+
+    return {
+        'login/register: user by email': User.query.filter_by(email='probe@example.com'),
+        'farmer_dashboard: first page': keyset_query(farmer_listings_query(probe_id), None, PAGE_SIZE),
+        'farmer_dashboard: next page': keyset_query(farmer_listings_query(probe_id), probe_cursor, PAGE_SIZE),
+        'buyer_dashboard: first page': keyset_query(buyer_listings_query(), None, PAGE_SIZE),
+        'buyer_dashboard: next page': keyset_query(buyer_listings_query(), probe_cursor, PAGE_SIZE),
+        'buyer_dashboard: search': buyer_listings_query('tomatoes').limit(PAGE_SIZE + 1),
+        'buyer_dashboard: quantity range': keyset_query(buyer_listings_query('', NO_FILTERS._replace(
+            unit='kg', min_quantity=500)), None, PAGE_SIZE),
+        'buyer_dashboard: price range in a currency, by price': buyer_listings_query('', NO_FILTERS._replace(
+            currency='GHS', max_price=300, sort='price_asc')).limit(PAGE_SIZE + 1),
+        'buyer_dashboard: sorted by price': buyer_listings_query('', NO_FILTERS._replace(
+            sort='price_desc')).limit(PAGE_SIZE + 1),
+        'buyer_dashboard: price range in the buyer currency, by price': buyer_listings_query('', NO_FILTERS._replace(
+            price_currency='GHS', max_price=300, sort='price_asc'), probe_rates).limit(PAGE_SIZE + 1),
+        'update/delete_listing: owned listing': Listing.query.filter_by(id=probe_id, supplier_id=probe_id),
+        'paystack_initiate: available listing': db.session.query(Listing, User).join(
+            User, Listing.supplier_id == User.id).filter(Listing.id == probe_id, Listing.is_available == True),
+        'webhook/status/callback: payment by reference': Payment.query.filter_by(transaction_id='fb_probe'),
+        'status/callback: archived payment by reference': ArchivedPayment.query.filter_by(transaction_id='fb_probe'),
+        'export: archived payments of a supplier': payments_export_statements(supplier_id=probe_id)[1],
+        'archive: settled payments batch': archive._batch_query(
+            Payment, archive._archivable_payments(datetime.utcnow()), None, archive.BATCH_SIZE),
+        'archive: sold listings batch': archive._batch_query(
+            Listing, archive._archivable_listings(datetime.utcnow()), None, archive.BATCH_SIZE),
+        'farmer_analytics: rollup rows': SupplierDailySales.query.filter(
+            SupplierDailySales.supplier_id == probe_id, SupplierDailySales.day >= datetime.utcnow().date()),
+        'rebuild-sales: supplier batch': sales._rollup_select([probe_id]),
+        'webhook worker/metrics: pending events': WebhookEvent.query.filter_by(status='pending').order_by(
+            WebhookEvent.received_at).limit(100),
+        'metrics/webhooks replay: failed events': WebhookEvent.query.filter_by(status='failed'),
+    }
+
+def _postgres_seq_scans(plan):
+    """Walk a Postgres JSON plan and yield the relations read by a Seq Scan"""
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from _postgres_seq_scans(child)
+
+def explain(query):
+    """Return (plan text, list of large tables scanned sequentially) for a query"""
+    dialect = db.engine.dialect.name
+    statement = query.statement if hasattr(query, 'statement') else query
+
+    if dialect == 'postgresql':
+        # Disable seq scans so a small table still reports whether an index is usable
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        raw = db.session.execute(Explain(statement)).scalar()
+        plan = raw if isinstance(raw, list) else json.loads(raw)
+        scanned = [name for name in _postgres_seq_scans(plan[0]['Plan']) if name in LARGE_TABLES]
+        return json.dumps(plan, indent=2), scanned
+
+    rows = db.session.execute(Explain(statement)).all()
+    details = [row[-1] for row in rows]
+    scanned = []
+    for detail in details:
+        match = _SQLITE_FULL_SCAN.match(detail)
+        if match and match.group(1) in LARGE_TABLES:
+            scanned.append(match.group(1))
+    return '\n'.join(details), scanned
+
+def check_query_plans():
+    """Explain every route query and return {description: (plan, scanned tables)}"""
+    results = {}
+    try:
+        for description, query in route_queries().items():
+            results[description] = explain(query)
+    finally:
+        db.session.rollback()
+    return results
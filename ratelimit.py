@@ -0,0 +1,333 @@
+"""
+Rate limits and load shedding for the expensive endpoints
+
+/login and /register spend a scrypt hash per attempt, and
+/paystack/initiate makes a provider call and a pending Payment row. Each of
+those routes has a policy:
+
+    token buckets   one per client IP and one per session (the signed-in
+                    user, or an id kept in the session cookie). A request
+                    takes a token from each; an empty bucket gets 429 with
+                    Retry-After saying when the next token arrives.
+    concurrency     a process-wide cap on requests of that group in flight
+                    (login and register share "auth", initiate uses
+                    "checkout"). Past the cap the request gets 503 with
+                    Retry-After at once, instead of queueing for a worker
+                    thread that dashboards also need.
+
+The "stream" group caps the transaction status streams (see hold()), which
+keep a worker thread for their whole lifetime; past it the page polls.
+
+Buckets live in process memory by default, so with several workers each
+one counts separately. Set RATE_LIMIT_URL to a redis:// URL to share them
+across workers and hosts (requires the optional `redis` package). If the
+shared backend is unreachable, requests are let through and the error is
+logged.
+
+    RATE_LIMITS         "off" to disable, or overrides of the form
+                        "policy.scope=COUNT/SECONDS[:BURST]", e.g.
+                        "login.ip=60/60:20,initiate.session=5/60"
+    CONCURRENCY_LIMITS  "auth=6,checkout=8,stream=6" (0 removes a cap)
+    RATE_LIMIT_URL      shared bucket store
+"""
+import functools
+import logging
+import math
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask import request, session
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+# Buckets kept by the in-memory backend; the least recently used one is forgotten first
+MEMORY_MAX_KEYS = 100000
+SESSION_KEY = '_rl'
+
+class Rate:
+    """COUNT requests per SECONDS, with bursts of up to BURST"""
+
+    def __init__(self, count, seconds, burst=None):
+        self.count = count
+        self.seconds = seconds
+        self.burst = burst or count
+        self.per_second = count / seconds
+
+    @classmethod
+    def parse(cls, spec):
+        """Rate from "COUNT/SECONDS[:BURST]"; ValueError if it is not one"""
+        rate, _, burst = spec.partition(':')
+        count, _, seconds = rate.partition('/')
+        count, seconds = int(count), float(seconds or 1)
+        burst = int(burst) if burst else None
+        if count <= 0 or seconds <= 0 or (burst is not None and burst <= 0):
+            raise ValueError(spec)
+        return cls(count, seconds, burst)
+
+    def __repr__(self):
+        return f'{self.count}/{self.seconds:g}:{self.burst}'
+
+class Policy:
+    """Buckets by scope ('ip', 'session') plus the concurrency group for one route"""
+
+    def __init__(self, name, rates, concurrency=None):
+        self.name = name
+        self.rates = dict(rates)
+        self.concurrency = concurrency
+
+POLICIES = {
+    'login': Policy('login', {'ip': Rate(30, 60, 10), 'session': Rate(10, 60, 5)}, 'auth'),
+    'register': Policy('register', {'ip': Rate(10, 3600, 5), 'session': Rate(5, 3600, 3)}, 'auth'),
+    'initiate': Policy('initiate', {'ip': Rate(60, 60, 20), 'session': Rate(10, 60, 5)}, 'checkout'),
+}
+# gunicorn.conf.py gives each worker 16 threads; these leave most of them for everything else
+CONCURRENCY = {'auth': 6, 'checkout': 8, 'stream': 6}
+
+class RateLimited(TooManyRequests):
+    """A bucket for this client is empty"""
+
+    def __init__(self, policy, scope, retry_after):
+        super().__init__(retry_after=retry_after)
+        self.policy = policy
+        self.scope = scope
+
+class OverCapacity(ServiceUnavailable):
+    """Too many requests of this group are already in flight"""
+
+    def __init__(self, group, retry_after):
+        super().__init__(retry_after=retry_after)
+        self.group = group
+
+class MemoryBackend:
+    """Token buckets in this process"""
+
+    def __init__(self, max_keys=MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate):
+        """Take a token; returns 0 if there was one, else seconds until there will be"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (rate.burst, now))
+            tokens = min(rate.burst, tokens + (now - updated) * rate.per_second)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate.per_second
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+# Same arithmetic as MemoryBackend.take, atomic on the Redis server and on its clock
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local per_second = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * per_second)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / per_second * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisBackend:
+    """Token buckets in Redis, shared by every worker and host"""
+
+    def __init__(self, url, prefix='ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_URL points at Redis but the 'redis' package is not installed")
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, rate):
+        return float(self._take(keys=[self.prefix + key], args=[rate.per_second, rate.burst]))
+
+    def reset(self):
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+
+class ConcurrencyCap:
+    """At most `limit` holders at once; the rest are turned away, not queued"""
+
+    def __init__(self, name, limit, retry_after=1):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.shed = 0
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.shed += 1
+            raise OverCapacity(self.name, self.retry_after)
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+class Limiter:
+    """Policies, caps and the bucket backend; check() raises RateLimited"""
+
+    def __init__(self, backend=None, policies=None, concurrency=None, enabled=True):
+        self.backend = backend or MemoryBackend()
+        self.policies = dict(POLICIES if policies is None else policies)
+        limits = CONCURRENCY if concurrency is None else concurrency
+        self.caps = {name: ConcurrencyCap(name, limit) for name, limit in limits.items() if limit > 0}
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.limited = {}
+
+    def check(self, name, keys):
+        """Take a token from each of the policy's buckets; keys maps scope -> client key"""
+        policy = self.policies[name]
+        wait, scope = 0.0, None
+        for bucket_scope, rate in policy.rates.items():
+            key = keys.get(bucket_scope)
+            if key is None:
+                continue
+            try:
+                bucket_wait = self.backend.take(f'{name}:{bucket_scope}:{key}', rate)
+            except Exception as e:
+                # Failing open: an unreachable bucket store must not lock everyone out
+                logging.error(f"Error checking rate limit: {str(e)}")
+                continue
+            if bucket_wait > wait:
+                wait, scope = bucket_wait, bucket_scope
+        if scope is not None:
+            with self._lock:
+                self.limited[(name, scope)] = self.limited.get((name, scope), 0) + 1
+            raise RateLimited(name, scope, max(1, math.ceil(wait)))
+
+    def cap(self, name):
+        policy = self.policies.get(name)
+        return self.caps.get(policy.concurrency) if policy else None
+
+def _parse_overrides(spec, policies):
+    for item in spec.split(','):
+        key, sep, value = item.partition('=')
+        name, _, scope = key.strip().partition('.')
+        if not sep or name not in policies or not scope:
+            continue
+        try:
+            policies[name].rates[scope] = Rate.parse(value.strip())
+        except ValueError:
+            logging.warning(f"Ignoring invalid rate limit {item.strip()}")
+
+def _parse_concurrency(spec):
+    limits = dict(CONCURRENCY)
+    for item in spec.split(','):
+        key, sep, value = item.partition('=')
+        if sep and key.strip():
+            try:
+                limits[key.strip()] = int(value)
+            except ValueError:
+                logging.warning(f"Ignoring invalid concurrency limit {item.strip()}")
+    return limits
+
+def limiter_from_env():
+    """A Limiter configured from RATE_LIMITS, CONCURRENCY_LIMITS and RATE_LIMIT_URL"""
+    spec = os.environ.get('RATE_LIMITS', '').strip()
+    if spec.lower() in ('off', '0', 'false', 'no'):
+        return Limiter(policies={}, concurrency={}, enabled=False)
+    policies = {name: Policy(name, policy.rates, policy.concurrency) for name, policy in POLICIES.items()}
+    _parse_overrides(spec, policies)
+    url = os.environ.get('RATE_LIMIT_URL', '')
+    backend = RedisBackend(url) if url.startswith(('redis://', 'rediss://')) else MemoryBackend()
+    return Limiter(backend, policies, _parse_concurrency(os.environ.get('CONCURRENCY_LIMITS', '')))
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    """Return the process-wide limiter, creating it on first use"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = limiter_from_env()
+    return _limiter
+
+def set_limiter(limiter):
+    """Replace the process-wide limiter (e.g. with another backend or policies)"""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+def client_keys():
+    """Bucket keys for the current request: its IP and its session"""
+    if 'user_id' in session:
+        session_key = f"user:{session['user_id']}"
+    else:
+        if SESSION_KEY not in session:
+            session[SESSION_KEY] = secrets.token_urlsafe(12)
+        session_key = f'anon:{session[SESSION_KEY]}'
+    return {'ip': request.remote_addr or 'unknown', 'session': session_key}
+
+def limited(name, methods=('POST',)):
+    """Apply policy `name` to a view for the given methods"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = get_limiter()
+            if not limiter.enabled or request.method not in methods or name not in limiter.policies:
+                return view(*args, **kwargs)
+            limiter.check(name, client_keys())
+            cap = limiter.cap(name)
+            if cap is None:
+                return view(*args, **kwargs)
+            cap.acquire()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                cap.release()
+        return wrapper
+    return decorator
+
+def hold(group):
+    """
+    Take a slot in concurrency group `group` for a response that outlives
+    its view, e.g. a stream; returns the function that gives it back.
+    Raises OverCapacity when the group is full.
+    """
+    limiter = get_limiter()
+    cap = limiter.caps.get(group) if limiter.enabled else None
+    if cap is None:
+        return lambda: None
+    cap.acquire()
+    return cap.release
+
+def stats():
+    """{'limited': {(policy, scope): n}, 'caps': {group: (in_flight, limit, shed)}} for this process"""
+    limiter = get_limiter()
+    with limiter._lock:
+        limited_counts = dict(limiter.limited)
+    return {'limited': limited_counts,
+            'caps': {name: (cap.in_flight, cap.limit, cap.shed) for name, cap in limiter.caps.items()}}
@@ -0,0 +1,246 @@
+"""
+Currency rates and normalized listing prices
+
+Listings are priced in their own currency, so prices can only be compared
+after conversion. Every listing stores price_base, its price in
+BASE_CURRENCY, and the feed filters and sorts on that indexed column.
+Nothing is converted per row at query time; only the buyer's bounds are
+converted, once per request.
+
+Rates come from a pluggable source. RATES_SOURCE is either a path to a
+JSON file ({"base": "USD", "rates": {"GHS": 15.4, ...}}, units of each
+currency per base unit) or an http(s) URL that returns the same shape
+(a "base_code" key is accepted too). Any object with fetch() -> RateTable
+can be installed with set_source().
+
+`flask refresh-rates` (run it from cron, or with --interval) fetches the
+source and stores the rates it applied in currency_rates. For every
+currency whose rate changed, it then recomputes price_base in id-ordered
+batches of BATCH_SIZE rows, one transaction each. Listing writes compute
+price_base from currency_rates in the same statement
+(normalized_price()), so they always use the applied rates. The only
+exception is a listing inserted during a rate change, which can keep the
+old rate. `flask refresh-rates --all` recomputes everything.
+
+Web processes read the applied rates through an in-memory cache that is
+reloaded after RATES_CACHE_TTL seconds (default 300).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import Numeric, cast, func, or_, select
+from app import db
+from models import CurrencyRate, Listing
+from cache import invalidate_listings
+
+BASE_CURRENCY = 'USD'
+DEFAULT_CACHE_TTL = 300
+BATCH_SIZE = 1000
+
+# Stored rates and normalized prices are rounded to these places
+RATE_PLACES = Decimal('0.00000001')
+PRICE_PLACES = 4
+
+class RatesUnavailable(Exception):
+    """The rate source could not be read or returned nothing usable"""
+
+class RateTable:
+    """Units of each currency per one BASE_CURRENCY"""
+
+    def __init__(self, rates, base=BASE_CURRENCY):
+        self.base = base
+        self.rates = dict(rates)
+
+    def rate(self, currency):
+        return self.rates.get(currency)
+
+    def to_base(self, amount, currency):
+        rate = self.rate(currency)
+        return None if amount is None or not rate else Decimal(str(amount)) / rate
+
+    def from_base(self, amount, currency):
+        rate = self.rate(currency)
+        return None if amount is None or not rate else Decimal(str(amount)) * rate
+
+def parse_rates(data):
+    """RateTable from a {"base": ..., "rates": {...}} document, rebased onto BASE_CURRENCY if needed"""
+    if not isinstance(data, dict) or not isinstance(data.get('rates'), dict):
+        raise RatesUnavailable('Rates document has no "rates" object')
+    base = str(data.get('base') or data.get('base_code') or BASE_CURRENCY).upper()
+
+    rates = {base: Decimal(1)}
+    for currency, value in data['rates'].items():
+        try:
+            rate = Decimal(str(value))
+        except InvalidOperation:
+            continue
+        if rate > 0 and len(currency) == 3:
+            rates[currency.upper()] = rate
+
+    if base != BASE_CURRENCY:
+        if BASE_CURRENCY not in rates:
+            raise RatesUnavailable(f'Rates are based on {base} and do not include {BASE_CURRENCY}')
+        pivot = rates[BASE_CURRENCY]
+        rates = {currency: rate / pivot for currency, rate in rates.items()}
+    return RateTable({currency: rate.quantize(RATE_PLACES) for currency, rate in rates.items()})
+
+class FileRateSource:
+    """Rates from a local JSON file (tests, air-gapped deployments, manual overrides)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        try:
+            with open(self.path, encoding='utf-8') as handle:
+                return parse_rates(json.load(handle))
+        except (OSError, ValueError) as e:
+            raise RatesUnavailable(f'Could not read rates from {self.path}: {str(e)}')
+
+class HttpRateSource:
+    """Rates from a JSON HTTP endpoint"""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        import requests
+        try:
+            response = requests.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            return parse_rates(response.json())
+        except (requests.RequestException, ValueError) as e:
+            raise RatesUnavailable(f'Could not fetch rates from {self.url}: {str(e)}')
+
+_source = None
+_source_lock = threading.Lock()
+
+def get_source():
+    """Return the configured rate source (RATES_SOURCE), creating it on first use"""
+    global _source
+    if _source is None:
+        with _source_lock:
+            if _source is None:
+                configured = os.environ.get('RATES_SOURCE', '')
+                if not configured:
+                    raise RuntimeError('RATES_SOURCE is not set (a JSON file path or an http(s) URL)')
+                if configured.startswith(('http://', 'https://')):
+                    _source = HttpRateSource(configured)
+                else:
+                    _source = FileRateSource(configured)
+    return _source
+
+def set_source(source):
+    """Replace the rate source (anything with fetch() -> RateTable)"""
+    global _source
+    with _source_lock:
+        _source = source
+
+def applied_rates():
+    """The rates listings are currently normalized with, read from currency_rates"""
+    return RateTable({row.currency: row.rate for row in CurrencyRate.query.all()})
+
+class RateCache:
+    """Applied rates held in memory for ttl seconds, shared by the threads of a process"""
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._table = None
+        self._expires_at = 0.0
+
+    def get(self):
+        if self._table is not None and time.monotonic() < self._expires_at:
+            return self._table
+        with self._lock:
+            if self._table is None or time.monotonic() >= self._expires_at:
+                try:
+                    self._table = applied_rates()
+                except Exception as e:
+                    if self._table is None:
+                        raise
+                    # Keep serving the last rates rather than failing the page
+                    logging.error(f"Could not reload currency rates: {str(e)}")
+                self._expires_at = time.monotonic() + self.ttl
+            return self._table
+
+    def clear(self):
+        with self._lock:
+            self._table = None
+
+_cache = RateCache(int(os.environ.get('RATES_CACHE_TTL', DEFAULT_CACHE_TTL)))
+
+def get_rates():
+    """Applied rates for display and bound conversion (cached)"""
+    return _cache.get()
+
+def base_price(rates, price, currency):
+    """price in BASE_CURRENCY with the given rates, rounded like the stored column (for Core inserts)"""
+    amount = rates.to_base(price, currency or BASE_CURRENCY)
+    return None if amount is None else round(amount, PRICE_PLACES)
+
+def normalized_price(price, currency):
+    """SQL expression for price in BASE_CURRENCY using the applied rate (NULL without a price or rate)"""
+    if price is None:
+        return None
+    rate = select(CurrencyRate.rate).where(CurrencyRate.currency == (currency or BASE_CURRENCY)).scalar_subquery()
+    return func.round(cast(price, Numeric(14, PRICE_PLACES)) / rate, PRICE_PLACES)
+
+def recompute_currency(currency, batch_size=BATCH_SIZE):
+    """Recompute price_base for every listing in one currency, batch_size rows per transaction"""
+    rate = select(CurrencyRate.rate).where(CurrencyRate.currency == currency).scalar_subquery()
+    in_currency = Listing.currency == currency
+    if currency == BASE_CURRENCY:
+        # Listings without a currency are priced in the base currency
+        in_currency = or_(in_currency, Listing.currency.is_(None))
+    after = None
+    updated = 0
+    while True:
+        query = db.session.query(Listing.id).filter(in_currency)
+        if after is not None:
+            query = query.filter(Listing.id > after)
+        ids = [row.id for row in query.order_by(Listing.id).limit(batch_size)]
+        if not ids:
+            db.session.rollback()
+            return updated
+        db.session.execute(Listing.__table__.update().where(Listing.id.in_(ids)).values(
+            price_base=func.round(Listing.price / rate, PRICE_PLACES)))
+        db.session.commit()
+        updated += len(ids)
+        after = ids[-1]
+
+def refresh(source=None, recompute_all=False, batch_size=BATCH_SIZE):
+    """
+    Fetch rates, store the ones that changed and recompute the affected listings
+    Returns {'changed': [currencies], 'listings_updated': n}
+    """
+    table = (source or get_source()).fetch()
+    current = applied_rates()
+    changed = sorted(currency for currency, rate in table.rates.items() if current.rate(currency) != rate)
+
+    now = datetime.utcnow()
+    for currency in changed:
+        row = db.session.get(CurrencyRate, currency)
+        if row is None:
+            db.session.add(CurrencyRate(currency=currency, rate=table.rates[currency], updated_at=now))
+        else:
+            row.rate = table.rates[currency]
+            row.updated_at = now
+    db.session.commit()
+
+    if recompute_all:
+        currencies = [row[0] for row in db.session.query(Listing.currency).filter(
+            Listing.currency.isnot(None)).distinct()]
+    else:
+        currencies = changed
+    updated = sum(recompute_currency(currency, batch_size) for currency in currencies)
+
+    if updated:
+        invalidate_listings()
+    _cache.clear()
+    return {'changed': changed, 'listings_updated': updated}
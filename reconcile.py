@@ -0,0 +1,201 @@
+"""
+Reconciliation of stale pending payments
+
+A payment stays pending until Paystack's webhook arrives; if it never does,
+the buyer's status page waits forever and the listing is never marked
+sold. This job pages through pending payments older than a threshold in
+keyset order, verifies each reference with Paystack from a bounded thread
+pool under a request rate limit, and applies the outcome per chunk in one
+transaction with the same transitions as the webhook (complete_payment /
+fail_payment), so sold listings drop out of the feed and status pages are
+notified exactly as if the webhook had arrived.
+
+Paystack outcomes:
+    success                      -> completed
+    failed, reversed             -> failed
+    abandoned, or reference
+    unknown to Paystack          -> failed once older than abandon_after
+    anything else / errors       -> left pending for the next run
+
+If Paystack's circuit breaker opens, the run stops after the current chunk.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from app import db
+from models import Listing, Payment
+from paystack import get_client, PaystackUnavailable
+from pubsub import publish_payment_status
+from cache import invalidate_listings
+from webhooks import complete_payment, fail_payment
+
+DEFAULT_OLDER_THAN_MINUTES = 30
+DEFAULT_ABANDON_AFTER_MINUTES = 24 * 60
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 20.0
+CHUNK_SIZE = 500
+
+FAILED_STATUSES = ('failed', 'reversed')
+
+class RateLimiter:
+    """Spaces calls at most `rate` per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class ReconcileResult:
+    """Counts for one run"""
+
+    def __init__(self):
+        self.checked = 0
+        self.completed = 0
+        self.failed = 0
+        self.still_pending = 0
+        self.errors = 0
+        self.aborted = False
+
+    def to_dict(self):
+        return {
+            'checked': self.checked,
+            'completed': self.completed,
+            'failed': self.failed,
+            'still_pending': self.still_pending,
+            'errors': self.errors,
+            'aborted': self.aborted
+        }
+
+def stale_chunks(cutoff, chunk_size=CHUNK_SIZE, limit=None):
+    """Yield lists of (id, reference, created_at) for pending payments created before cutoff"""
+    after = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        query = db.session.query(Payment.id, Payment.transaction_id, Payment.created_at).filter(
+            Payment.status == 'pending', Payment.created_at < cutoff)
+        if after is not None:
+            query = query.filter(tuple_(Payment.created_at, Payment.id) > tuple_(
+                *after, types=(Payment.created_at.type, Payment.id.type)))
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        rows = query.order_by(Payment.created_at, Payment.id).limit(size).all()
+        # Don't hold a transaction open while Paystack is being called
+        db.session.rollback()
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1].created_at, rows[-1].id)
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < size:
+            return
+
+def decide(response, created_at, abandon_before):
+    """'completed', 'failed' or None (leave pending) for one verify response"""
+    data = response.data or {}
+    if response.status_code == 200 and data.get('status'):
+        status = (data.get('data') or {}).get('status')
+        if status == 'success':
+            return 'completed'
+        if status in FAILED_STATUSES:
+            return 'failed'
+        if status == 'abandoned' and created_at < abandon_before:
+            return 'failed'
+        return None
+    if response.status_code in (400, 404) and created_at < abandon_before:
+        # Paystack has never seen this reference: initialization never completed
+        return 'failed'
+    return None
+
+def _verify(client, limiter, reference):
+    limiter.wait()
+    return client.verify_transaction(reference)
+
+def apply_outcomes(outcomes, result):
+    """Apply {payment id: 'completed'|'failed'} in one transaction, skipping payments no longer pending"""
+    if not outcomes:
+        return []
+
+    query = Payment.query.filter(Payment.id.in_(list(outcomes)), Payment.status == 'pending')
+    if db.engine.dialect.name == 'postgresql':
+        # A payment locked by the webhook worker is settled there; skip it here
+        query = query.with_for_update(skip_locked=True)
+    payments = query.all()
+
+    listing_ids = {payment.listing_id for payment in payments if outcomes[payment.id] == 'completed'}
+    if listing_ids:
+        Listing.query.filter(Listing.id.in_(listing_ids)).all()
+
+    # Only payments this transaction moved out of pending count; another may have settled one meanwhile
+    settled = [payment for payment in payments
+               if (complete_payment if outcomes[payment.id] == 'completed' else fail_payment)(payment)]
+    db.session.commit()
+
+    completed = sum(1 for payment in settled if payment.status == 'completed')
+    result.completed += completed
+    result.failed += len(settled) - completed
+
+    if completed:
+        invalidate_listings()
+    for payment in settled:
+        publish_payment_status(payment)
+    return settled
+
+def reconcile(older_than_minutes=DEFAULT_OLDER_THAN_MINUTES, abandon_after_minutes=DEFAULT_ABANDON_AFTER_MINUTES,
+              concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, limit=None, chunk_size=CHUNK_SIZE, client=None):
+    """Verify and settle stale pending payments; returns a ReconcileResult"""
+    client = client or get_client()
+    limiter = RateLimiter(rate)
+    result = ReconcileResult()
+    now = datetime.utcnow()
+    cutoff = now - timedelta(minutes=older_than_minutes)
+    abandon_before = now - timedelta(minutes=abandon_after_minutes)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reconcile') as pool:
+        for rows in stale_chunks(cutoff, chunk_size, limit):
+            futures = [(row, pool.submit(_verify, client, limiter, row.transaction_id)) for row in rows]
+
+            outcomes = {}
+            for row, future in futures:
+                result.checked += 1
+                try:
+                    outcome = decide(future.result(), row.created_at, abandon_before)
+                except PaystackUnavailable as e:
+                    result.errors += 1
+                    logging.warning(f"Reconciliation of {row.transaction_id} failed: {str(e)}")
+                    continue
+                except Exception as e:
+                    result.errors += 1
+                    logging.error(f"Reconciliation of {row.transaction_id} failed: {str(e)}")
+                    continue
+                if outcome is None:
+                    result.still_pending += 1
+                else:
+                    outcomes[row.id] = outcome
+
+            try:
+                apply_outcomes(outcomes, result)
+            except Exception as e:
+                db.session.rollback()
+                result.errors += len(outcomes)
+                logging.error(f"Error applying reconciliation batch: {str(e)}")
+
+            logging.info(f"Reconciliation progress: {result.to_dict()}")
+            if not client.is_available():
+                result.aborted = True
+                logging.warning("Paystack unavailable, stopping reconciliation early")
+                break
+
+    return result
@@ -0,0 +1,170 @@
+"""
+Read-replica routing
+
+Set DATABASE_REPLICA_URLS (comma separated) to add replica engines as
+SQLAlchemy binds (replica_0, replica_1, ...). Views decorated with
+@replica_reads send their SELECTs to a healthy replica; everything else,
+every flush and every locking SELECT goes to the primary.
+
+Read-your-writes: once a request writes, the rest of it reads from the
+primary, and the user's next READ_YOUR_WRITES_SECONDS of requests do too
+(a timestamp kept in their session cookie), so a farmer sees the listing
+they just created. Code that must see the latest committed state (e.g.
+a payment the webhook may just have settled) can wrap reads in
+`with primary():`.
+
+Lag-aware fallback: each replica's lag is checked at most every
+REPLICA_LAG_CHECK_SECONDS (Postgres: time since the last replayed
+transaction; other databases report 0). A replica that lags by more
+than REPLICA_MAX_LAG_SECONDS or cannot be reached is skipped until the
+next check, and with no healthy replica reads go to the primary.
+Note that on an idle primary Postgres reports growing replay lag;
+a replica then looks stale until the next write, which only costs
+primary reads.
+"""
+import functools
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+REPLICA_BIND_PREFIX = 'replica_'
+DEFAULT_MAX_LAG_SECONDS = 5.0
+DEFAULT_LAG_CHECK_SECONDS = 5.0
+DEFAULT_READ_YOUR_WRITES_SECONDS = 10.0
+
+PG_LAG_SQL = text("SELECT CASE WHEN pg_is_in_recovery() "
+                  "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END")
+
+def replica_binds(urls, engine_options=None):
+    """SQLALCHEMY_BINDS entries for a list of replica URLs"""
+    return {f'{REPLICA_BIND_PREFIX}{number}': dict(engine_options or {}, url=url)
+            for number, url in enumerate(urls)}
+
+class ReplicaHealth:
+    """Cached lag/availability per replica engine, shared by all threads of a process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+        self._round_robin = itertools.count()
+
+    def lag(self, engine):
+        if engine.dialect.name != 'postgresql':
+            return 0.0
+        with engine.connect() as connection:
+            return float(connection.execute(PG_LAG_SQL).scalar() or 0.0)
+
+    def healthy(self, key, engine, max_lag, check_interval):
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(key)
+            if checked is not None and now - checked[0] < check_interval:
+                return checked[1]
+            # Mark as checked first so only one thread probes at a time; others use the last answer
+            self._checked[key] = (now, checked[1] if checked else False)
+
+        try:
+            lag = self.lag(engine)
+            ok = lag <= max_lag
+            if not ok:
+                logging.warning(f"Replica {key} lags by {lag:.1f}s, reading from the primary")
+        except Exception as e:
+            ok = False
+            logging.warning(f"Replica {key} unavailable, reading from the primary: {str(e)}")
+
+        with self._lock:
+            self._checked[key] = (time.monotonic(), ok)
+        return ok
+
+    def pick(self, engines, max_lag, check_interval):
+        """A healthy replica engine, rotating between them, or None"""
+        keys = sorted(engines)
+        start = next(self._round_robin)
+        for offset in range(len(keys)):
+            key = keys[(start + offset) % len(keys)]
+            if self.healthy(key, engines[key], max_lag, check_interval):
+                return engines[key]
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+health = ReplicaHealth()
+
+def _replica_engines(db):
+    return {key: engine for key, engine in db.engines.items()
+            if isinstance(key, str) and key.startswith(REPLICA_BIND_PREFIX)}
+
+def _wants_replica():
+    if not has_request_context() or not g.get('_replica_reads') or g.get('_force_primary') or g.get('_db_wrote'):
+        return False
+    return session.get('_primary_until', 0) < time.time()
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads in @replica_reads views to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            reading = not self._flushing and clause is not None and clause.is_select
+            if not reading and has_request_context():
+                # A flush or any other statement: this request now reads its own writes from the primary
+                g._db_wrote = True
+            elif (reading and getattr(clause, '_for_update_arg', None) is None and _wants_replica()):
+                engine = self._pick_replica()
+                if engine is not None:
+                    g._read_from_replica = True
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _pick_replica(self):
+        engines = _replica_engines(self._db)
+        if not engines:
+            return None
+        config = current_app.config
+        return health.pick(engines, config.get('REPLICA_MAX_LAG_SECONDS', DEFAULT_MAX_LAG_SECONDS),
+                           config.get('REPLICA_LAG_CHECK_SECONDS', DEFAULT_LAG_CHECK_SECONDS))
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _read_your_writes(db_session):
+    if has_request_context() and g.get('_db_wrote'):
+        seconds = current_app.config.get('READ_YOUR_WRITES_SECONDS', DEFAULT_READ_YOUR_WRITES_SECONDS)
+        session['_primary_until'] = time.time() + seconds
+
+def replica_reads(view):
+    """Allow this view's reads to be served by a replica"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g._replica_reads = True
+        return view(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block, even in a @replica_reads view"""
+    previous = g.get('_force_primary', False)
+    g._force_primary = True
+    try:
+        yield
+    finally:
+        g._force_primary = previous
+
+def read_from_replica():
+    """True if this request has read from a replica so far"""
+    return has_request_context() and g.get('_read_from_replica', False)
+
+@contextmanager
+def primary_if_changed_since(changed_at):
+    """Use the primary while a replica may not have caught up with a change made at changed_at"""
+    max_lag = current_app.config.get('REPLICA_MAX_LAG_SECONDS', DEFAULT_MAX_LAG_SECONDS)
+    if changed_at is not None and (datetime.now(timezone.utc) - changed_at).total_seconds() <= max_lag:
+        with primary():
+            yield
+    else:
+        yield
@@ -0,0 +1,65 @@
+"""
+Checkout holds on listings
+
+Every listing is a single lot, so when many buyers hit "Buy" at once only
+one of them can get it. Before a payment record is created or Paystack is
+called, /paystack/initiate takes a hold on the listing with one
+conditional UPDATE (a compare-and-set on the hold columns):
+
+    UPDATE listings SET reserved_by = :buyer, reserved_until = :now + hold, ...
+    WHERE id = :listing AND is_available
+      AND (reserved_until IS NULL OR reserved_until <= :now OR reserved_by = :buyer)
+
+The buyer whose UPDATE matched a row owns the listing until the hold
+expires; everyone else matches no row and is answered 409 straight away,
+without a payment record or a provider call. On Postgres a concurrent
+loser waits only for the winner's transaction (the UPDATE plus the
+payment insert) and then re-checks the condition; on SQLite writes are
+serialized anyway.
+
+A hold ends when its payment fails (webhook, reconciliation or a failed
+Paystack initialization), when the listing sells, or when
+RESERVATION_HOLD_SECONDS pass. Expiry needs no sweeper: an expired hold
+simply no longer blocks the UPDATE. The same buyer may start checkout
+again while holding the listing; the hold moves to the new reference.
+Keep the hold longer than a Paystack checkout usually takes, or a buyer
+who pays after their hold lapsed can race a second buyer.
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, update
+from app import db
+from models import Listing
+
+DEFAULT_HOLD_SECONDS = 15 * 60
+
+def hold_seconds():
+    return current_app.config.get('RESERVATION_HOLD_SECONDS', DEFAULT_HOLD_SECONDS)
+
+def reserve(listing_id, buyer_id, reference, seconds=None):
+    """Take (or renew) the buyer's hold on an available listing; False if someone else holds it (caller commits)"""
+    now = datetime.utcnow()
+    seconds = hold_seconds() if seconds is None else seconds
+    statement = update(Listing).where(
+        Listing.id == listing_id,
+        Listing.is_available == True,
+        or_(Listing.reserved_until.is_(None), Listing.reserved_until <= now, Listing.reserved_by == buyer_id)
+    ).values(
+        reserved_by=buyer_id,
+        reserved_until=now + timedelta(seconds=seconds),
+        reservation_reference=reference
+    ).execution_options(synchronize_session=False)
+    return db.session.execute(statement).rowcount == 1
+
+def release(listing_id, reference):
+    """Drop the hold if it still belongs to this payment reference (caller commits)"""
+    statement = update(Listing).where(
+        Listing.id == listing_id,
+        Listing.reservation_reference == reference
+    ).values(
+        reserved_by=None,
+        reserved_until=None,
+        reservation_reference=None
+    ).execution_options(synchronize_session=False)
+    db.session.execute(statement)
+
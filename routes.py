@@ -1,22 +1,51 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
-from app import app, db
-from models import User, Listing, Payment
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify, Response, make_response, stream_with_context
+from flask.globals import request_ctx
+from app import db
+from models import User, Listing, Payment, WaitingList
+from search import apply_search
+from pagination import Page, keyset_page, offset_page, page_size, serialize_listing, listing_snapshot, supplier_snapshot
+from pubsub import get_broker, payment_channel, publish_payment_status
+from paystack import get_client as get_paystack_client, PaystackUnavailable
+from webhooks import apply_event, enqueue_event, fail_payment
+from reservations import reserve
+from waitlist import notify_matches, register_want, remove_want
+from cache import listings_state, invalidate_listings, feed_key, get_or_load, validators_shared
+from validation import validate_listing, parse_price, parse_quantity, ListingValidationError, CURRENCIES
+from filters import NO_FILTERS, parse_filters, filter_args, apply_filters, display_rate
+from rates import get_rates, normalized_price
+from facets import facet_counts
+from bulk_import import import_listings, detect_format
+from instrumentation import render_metrics
+from passwords import PasswordHashingBusy
+from ratelimit import hold, limited, RateLimited, OverCapacity
+from archive import find_payment, find_listing_with_supplier
+from sales import supplier_summary, period, PERIODS
+from replicas import replica_reads, primary, primary_if_changed_since, read_from_replica
+from exports import EXPORT_FORMATS, parse_date, payments_export_statements, iter_export
 from werkzeug.security import generate_password_hash
 import logging
-import requests
 import os
 import hmac
 import hashlib
 import json
+import time
+from datetime import datetime
 
-@app.route('/')
+
+bp = Blueprint('main', __name__)
+
+# One record per webhook delivery; sampled in staging/production (see logs.py)
+webhook_receipts = logging.getLogger('webhooks.received')
+
+@bp.route('/')
 def index():
     """Redirect to dashboard if logged in, otherwise to login"""
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+        return redirect(url_for('main.dashboard'))
+    return redirect(url_for('main.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
+@limited('login')
 def login():
     """Login route"""
     if request.method == 'POST':
@@ -29,18 +58,47 @@ def login():
         
         user = User.query.filter_by(email=email).first()
         
-        if user and user.check_password(password):
+        try:
+            verified = user is not None and user.check_password(password)
+        except PasswordHashingBusy:
+            return _hashing_busy()
+        
+        if verified:
+            _upgrade_password_hash(user, password)
             session['user_id'] = user.id
             session['user_name'] = user.name
             session['user_role'] = user.role
             flash(f'Welcome back, {user.name}!', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid email or password.', 'error')
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+def _upgrade_password_hash(user, password):
+    """Rehash under the current policy if the stored hash predates it; a failure only delays the upgrade"""
+    try:
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
+    except PasswordHashingBusy:
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error upgrading password hash: {str(e)}")
+
+def _hashing_busy():
+    """503 for a sign-in that could not get a password hashing slot in time"""
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+    response = make_response(render_template('login.html'), 503)
+    response.headers['Retry-After'] = '2'
+    return response
+
+# Roles anyone can sign up for; nothing is granted more than its own data
+REGISTRATION_ROLES = ('farmer', 'buyer')
+
+@bp.route('/register', methods=['GET', 'POST'])
+@limited('register')
 def register():
     """Registration route"""
     if request.method == 'POST':
@@ -53,6 +111,10 @@ def register():
             flash('Please fill in all fields.', 'error')
             return render_template('login.html')
         
+        if role not in REGISTRATION_ROLES:
+            flash('Please register as a farmer or a buyer.', 'error')
+            return render_template('login.html')
+        
         # Check if user already exists
         existing_user = User.query.filter_by(email=email).first()
         if existing_user:
@@ -64,7 +126,10 @@ def register():
         new_user.name = name
         new_user.email = email
         new_user.role = role
-        new_user.set_password(password)
+        try:
+            new_user.set_password(password)
+        except PasswordHashingBusy:
+            return _hashing_busy()
         
         try:
             db.session.add(new_user)
@@ -75,7 +140,7 @@ def register():
             session['user_role'] = new_user.role
             
             flash(f'Registration successful! Welcome, {new_user.name}!', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         except Exception as e:
             db.session.rollback()
             logging.error(f"Registration error: {str(e)}")
@@ -83,163 +148,515 @@ def register():
     
     return render_template('login.html')
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     """Main dashboard route"""
     if 'user_id' not in session:
         flash('Please login to access the dashboard.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     user_role = session.get('user_role', 'farmer')
     
     if user_role == 'buyer':
-        return redirect(url_for('buyer_dashboard'))
+        return redirect(url_for('main.buyer_dashboard'))
+    else:
+        return redirect(url_for('main.farmer_dashboard'))
+
+def farmer_listings_query(user_id):
+    """A supplier's own listings"""
+    return Listing.query.filter_by(supplier_id=user_id)
+
+def buyer_listings_query(search_query='', filters=NO_FILTERS, rates=None):
+    """Available listings with farmer names, ranked by relevance when searching unless filters sort them"""
+    query = db.session.query(Listing, User).join(User, Listing.supplier_id == User.id).filter(Listing.is_available == True)
+    
+    if search_query:
+        # Ranked full-text search (most relevant first)
+        query = apply_search(query, search_query)
+    
+    return apply_filters(query, filters, rates)
+
+def _farmer_listings_page(user_id, cursor=None, limit=None):
+    """One page of a supplier's own listings, newest first"""
+    return keyset_page(farmer_listings_query(user_id), cursor, page_size(limit))
+
+def _buyer_listings_page(search_query, cursor=None, limit=None, version=None, changed_at=None, filters=NO_FILTERS):
+    """
+    One page of available listings, newest first, by relevance when searching or in the filters' sort order
+    Served from the listings cache when a feed version is given; a page cached
+    right after a change (changed_at) is loaded from the primary, not a replica
+    """
+    limit = page_size(limit)
+    
+    def load():
+        query = buyer_listings_query(search_query, filters, get_rates() if filters != NO_FILTERS else None)
+        with primary_if_changed_since(changed_at):
+            if search_query or filters.sort:
+                page = offset_page(query, cursor, limit)
+            else:
+                page = keyset_page(query, cursor, limit)
+        # Cache plain snapshots, not session-bound ORM objects
+        return Page([(listing_snapshot(listing), supplier_snapshot(farmer)) for listing, farmer in page.items],
+                    page.next_cursor)
+    
+    return get_or_load(version, ('buyer', search_query, cursor or '', limit, filters), load)
+
+def _feed_facets(version):
+    """Available listings per currency and unit, cached with the feed"""
+    return get_or_load(version, ('facets',), facet_counts)
+
+def _feed_filters():
+    """Filters from the query string; the buyer's price currency is remembered in their session"""
+    filters = parse_filters(request.args, session.get('price_currency'))
+    if filters.price_currency and request.args.get('price_currency'):
+        session['price_currency'] = filters.price_currency
+    return filters
+
+def _feed_validators(version, last_modified, *parts):
+    """
+    ETag and Last-Modified for one view of the listings feed
+    Only from a shared cache backend: an in-process version misses writes made
+    by other processes, and a 304 would keep serving the buyer's stale copy
+    """
+    if version is None or not validators_shared():
+        return None
+    return feed_key(version, *parts), last_modified
+
+def _shows_flashes():
+    """True if flash messages are pending, or were taken by this request's render"""
+    return bool(request_ctx.flashes) or bool(session.get('_flashes'))
+
+def _not_modified(validators):
+    """A 304 response if the client's cached copy is current, otherwise None"""
+    # Pending flash messages make the page differ from the cached copy
+    if validators is None or _shows_flashes():
+        return None
+    
+    etag, last_modified = validators
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
     else:
-        return redirect(url_for('farmer_dashboard'))
+        matched = request.if_modified_since is not None and request.if_modified_since >= last_modified.replace(microsecond=0)
+    
+    if not matched:
+        return None
+    response = Response(status=304)
+    _set_validators(response, validators)
+    return response
+
+def _set_validators(response, validators):
+    """Attach ETag/Last-Modified so the next visit can be answered with a 304"""
+    # A page showing flash messages must not be revalidated later, or the browser shows them again
+    if validators is not None and not _shows_flashes():
+        etag, last_modified = validators
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-@app.route('/farmer_dashboard')
+@bp.route('/farmer_dashboard')
+@replica_reads
 def farmer_dashboard():
     """Farmer dashboard route"""
     if 'user_id' not in session:
         flash('Please login to access the dashboard.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     user_id = session['user_id']
     user_name = session['user_name']
     
-    # Get user's listings
-    listings = Listing.query.filter_by(supplier_id=user_id).order_by(Listing.created_at.desc()).all()
+    # Get one page of the user's listings
+    page = _farmer_listings_page(user_id, request.args.get('cursor'))
+    
+    return render_template('dashboard.html', user_name=user_name, listings=page.items,
+                         next_cursor=page.next_cursor)
+
+@bp.route('/farmer_analytics')
+@replica_reads
+def farmer_analytics():
+    """Revenue, sales and conversion per currency over time, from the sales rollups"""
+    if 'user_id' not in session:
+        flash('Please login to access the dashboard.', 'error')
+        return redirect(url_for('main.login'))
+    
+    days = period(request.args.get('days'))
+    summary = supplier_summary(session['user_id'], days)
     
-    return render_template('dashboard.html', user_name=user_name, listings=listings)
+    return render_template('analytics.html', user_name=session['user_name'], days=days, periods=PERIODS,
+                         summary=summary)
 
-@app.route('/buyer_dashboard')
+@bp.route('/buyer_dashboard')
+@replica_reads
 def buyer_dashboard():
     """Buyer dashboard route"""
     if 'user_id' not in session:
         flash('Please login to access the dashboard.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     search_query = request.args.get('search', '')
+    cursor = request.args.get('cursor')
+    filters = _feed_filters()
     
-    # Get all available listings with farmer names
-    query = db.session.query(Listing, User).join(User, Listing.supplier_id == User.id).filter(Listing.is_available == True)
+    # Answer repeat visits with a 304 without touching the database
+    version, last_modified = listings_state()
+    validators = _feed_validators(version, last_modified, 'buyer_dashboard', session['user_id'], search_query, cursor,
+                                  filters)
+    not_modified = _not_modified(validators)
+    if not_modified:
+        return not_modified
     
-    if search_query:
-        query = query.filter(Listing.item_name.ilike(f'%{search_query}%'))
+    # Get one page of available listings with farmer names
+    page = _buyer_listings_page(search_query, cursor, version=version, changed_at=last_modified, filters=filters)
     
-    listings_with_farmers = query.order_by(Listing.created_at.desc()).all()
+    # The buyer's open waiting list items
+    wants = WaitingList.query.filter_by(buyer_id=session['user_id'], is_notified='no').order_by(
+        WaitingList.created_at.desc()).limit(20).all()
     
-    return render_template('buyer_dashboard.html', 
+    response = make_response(render_template('buyer_dashboard.html', 
                          user_name=session['user_name'], 
-                         listings_with_farmers=listings_with_farmers,
-                         search_query=search_query)
+                         listings_with_farmers=page.items,
+                         next_cursor=page.next_cursor,
+                         search_query=search_query,
+                         filters=filters,
+                         filter_args=filter_args(filters),
+                         facets=_feed_facets(version),
+                         currencies=CURRENCIES,
+                         display=display_rate(filters, get_rates()),
+                         wants=wants))
+    return _set_validators(response, validators)
 
-@app.route('/create_listing', methods=['POST'])
+@bp.route('/api/listings')
+@replica_reads
+def api_listings():
+    """
+    API endpoint for paginated listings (infinite scroll)
+    scope=mine returns the logged-in supplier's listings, otherwise available listings
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    
+    if request.args.get('scope') == 'mine':
+        page = _farmer_listings_page(session['user_id'], cursor, limit)
+        return jsonify({
+            'listings': [serialize_listing(listing) for listing in page.items],
+            'next_cursor': page.next_cursor
+        })
+    
+    search_query = request.args.get('search', '')
+    filters = _feed_filters()
+    version, last_modified = listings_state()
+    validators = _feed_validators(version, last_modified, 'api_listings', search_query, cursor, page_size(limit),
+                                  filters)
+    not_modified = _not_modified(validators)
+    if not_modified:
+        return not_modified
+    
+    page = _buyer_listings_page(search_query, cursor, limit, version=version, changed_at=last_modified, filters=filters)
+    display = display_rate(filters, get_rates())
+    response = jsonify({
+        'listings': [serialize_listing(listing, farmer, display) for listing, farmer in page.items],
+        'next_cursor': page.next_cursor,
+        'facets': {facet: [{'value': value, 'count': count} for value, count in counts]
+                   for facet, counts in _feed_facets(version).items()}
+    })
+    return _set_validators(response, validators)
+
+def _notify_waiting_buyers(listing):
+    """Notify buyers on the waiting list about a newly available listing"""
+    try:
+        matched = notify_matches(listing)
+        if matched:
+            logging.info(f"Notified {matched} waiting buyer(s) about listing {listing.id}")
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error notifying waiting list: {str(e)}")
+
+@bp.route('/create_listing', methods=['POST'])
 def create_listing():
     """Create a new listing"""
     if 'user_id' not in session:
         flash('Please login to create a listing.', 'error')
-        return redirect(url_for('login'))
-    
-    item_name = request.form.get('item_name')
-    quantity = request.form.get('quantity')
-    price = request.form.get('price')
-    currency = request.form.get('currency')
-    contact = request.form.get('contact')
-    is_available = request.form.get('is_available') == 'on'
+        return redirect(url_for('main.login'))
     
-    if not all([item_name, quantity, contact]):
-        flash('Please fill in all required fields.', 'error')
-        return redirect(url_for('dashboard'))
+    try:
+        values = validate_listing(request.form)
+    except ListingValidationError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.dashboard'))
     
     new_listing = Listing()
-    new_listing.item_name = item_name
-    new_listing.quantity = quantity
-    new_listing.price = float(price) if price else None
-    new_listing.currency = currency if currency else 'USD'
-    new_listing.contact = contact
-    new_listing.is_available = is_available
+    new_listing.item_name = values['item_name']
+    new_listing.quantity = values['quantity']
+    new_listing.quantity_amount = values['quantity_amount']
+    new_listing.quantity_unit = values['quantity_unit']
+    new_listing.price = values['price']
+    new_listing.currency = values['currency']
+    new_listing.price_base = normalized_price(values['price'], values['currency'])
+    new_listing.contact = values['contact']
+    new_listing.is_available = values['is_available']
     new_listing.supplier_id = session['user_id']
     
     try:
         db.session.add(new_listing)
         db.session.commit()
+        invalidate_listings()
         flash('Listing created successfully!', 'success')
+        _notify_waiting_buyers(new_listing)
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error creating listing: {str(e)}")
         flash('Failed to create listing. Please try again.', 'error')
     
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('main.dashboard'))
 
-@app.route('/update_listing/<listing_id>', methods=['POST'])
+@bp.route('/update_listing/<listing_id>', methods=['POST'])
 def update_listing(listing_id):
     """Update an existing listing"""
     if 'user_id' not in session:
         flash('Please login to update listings.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     listing = Listing.query.filter_by(id=listing_id, supplier_id=session['user_id']).first()
     
     if not listing:
         flash('Listing not found or you do not have permission to edit it.', 'error')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    
+    try:
+        price = parse_price(request.form.get('price'))
+    except ListingValidationError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    # Waiting buyers are notified when a listing becomes available or is renamed while available
+    was_available = listing.is_available
+    previous_name = listing.item_name
     
     listing.item_name = request.form.get('item_name', listing.item_name)
     listing.quantity = request.form.get('quantity', listing.quantity)
-    price = request.form.get('price')
-    listing.price = float(price) if price else listing.price
+    listing.quantity_amount, listing.quantity_unit = parse_quantity(listing.quantity)
+    listing.price = price if price is not None else listing.price
     listing.currency = request.form.get('currency', listing.currency)
+    listing.price_base = normalized_price(listing.price, listing.currency)
     listing.contact = request.form.get('contact', listing.contact)
     listing.is_available = request.form.get('is_available') == 'on'
     
     try:
         db.session.commit()
+        invalidate_listings()
         flash('Listing updated successfully!', 'success')
+        if listing.is_available and (not was_available or listing.item_name != previous_name):
+            _notify_waiting_buyers(listing)
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error updating listing: {str(e)}")
         flash('Failed to update listing. Please try again.', 'error')
     
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('main.dashboard'))
 
-@app.route('/delete_listing/<listing_id>', methods=['POST'])
+@bp.route('/delete_listing/<listing_id>', methods=['POST'])
 def delete_listing(listing_id):
     """Delete a listing"""
     if 'user_id' not in session:
         flash('Please login to delete listings.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     listing = Listing.query.filter_by(id=listing_id, supplier_id=session['user_id']).first()
     
     if not listing:
         flash('Listing not found or you do not have permission to delete it.', 'error')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     
     try:
         db.session.delete(listing)
         db.session.commit()
+        invalidate_listings()
         flash('Listing deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error deleting listing: {str(e)}")
         flash('Failed to delete listing. Please try again.', 'error')
     
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('main.dashboard'))
 
-@app.route('/logout')
+@bp.route('/import_listings', methods=['POST'])
+def import_listings_route():
+    """
+    Bulk import listings from an uploaded CSV or NDJSON file
+    Returns JSON for API clients, otherwise flashes a summary
+    """
+    wants_json = request.accept_mimetypes.best == 'application/json' or \
+        request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    
+    if 'user_id' not in session:
+        if wants_json:
+            return jsonify({'error': 'Authentication required'}), 401
+        flash('Please login to import listings.', 'error')
+        return redirect(url_for('main.login'))
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        if wants_json:
+            return jsonify({'error': 'No file uploaded'}), 400
+        flash('Please choose a CSV or NDJSON file to import.', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    file_format = detect_format(upload.filename, request.form.get('format'))
+    if file_format not in ('csv', 'ndjson'):
+        if wants_json:
+            return jsonify({'error': 'Unsupported format'}), 400
+        flash('Unsupported file format. Please upload CSV or NDJSON.', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    try:
+        # Werkzeug spools large uploads to disk, so this reads row by row
+        result = import_listings(upload.stream, session['user_id'], file_format)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error importing listings: {str(e)}")
+        if wants_json:
+            return jsonify({'error': 'Import failed'}), 500
+        flash('Import failed. Please check the file and try again.', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    if wants_json:
+        return jsonify(result.to_dict())
+    
+    if result.failed:
+        first = result.errors[0]
+        flash(f"Imported {result.imported} listing(s); {result.failed} row(s) skipped "
+              f"(first error on line {first['line']}: {first['error']})", 'info')
+    else:
+        flash(f"Imported {result.imported} listing(s).", 'success')
+    return redirect(url_for('main.dashboard'))
+
+@bp.route('/export/payments')
+@replica_reads
+def export_payments():
+    """
+    Stream a CSV/NDJSON export of payments
+    Farmers get their sales, buyers their purchases (`flask export-payments` exports any)
+    Filters: status, start, end (ISO dates)
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    file_format = request.args.get('format', 'csv').lower()
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported format'}), 400
+    
+    try:
+        start = parse_date(request.args.get('start'))
+        end = parse_date(request.args.get('end'), end_of_day=True)
+    except ValueError:
+        return jsonify({'error': 'Invalid date, use YYYY-MM-DD'}), 400
+    
+    supplier_id = buyer_id = None
+    if session.get('user_role') == 'buyer':
+        buyer_id = session['user_id']
+    else:
+        supplier_id = session['user_id']
+    
+    statements = payments_export_statements(supplier_id=supplier_id, buyer_id=buyer_id,
+                                            status=request.args.get('status'), start=start, end=end)
+    
+    filename = f"payments-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{file_format}"
+    return Response(stream_with_context(iter_export(statements, file_format)),
+                    mimetype=EXPORT_FORMATS[file_format],
+                    headers={
+                        'Content-Disposition': f'attachment; filename="{filename}"',
+                        'X-Accel-Buffering': 'no'
+                    })
+
+@bp.route('/waiting_list', methods=['POST'])
+def create_waiting_list_item():
+    """Register a want: notify the buyer when a matching listing becomes available"""
+    if 'user_id' not in session:
+        flash('Please login to join the waiting list.', 'error')
+        return redirect(url_for('main.login'))
+    
+    item_requested = (request.form.get('item_requested') or '').strip()
+    contact = (request.form.get('contact') or '').strip()
+    
+    if not item_requested or not contact:
+        flash('Please tell us what you are looking for and how to reach you.', 'error')
+        return redirect(url_for('main.buyer_dashboard'))
+    
+    want = WaitingList()
+    want.item_requested = item_requested
+    want.contact = contact
+    want.is_notified = 'no'
+    want.buyer_id = session['user_id']
+    
+    try:
+        db.session.add(want)
+        db.session.commit()
+        register_want(want)
+        flash(f"We'll let you know when {item_requested} is listed.", 'success')
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error creating waiting list item: {str(e)}")
+        flash('Failed to join the waiting list. Please try again.', 'error')
+    
+    return redirect(url_for('main.buyer_dashboard'))
+
+@bp.route('/waiting_list/<want_id>/delete', methods=['POST'])
+def delete_waiting_list_item(want_id):
+    """Remove a want from the waiting list"""
+    if 'user_id' not in session:
+        flash('Please login to manage your waiting list.', 'error')
+        return redirect(url_for('main.login'))
+    
+    want = WaitingList.query.filter_by(id=want_id, buyer_id=session['user_id']).first()
+    if not want:
+        flash('Waiting list item not found.', 'error')
+        return redirect(url_for('main.buyer_dashboard'))
+    
+    try:
+        db.session.delete(want)
+        db.session.commit()
+        remove_want(want_id)
+        flash('Removed from your waiting list.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error deleting waiting list item: {str(e)}")
+        flash('Failed to remove waiting list item. Please try again.', 'error')
+    
+    return redirect(url_for('main.buyer_dashboard'))
+
+@bp.route('/logout')
 def logout():
     """Logout route"""
     session.clear()
     flash('You have been logged out successfully.', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
     """404 error handler"""
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(RateLimited)
+@bp.app_errorhandler(OverCapacity)
+def limit_exceeded(error):
+    """429/503 from the rate limits and concurrency caps (see ratelimit.py), with Retry-After"""
+    if isinstance(error, RateLimited):
+        message = f'Too many attempts. Please try again in {error.retry_after} seconds.'
+    else:
+        message = 'We are handling a lot of requests right now. Please try again in a moment.'
+    if request.is_json or request.path.startswith('/api/') or request.endpoint == 'main.paystack_initiate':
+        response = jsonify({'error': message})
+        response.status_code = error.code
+    else:
+        flash(message, 'error')
+        response = make_response(render_template('login.html'), error.code)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@bp.app_errorhandler(500)
 def internal_error(error):
     """500 error handler"""
     db.session.rollback()
@@ -247,7 +664,8 @@ def internal_error(error):
 
 # Paystack Payment Integration Endpoints
 
-@app.route('/paystack/initiate', methods=['POST'])
+@bp.route('/paystack/initiate', methods=['POST'])
+@limited('initiate')
 def paystack_initiate():
     """
     Initialize Paystack payment transaction
@@ -278,8 +696,7 @@ def paystack_initiate():
             return jsonify({'error': 'Invalid amount'}), 400
         
         # Security: Validate currency
-        valid_currencies = ['USD', 'EUR', 'CAD', 'GHS', 'NGN']
-        if currency not in valid_currencies:
+        if currency not in CURRENCIES:
             return jsonify({'error': 'Unsupported currency'}), 400
         
         # Get buyer information
@@ -303,18 +720,15 @@ def paystack_initiate():
         # Convert amount to kobo (Paystack uses smallest currency unit)
         amount_in_kobo = int(amount * 100)
         
-        # Prepare Paystack request
-        paystack_url = "https://api.paystack.co/transaction/initialize"
+        # Fail fast while Paystack is degraded, before creating a payment record
+        paystack = get_paystack_client()
+        if not paystack.is_available():
+            return jsonify({'error': 'Payment service unavailable'}), 503
         
         # Generate unique reference
         import uuid
         reference = f"fb_{uuid.uuid4().hex[:12]}"
         
-        headers = {
-            'Authorization': f'Bearer {os.environ.get("PAYSTACK_SECRET_KEY")}',
-            'Content-Type': 'application/json'
-        }
-        
         payload = {
             'amount': amount_in_kobo,
             'currency': currency,
@@ -329,6 +743,11 @@ def paystack_initiate():
             }
         }
         
+        # Hold the listing for this buyer; losers of a checkout race stop here, before any provider call
+        if not reserve(listing_id, session['user_id'], reference):
+            db.session.rollback()
+            return jsonify({'error': 'Another buyer is checking out this listing. Please try again in a few minutes.'}), 409
+        
         # Create payment record with pending status
         payment = Payment()
         payment.amount = amount
@@ -342,12 +761,18 @@ def paystack_initiate():
         db.session.add(payment)
         db.session.commit()
         
-        # Make request to Paystack
-        response = requests.post(paystack_url, json=payload, headers=headers)
+        # Make request to Paystack (pooled connection, bounded by timeouts)
+        try:
+            response = paystack.initialize_transaction(payload)
+        except PaystackUnavailable as e:
+            fail_payment(payment)
+            db.session.commit()
+            logging.error(f"Paystack unavailable: {str(e)}")
+            return jsonify({'error': 'Payment service unavailable'}), 503
         
         if response.status_code == 200:
-            paystack_data = response.json()
-            if paystack_data['status']:
+            paystack_data = response.data
+            if paystack_data.get('status'):
                 return jsonify({
                     'status': 'success',
                     'authorization_url': paystack_data['data']['authorization_url'],
@@ -355,14 +780,14 @@ def paystack_initiate():
                 })
             else:
                 # Update payment status to failed
-                payment.status = 'failed'
+                fail_payment(payment)
                 db.session.commit()
                 return jsonify({'error': paystack_data.get('message', 'Payment initialization failed')}), 400
         else:
             # Update payment status to failed
-            payment.status = 'failed'
+            fail_payment(payment)
             db.session.commit()
-            logging.error(f"Paystack API error: {response.status_code} - {response.text}")
+            logging.error(f"Paystack API error: {response.status_code} - {response.data}")
             return jsonify({'error': 'Payment service unavailable'}), 503
             
     except ValueError as e:
@@ -373,7 +798,7 @@ def paystack_initiate():
         logging.error(f"Error initiating payment: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-@app.route('/payment/success')
+@bp.route('/payment/success')
 def payment_success():
     """
     Handle Paystack callback after payment
@@ -384,23 +809,40 @@ def payment_success():
         reference = request.args.get('reference')
         if not reference:
             flash('Invalid payment reference.', 'error')
-            return redirect(url_for('buyer_dashboard'))
+            return redirect(url_for('main.buyer_dashboard'))
         
-        # Query database for transaction record
-        payment = Payment.query.filter_by(transaction_id=reference).first()
+        # Query database for transaction record (archived ones included)
+        payment = find_payment(reference)
         if not payment:
             flash('Transaction not found.', 'error')
-            return redirect(url_for('buyer_dashboard'))
+            return redirect(url_for('main.buyer_dashboard'))
         
         # Redirect to transaction status page
-        return redirect(url_for('transaction_status', reference=reference))
+        return redirect(url_for('main.transaction_status', reference=reference))
         
     except Exception as e:
         logging.error(f"Error in payment callback: {str(e)}")
         flash('Error processing payment callback.', 'error')
-        return redirect(url_for('buyer_dashboard'))
+        return redirect(url_for('main.buyer_dashboard'))
 
-@app.route('/transactions/<reference>')
+def _payment_by_reference(reference):
+    """
+    Look up a payment for the status views
+    A pending (or missing) payment read from a replica is re-read from the
+    primary, since the webhook may have settled it before the replica caught up;
+    one that is in neither is looked for in the archive
+    """
+    payment = Payment.query.filter_by(transaction_id=reference).first()
+    if (payment is None or payment.status == 'pending') and read_from_replica():
+        with primary():
+            payment = Payment.query.filter_by(transaction_id=reference).execution_options(
+                populate_existing=True).first()
+    if payment is None:
+        payment = find_payment(reference)
+    return payment
+
+@bp.route('/transactions/<reference>')
+@replica_reads
 def transaction_status(reference):
     """
     Display transaction status page with polling for pending payments
@@ -409,26 +851,25 @@ def transaction_status(reference):
         # Security: Check if user is logged in
         if 'user_id' not in session:
             flash('Please log in to view transactions.', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         
         # Find the payment record
-        payment = Payment.query.filter_by(transaction_id=reference).first()
+        payment = _payment_by_reference(reference)
         if not payment:
             flash('Transaction not found.', 'error')
-            return redirect(url_for('buyer_dashboard'))
+            return redirect(url_for('main.buyer_dashboard'))
         
         # Security: Verify user owns this transaction
         if payment.buyer_id != session['user_id']:
             flash('Access denied.', 'error')
-            return redirect(url_for('buyer_dashboard'))
+            return redirect(url_for('main.buyer_dashboard'))
         
-        # Get associated listing and supplier info
-        listing_query = db.session.query(Listing, User).join(User, Listing.supplier_id == User.id)
-        listing_data = listing_query.filter(Listing.id == payment.listing_id).first()
+        # Get associated listing and supplier info (the listing may have been archived)
+        listing_data = find_listing_with_supplier(payment.listing_id)
         
         if not listing_data:
             flash('Associated listing not found.', 'error')
-            return redirect(url_for('buyer_dashboard'))
+            return redirect(url_for('main.buyer_dashboard'))
         
         listing, supplier = listing_data
         
@@ -452,9 +893,10 @@ def transaction_status(reference):
     except Exception as e:
         logging.error(f"Error displaying transaction status: {str(e)}")
         flash('Error loading transaction details.', 'error')
-        return redirect(url_for('buyer_dashboard'))
+        return redirect(url_for('main.buyer_dashboard'))
 
-@app.route('/api/transaction-status/<reference>')
+@bp.route('/api/transaction-status/<reference>')
+@replica_reads
 def api_transaction_status(reference):
     """
     API endpoint for polling transaction status
@@ -466,7 +908,7 @@ def api_transaction_status(reference):
             return jsonify({'error': 'Unauthorized'}), 401
         
         # Find the payment record
-        payment = Payment.query.filter_by(transaction_id=reference).first()
+        payment = _payment_by_reference(reference)
         if not payment:
             return jsonify({'error': 'Transaction not found'}), 404
         
@@ -483,7 +925,115 @@ def api_transaction_status(reference):
         logging.error(f"Error in transaction status API: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-@app.route('/paystack/webhook', methods=['POST'])
+# Server-Sent Events settings for the transaction status stream
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RECHECK_SECONDS = 20
+# Streams hold a worker thread; ending them this often lets EventSource reconnect
+# and frees the thread for other requests in between
+SSE_MAX_STREAM_SECONDS = 60
+
+def _sse_event(data):
+    """Format a Server-Sent Events message"""
+    return f"data: {json.dumps(data)}\n\n"
+
+@bp.route('/api/transaction-status/<reference>/stream')
+def api_transaction_status_stream(reference):
+    """
+    Server-Sent Events stream of transaction status changes
+    The webhook publishes status changes, so waiting clients get them at once
+    without polling. The database is re-checked only occasionally as a safety
+    net for updates published by another worker without a shared broker.
+    Open streams per process are capped (the "stream" group in ratelimit.py);
+    past the cap the client gets 503 and falls back to polling.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # Subscribe before reading the status so an update can't slip in between
+    subscription = get_broker().subscribe(payment_channel(reference))
+    
+    try:
+        payment = find_payment(reference)
+        if not payment:
+            subscription.close()
+            return jsonify({'error': 'Transaction not found'}), 404
+        
+        if payment.buyer_id != session['user_id']:
+            subscription.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        initial = {
+            'status': payment.status,
+            'updated_at': payment.updated_at.isoformat() if payment.updated_at else None
+        }
+    except Exception as e:
+        subscription.close()
+        logging.error(f"Error in transaction status stream: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        # Don't hold a pooled connection for the lifetime of the stream
+        db.session.remove()
+    
+    release = lambda: None
+    if initial['status'] == 'pending':
+        try:
+            release = hold('stream')
+        except OverCapacity:
+            subscription.close()
+            raise
+    
+    def generate():
+        with subscription:
+            yield _sse_event(initial)
+            if initial['status'] != 'pending':
+                return
+            
+            started = last_check = time.monotonic()
+            while time.monotonic() - started < SSE_MAX_STREAM_SECONDS:
+                message = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                
+                if message is None and time.monotonic() - last_check >= SSE_RECHECK_SECONDS:
+                    last_check = time.monotonic()
+                    payment = Payment.query.filter_by(transaction_id=reference).first()
+                    db.session.remove()
+                    if payment and payment.status != 'pending':
+                        message = {
+                            'status': payment.status,
+                            'updated_at': payment.updated_at.isoformat() if payment.updated_at else None
+                        }
+                
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                
+                yield _sse_event(message)
+                if message.get('status') != 'pending':
+                    return
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs once the server is done with the response, even if the stream never started
+    response.call_on_close(release)
+    return response
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics for this process
+    Security: off (404) unless METRICS_TOKEN is set, and then requires it as a bearer token
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    if not token:
+        return render_template('404.html'), 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied, f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/paystack/webhook', methods=['POST'])
 def paystack_webhook():
     """
     Handle Paystack webhook for payment verification
@@ -523,46 +1073,33 @@ def paystack_webhook():
             logging.error("Invalid JSON in webhook payload")
             return jsonify({'error': 'Invalid JSON'}), 400
         
-        # Handle successful payment
-        if event_data.get('event') == 'charge.success':
-            transaction_data = event_data.get('data', {})
-            reference = transaction_data.get('reference')
-            status = transaction_data.get('status')
-            
-            if status == 'success' and reference:
-                # Find the payment record
-                payment = Payment.query.filter_by(transaction_id=reference).first()
-                
-                if payment and payment.status == 'pending':
-                    # Update payment status
-                    payment.status = 'completed'
-                    
-                    # Mark listing as unavailable
-                    listing = Listing.query.get(payment.listing_id)
-                    if listing:
-                        listing.is_available = False
-                    
-                    db.session.commit()
-                    
-                    logging.info(f"Payment completed successfully: {reference}")
-                    return jsonify({'status': 'success'}), 200
-                else:
-                    logging.warning(f"Payment record not found or already processed: {reference}")
-                    return jsonify({'status': 'already_processed'}), 200
-        
-        # Handle failed payment
-        elif event_data.get('event') == 'charge.failed':
-            transaction_data = event_data.get('data', {})
-            reference = transaction_data.get('reference')
+        webhook_receipts.info(f"Webhook received: {event_data.get('event')} "
+                              f"{(event_data.get('data') or {}).get('reference')}")
+        
+        # Queue mode: store the event and let the webhook worker apply it
+        if current_app.config.get('WEBHOOK_MODE') == 'queue':
+            if enqueue_event(event_data, payload):
+                return jsonify({'status': 'queued'}), 200
+            return jsonify({'status': 'duplicate'}), 200
+        
+        # Inline mode: apply the event now
+        result, payment = apply_event(event_data)
+        
+        if result in ('success', 'failed'):
+            db.session.commit()
+            publish_payment_status(payment)
             
-            if reference:
-                # Find and update payment record
-                payment = Payment.query.filter_by(transaction_id=reference).first()
-                if payment and payment.status == 'pending':
-                    payment.status = 'failed'
-                    db.session.commit()
-                    
-                    logging.info(f"Payment failed: {reference}")
+            if result == 'success':
+                # The listing is now sold and must drop out of the feed
+                invalidate_listings()
+                logging.info(f"Payment completed successfully: {payment.transaction_id}")
+                return jsonify({'status': 'success'}), 200
+            logging.info(f"Payment failed: {payment.transaction_id}")
+        
+        elif result == 'already_processed' and event_data.get('event') == 'charge.success':
+            reference = (event_data.get('data') or {}).get('reference')
+            logging.warning(f"Payment record not found or already processed: {reference}")
+            return jsonify({'status': 'already_processed'}), 200
         
         return jsonify({'status': 'received'}), 200
         
@@ -0,0 +1,146 @@
+"""
+Supplier sales rollups for the farmer analytics page
+
+supplier_daily_sales keeps one row per supplier, day and currency with the
+checkouts started that day that have since settled: sold (completed),
+their revenue, and failed. Keying by the checkout's day (payments.created_at,
+UTC), which never changes, means a rebuild from history lands on the same
+rows as the incremental updates.
+
+complete_payment / fail_payment (webhook, webhook worker and
+reconcile-payments alike) add to the row in the same transaction as the
+status change, so the page reads a few precomputed rows instead of
+aggregating payments. `flask rebuild-sales` recomputes every supplier's
+rows from payments and payments_archive, a batch of suppliers per
+transaction, e.g. after a bulk correction or when first deployed.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import Date, case, cast, delete, func, insert, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import ArchivedPayment, Payment, SupplierDailySales, User
+
+BATCH_SIZE = 200
+PERIODS = (7, 30, 90, 365)
+DEFAULT_PERIOD = 30
+
+def record_settlement(payment, status):
+    """Add a payment that just became completed or failed to its supplier's row (caller commits)"""
+    table = SupplierDailySales.__table__
+    completed = status == 'completed'
+    values = {
+        'supplier_id': payment.supplier_id,
+        'day': (payment.created_at or datetime.utcnow()).date(),
+        'currency': payment.currency,
+        'sold': 1 if completed else 0,
+        'revenue': payment.amount if completed else 0,
+        'failed': 0 if completed else 1,
+    }
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        upsert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table).values(**values)
+        db.session.execute(upsert.on_conflict_do_update(
+            index_elements=['supplier_id', 'day', 'currency'],
+            set_={
+                'sold': table.c.sold + upsert.excluded.sold,
+                'revenue': table.c.revenue + upsert.excluded.revenue,
+                'failed': table.c.failed + upsert.excluded.failed,
+            }))
+        return
+
+    key = (table.c.supplier_id == values['supplier_id'], table.c.day == values['day'],
+           table.c.currency == values['currency'])
+    updated = db.session.execute(table.update().where(*key).values(
+        sold=table.c.sold + values['sold'], revenue=table.c.revenue + values['revenue'],
+        failed=table.c.failed + values['failed'])).rowcount
+    if not updated:
+        db.session.execute(table.insert().values(**values))
+
+def _day(column):
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column)
+    return cast(column, Date)
+
+def _rollup_select(supplier_ids):
+    """Rows of supplier_daily_sales for these suppliers, aggregated from payments and the archive"""
+    settled = union_all(*[
+        select(model.supplier_id, _day(model.created_at).label('day'), model.currency, model.status, model.amount)
+        .where(model.supplier_id.in_(supplier_ids), model.status.in_(('completed', 'failed')))
+        for model in (Payment, ArchivedPayment)
+    ]).subquery()
+    completed = settled.c.status == 'completed'
+    return select(
+        settled.c.supplier_id, settled.c.day, settled.c.currency,
+        func.sum(case((completed, 1), else_=0)),
+        func.coalesce(func.sum(case((completed, settled.c.amount), else_=0)), 0),
+        func.sum(case((completed, 0), else_=1)),
+    ).group_by(settled.c.supplier_id, settled.c.day, settled.c.currency)
+
+def _rebuild_suppliers(supplier_ids):
+    table = SupplierDailySales.__table__
+    if db.engine.dialect.name == 'postgresql':
+        # Settlements wait until this batch commits, then add to the rebuilt rows
+        db.session.execute(text("LOCK TABLE supplier_daily_sales IN SHARE ROW EXCLUSIVE MODE"))
+    db.session.execute(delete(table).where(table.c.supplier_id.in_(supplier_ids)))
+    return db.session.execute(insert(table).from_select(
+        ['supplier_id', 'day', 'currency', 'sold', 'revenue', 'failed'], _rollup_select(supplier_ids))).rowcount
+
+def rebuild(batch_size=BATCH_SIZE, echo=None):
+    """Recompute every supplier's rows from history; returns {'suppliers', 'rows'}"""
+    totals = {'suppliers': 0, 'rows': 0}
+    after = None
+    while True:
+        query = select(User.id)
+        if after is not None:
+            query = query.where(User.id > after)
+        supplier_ids = db.session.execute(query.order_by(User.id).limit(batch_size)).scalars().all()
+        if not supplier_ids:
+            break
+        after = supplier_ids[-1]
+        try:
+            rows = _rebuild_suppliers(supplier_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        totals['suppliers'] += len(supplier_ids)
+        totals['rows'] += rows
+        if echo:
+            echo(f"suppliers={totals['suppliers']} rows={totals['rows']}")
+    return totals
+
+def period(value):
+    """Days to show, from a query string value; one of PERIODS"""
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PERIOD
+    return days if days in PERIODS else DEFAULT_PERIOD
+
+def _conversion(sold, failed):
+    settled = sold + failed
+    return round(sold * 100.0 / settled, 1) if settled else None
+
+def supplier_summary(supplier_id, days=DEFAULT_PERIOD, today=None):
+    """
+    Totals per currency and daily rows, newest first, over the last `days` days
+    {'since', 'totals': [{currency, sold, revenue, failed, conversion}], 'days': [{day, currency, ...}]}
+    """
+    since = (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+    rows = SupplierDailySales.query.filter(
+        SupplierDailySales.supplier_id == supplier_id, SupplierDailySales.day >= since
+    ).order_by(SupplierDailySales.day.desc(), SupplierDailySales.currency).all()
+
+    totals = {}
+    daily = []
+    for row in rows:
+        total = totals.setdefault(row.currency, {'currency': row.currency, 'sold': 0, 'revenue': 0, 'failed': 0})
+        total['sold'] += row.sold
+        total['revenue'] += row.revenue
+        total['failed'] += row.failed
+        daily.append({'day': row.day, 'currency': row.currency, 'sold': row.sold, 'revenue': row.revenue,
+                      'failed': row.failed, 'conversion': _conversion(row.sold, row.failed)})
+    for total in totals.values():
+        total['conversion'] = _conversion(total['sold'], total['failed'])
+    return {'since': since, 'totals': sorted(totals.values(), key=lambda total: total['currency']), 'days': daily}
@@ -0,0 +1,168 @@
+import re
+import difflib
+import logging
+from sqlalchemy import text, or_, func, literal_column, table, column
+from app import db
+from models import Listing
+
+# Postgres: expression must match the index definition exactly so the planner uses it
+PG_TSVECTOR_SQL = "to_tsvector('simple', coalesce(listings.item_name, '') || ' ' || coalesce(listings.quantity, ''))"
+
+# How close a term must be to a vocabulary word to be treated as a typo on SQLite
+SQLITE_TYPO_CUTOFF = 0.75
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_table = table('listings_fts', column('rowid'), column('rank'))
+
+def tokenize(search_query):
+    """Split a raw search string into lowercase word tokens"""
+    return _WORD_RE.findall((search_query or '').lower())
+
+def ensure_search_index():
+    """Create the full-text search index for listings if it does not exist yet"""
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        _ensure_postgres_index()
+    elif dialect == 'sqlite':
+        _ensure_sqlite_index()
+    else:
+        logging.warning(f"No search index available for dialect {dialect}, falling back to ILIKE")
+
+def _ensure_postgres_index():
+    """tsvector GIN index for ranked/prefix search plus trigram index for typo tolerance"""
+    from migrations import drop_invalid_index
+
+    # Build without blocking writes to listings (CONCURRENTLY cannot run in a transaction)
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        drop_invalid_index(conn, 'ix_listings_search_tsv')
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_search_tsv ON listings USING gin ({PG_TSVECTOR_SQL})"
+        ))
+        drop_invalid_index(conn, 'ix_listings_item_name_trgm')
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_item_name_trgm "
+            "ON listings USING gin (item_name gin_trgm_ops)"
+        ))
+
+def _ensure_sqlite_index():
+    """External-content FTS5 table kept in sync with listings by triggers"""
+    with db.engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listings_fts'"
+        )).first()
+
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5("
+            "item_name, quantity, content='listings', content_rowid='rowid', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts_vocab USING fts5vocab(listings_fts, 'row')"
+        ))
+
+        # Triggers keep the index in sync with every write to listings
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS listings_fts_ai AFTER INSERT ON listings BEGIN "
+            "INSERT INTO listings_fts(rowid, item_name, quantity) "
+            "VALUES (new.rowid, new.item_name, new.quantity); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS listings_fts_ad AFTER DELETE ON listings BEGIN "
+            "INSERT INTO listings_fts(listings_fts, rowid, item_name, quantity) "
+            "VALUES ('delete', old.rowid, old.item_name, old.quantity); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS listings_fts_au AFTER UPDATE OF item_name, quantity ON listings BEGIN "
+            "INSERT INTO listings_fts(listings_fts, rowid, item_name, quantity) "
+            "VALUES ('delete', old.rowid, old.item_name, old.quantity); "
+            "INSERT INTO listings_fts(rowid, item_name, quantity) "
+            "VALUES (new.rowid, new.item_name, new.quantity); END"
+        ))
+
+        # Index rows that existed before the FTS table was created
+        if not exists:
+            conn.execute(text("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')"))
+
+def rebuild_search_index():
+    """Rebuild the search index from scratch (SQLite only, Postgres indexes are always current)"""
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')"))
+
+def apply_search(query, search_query):
+    """
+    Filter and rank a Listing query by a free-text search string
+    Supports prefix matching, relevance ranking and typo tolerance
+    """
+    terms = tokenize(search_query)
+    if not terms:
+        return query.filter(Listing.item_name.ilike(f'%{search_query}%'))
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return _apply_postgres_search(query, search_query, terms)
+    if dialect == 'sqlite':
+        return _apply_sqlite_search(query, terms)
+    return query.filter(Listing.item_name.ilike(f'%{search_query}%'))
+
+def _apply_postgres_search(query, search_query, terms):
+    """tsquery prefix match OR trigram similarity, ranked by both"""
+    tsvector = literal_column(PG_TSVECTOR_SQL)
+    tsquery = func.to_tsquery(literal_column("'simple'"), ' & '.join(f'{term}:*' for term in terms))
+    similarity = func.similarity(Listing.item_name, search_query)
+
+    return query.filter(
+        or_(tsvector.op('@@')(tsquery), Listing.item_name.op('%')(search_query))
+    ).order_by(
+        (func.ts_rank(tsvector, tsquery) + similarity).desc(),
+        Listing.created_at.desc()
+    )
+
+def _apply_sqlite_search(query, terms):
+    """FTS5 prefix match ranked by bm25, correcting typos against the index vocabulary"""
+    match = _fts_match_expression(terms)
+    if not _fts_has_match(match):
+        corrected = _correct_terms(terms)
+        if corrected != terms:
+            match = _fts_match_expression(corrected)
+
+    return query.join(
+        _fts_table, _fts_table.c.rowid == literal_column('listings.rowid')
+    ).filter(
+        text("listings_fts MATCH :fts_match").bindparams(fts_match=match)
+    ).order_by(
+        _fts_table.c.rank,
+        Listing.created_at.desc()
+    )
+
+def _fts_match_expression(terms):
+    """Build an FTS5 MATCH expression with every term quoted and prefix-matched"""
+    return ' AND '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+def _fts_has_match(match):
+    """Cheap existence check used to decide whether typo correction is needed"""
+    row = db.session.execute(
+        text("SELECT 1 FROM listings_fts WHERE listings_fts MATCH :fts_match LIMIT 1"),
+        {'fts_match': match}
+    ).first()
+    return row is not None
+
+def _correct_terms(terms):
+    """Replace each term that has no prefix match with its closest vocabulary word"""
+    corrected = []
+    for term in terms:
+        if _fts_has_match(_fts_match_expression([term])):
+            corrected.append(term)
+            continue
+
+        # Only compare against words sharing the first letter to keep the candidate set small
+        candidates = [row[0] for row in db.session.execute(
+            text("SELECT term FROM listings_fts_vocab WHERE term >= :lo AND term < :hi"),
+            {'lo': term[0], 'hi': term[0] + '\uffff'}
+        )]
+        matches = difflib.get_close_matches(term, candidates, n=1, cutoff=SQLITE_TYPO_CUTOFF)
+        corrected.append(matches[0] if matches else term)
+    return corrected
@@ -286,4 +286,12 @@ function handleSuccessMessage() {
 // Initialize success message handling
 document.addEventListener('DOMContentLoaded', handleSuccessMessage);
 
+// Keep the listings section open when paging through older listings
+document.addEventListener('DOMContentLoaded', function() {
+    const urlParams = new URLSearchParams(window.location.search);
+    if (urlParams.get('cursor')) {
+        showSection('current');
+    }
+});
+
 console.log('Food Bridge Dashboard JS loaded successfully');
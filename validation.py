@@ -0,0 +1,126 @@
+"""Listing field validation shared by create_listing and the bulk importer"""
+import math
+import re
+
+DEFAULT_CURRENCY = 'USD'
+# Currencies Paystack checkout accepts
+CURRENCIES = ('USD', 'EUR', 'CAD', 'GHS', 'NGN')
+# listings.price is NUMERIC(10, 2) and listings.quantity_amount NUMERIC(14, 3)
+MAX_PRICE = 99999999.99
+MAX_QUANTITY = 99999999999.999
+
+# Unit spellings -> (canonical unit, factor to the canonical unit); weights are stored in kg, volumes in litres
+UNIT_ALIASES = {
+    'kg': ('kg', 1), 'kgs': ('kg', 1), 'kilo': ('kg', 1), 'kilos': ('kg', 1),
+    'kilogram': ('kg', 1), 'kilograms': ('kg', 1),
+    'g': ('kg', 0.001), 'gram': ('kg', 0.001), 'grams': ('kg', 0.001),
+    't': ('kg', 1000), 'ton': ('kg', 1000), 'tons': ('kg', 1000), 'tonne': ('kg', 1000), 'tonnes': ('kg', 1000),
+    'lb': ('kg', 0.45359237), 'lbs': ('kg', 0.45359237), 'pound': ('kg', 0.45359237), 'pounds': ('kg', 0.45359237),
+    'l': ('l', 1), 'ltr': ('l', 1), 'litre': ('l', 1), 'litres': ('l', 1), 'liter': ('l', 1), 'liters': ('l', 1),
+    'ml': ('l', 0.001),
+    'bag': ('bag', 1), 'bags': ('bag', 1), 'sack': ('bag', 1), 'sacks': ('bag', 1),
+    'crate': ('crate', 1), 'crates': ('crate', 1),
+    'box': ('box', 1), 'boxes': ('box', 1),
+    'bunch': ('bunch', 1), 'bunches': ('bunch', 1),
+    'tray': ('tray', 1), 'trays': ('tray', 1),
+    'basket': ('basket', 1), 'baskets': ('basket', 1),
+    'piece': ('piece', 1), 'pieces': ('piece', 1), 'pcs': ('piece', 1), 'pc': ('piece', 1),
+    'dozen': ('piece', 12),
+}
+UNITS = sorted({unit for unit, _ in UNIT_ALIASES.values()})
+
+# The first number in the text (1,000 / 2.5 / 2,5) and the word after it; a range ("20-30 kg") keeps its lower bound
+_QUANTITY_RE = re.compile(r'(\d{1,3}(?:,\d{3})+(?![\d,])|\d+(?:[.,]\d+)?)(?:\s*(?:-|to)\s*[\d.,]+)?\s*([^\W\d_]+)?',
+                          re.UNICODE)
+
+_TRUE_VALUES = ('on', 'true', '1', 'yes', 'y')
+
+class ListingValidationError(ValueError):
+    """A listing's fields failed validation; the message is safe to show the user"""
+
+def parse_flag(value, default=False):
+    """Interpret a checkbox/CSV flag ('on', 'true', '1', 'yes') as a boolean"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in _TRUE_VALUES
+
+def parse_quantity(text):
+    """
+    Read the amount and unit out of a free-text quantity ("500 kg", "2.5 tonnes", "12 bags of maize")
+    Returns (amount in the canonical unit, canonical unit); (amount, None) for an unknown unit
+    and (None, None) when there is no number or it is too large to store
+    """
+    if text is not None and not isinstance(text, str):
+        text = str(text)
+    match = _QUANTITY_RE.search(text or '')
+    if not match:
+        return None, None
+
+    number, word = match.groups()
+    number = number.replace(',', '') if re.fullmatch(r'\d{1,3}(?:,\d{3})+', number) else number.replace(',', '.')
+    amount = float(number)
+
+    unit, factor = UNIT_ALIASES.get((word or '').lower(), (None, 1))
+    amount = round(amount * factor, 3)
+    if amount > MAX_QUANTITY:
+        return None, None
+    return amount, unit
+
+def _text_field(data, field):
+    """A text field as str; numbers (e.g. from JSON) become their text, anything else is rejected"""
+    value = data.get(field)
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ListingValidationError(f"{field.replace('_', ' ').capitalize()} must be text.")
+
+def parse_price(value):
+    """
+    A price from form, CSV or JSON input; None when blank
+    Raises ListingValidationError unless it is a finite number from 0 to MAX_PRICE
+    """
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, bool):
+            raise TypeError(value)
+        price = float(value)
+    except (TypeError, ValueError):
+        raise ListingValidationError('Price must be a number.')
+    if not math.isfinite(price):
+        raise ListingValidationError('Price must be a number.')
+    if price < 0:
+        raise ListingValidationError('Price cannot be negative.')
+    if price > MAX_PRICE:
+        raise ListingValidationError(f'Price cannot be more than {MAX_PRICE:,.2f}.')
+    return price
+
+def validate_listing(data, default_available=False):
+    """
+    Validate listing fields and return the column values for a new listing
+    Raises ListingValidationError with a user-facing message
+    """
+    item_name = _text_field(data, 'item_name')
+    quantity = _text_field(data, 'quantity')
+    contact = _text_field(data, 'contact')
+
+    if not all([item_name, quantity, contact]):
+        raise ListingValidationError('Please fill in all required fields.')
+
+    price = parse_price(data.get('price'))
+    currency = _text_field(data, 'currency')
+    quantity_amount, quantity_unit = parse_quantity(quantity)
+
+    return {
+        'item_name': item_name,
+        'quantity': quantity,
+        'quantity_amount': quantity_amount,
+        'quantity_unit': quantity_unit,
+        'price': price,
+        'currency': currency if currency else DEFAULT_CURRENCY,
+        'contact': contact,
+        'is_available': parse_flag(data.get('is_available'), default_available)
+    }
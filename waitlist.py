@@ -0,0 +1,371 @@
+"""
+Waiting list matching
+
+Buyers register wants (WaitingList rows). An in-memory inverted index maps
+normalized terms to wants, so when a listing becomes available only the
+wants posted under a term of its name are examined. A want matches when
+every one of its terms appears in the listing name.
+
+Matches are marked notified in the database and handed to a background
+dispatcher that sends them in batches through a pluggable sender.
+
+The index loads in keyset-ordered chunks on first use and afterwards only
+pulls wants from REFRESH_OVERLAP behind its watermark on, so it never
+rescans the whole table.
+If WAITLIST_INDEX_SNAPSHOT is set, the index is saved there and the next
+process starts from the snapshot plus the rows added since.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from app import db
+from models import WaitingList
+from search import tokenize
+
+LOAD_CHUNK_SIZE = 1000
+NOTIFY_BATCH_SIZE = 100
+NOTIFY_FLUSH_SECONDS = 2.0
+SNAPSHOT_EVERY_CHANGES = 1000
+# created_at is set before the want's transaction commits (and by each app
+# host's clock), so a want can become visible behind the watermark; refresh
+# re-reads this much before it
+REFRESH_OVERLAP = timedelta(minutes=2)
+
+def normalize_terms(text):
+    """Tokenize and lightly stem so 'Tomatoes' and 'tomato' share a term"""
+    terms = set()
+    for token in tokenize(text):
+        if len(token) < 2:
+            continue
+        if len(token) > 4 and token.endswith('oes'):
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        terms.add(token)
+    return terms
+
+class WaitlistIndex:
+    """
+    Inverted index of open wants
+    Each want is posted under a single key term (its rarest term at insert
+    time). Since a matching listing must contain every term of the want, it
+    must contain the key term too, so lookups only touch the postings of the
+    listing's own terms, and short postings keep that cheap.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(set)
+        self._terms = {}
+        self._keys = {}
+        self.watermark = None
+        self.changes = 0
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, want_id):
+        with self._lock:
+            return want_id in self._terms
+
+    def add(self, want_id, item_requested, terms=None):
+        terms = frozenset(terms if terms is not None else normalize_terms(item_requested))
+        if not terms:
+            return
+        with self._lock:
+            self.remove(want_id)
+            key = min(terms, key=lambda term: (len(self._postings.get(term, ())), term))
+            self._terms[want_id] = terms
+            self._keys[want_id] = key
+            self._postings[key].add(want_id)
+            self.changes += 1
+
+    def remove(self, want_id):
+        with self._lock:
+            key = self._keys.pop(want_id, None)
+            if key is None:
+                return
+            del self._terms[want_id]
+            postings = self._postings.get(key)
+            if postings is not None:
+                postings.discard(want_id)
+                if not postings:
+                    del self._postings[key]
+            self.changes += 1
+
+    def match(self, item_name):
+        """Ids of wants whose terms are all contained in item_name"""
+        listing_terms = normalize_terms(item_name)
+        matched = []
+        with self._lock:
+            for term in listing_terms:
+                for want_id in self._postings.get(term, ()):
+                    if self._terms[want_id] <= listing_terms:
+                        matched.append(want_id)
+        return matched
+
+    def advance(self, created_at, want_id):
+        with self._lock:
+            if self.watermark is None or (created_at, want_id) > self.watermark:
+                self.watermark = (created_at, want_id)
+
+    def to_snapshot(self):
+        with self._lock:
+            return {
+                'watermark': [self.watermark[0].isoformat(), self.watermark[1]] if self.watermark else None,
+                'wants': {want_id: sorted(terms) for want_id, terms in self._terms.items()}
+            }
+
+    @classmethod
+    def from_snapshot(cls, data):
+        index = cls()
+        for want_id, terms in data.get('wants', {}).items():
+            index.add(want_id, None, terms)
+        index.changes = 0
+        if data.get('watermark'):
+            created_at, want_id = data['watermark']
+            index.watermark = (datetime.fromisoformat(created_at), want_id)
+        return index
+
+class LogSender:
+    """Writes notifications to the application log (default, and for local testing)"""
+
+    def send_batch(self, notifications):
+        for notification in notifications:
+            logging.info(f"Waiting list match for {notification['contact']}: "
+                         f"{notification['item_requested']} -> {notification['item_name']}")
+
+class FileSender:
+    """Appends notifications as JSON lines to a file (for tests and local development)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send_batch(self, notifications):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as handle:
+            for notification in notifications:
+                handle.write(json.dumps(notification) + '\n')
+
+class NotificationDispatcher:
+    """Background thread that groups notifications into batches for the sender"""
+
+    def __init__(self, sender, batch_size=NOTIFY_BATCH_SIZE, flush_seconds=NOTIFY_FLUSH_SECONDS):
+        self.sender = sender
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='waitlist-notifier', daemon=True)
+        self._thread.start()
+
+    def submit(self, notifications):
+        for notification in notifications:
+            self._queue.put(notification)
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been sent"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = []
+            waiters = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+
+            if batch:
+                try:
+                    self.sender.send_batch(batch)
+                except Exception as e:
+                    logging.error(f"Error sending {len(batch)} waiting list notification(s): {str(e)}")
+            for waiter in waiters:
+                waiter.set()
+
+_index = None
+_dispatcher = None
+_sender = None
+_init_lock = threading.Lock()
+
+def default_sender():
+    path = os.environ.get('WAITLIST_NOTIFY_FILE')
+    return FileSender(path) if path else LogSender()
+
+def set_sender(sender):
+    """Use a custom sender (any object with send_batch(notifications))"""
+    global _sender, _dispatcher
+    with _init_lock:
+        _sender = sender
+        _dispatcher = None
+
+def get_dispatcher():
+    global _dispatcher, _sender
+    if _dispatcher is None:
+        with _init_lock:
+            if _dispatcher is None:
+                _sender = _sender or default_sender()
+                _dispatcher = NotificationDispatcher(_sender)
+    return _dispatcher
+
+def get_index():
+    """Return the process-wide index, loading it on first use"""
+    global _index
+    if _index is None:
+        with _init_lock:
+            if _index is None:
+                _index = _load_index()
+    return _index
+
+def _snapshot_path():
+    return os.environ.get('WAITLIST_INDEX_SNAPSHOT')
+
+def _load_index():
+    index = None
+    path = _snapshot_path()
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as handle:
+                index = WaitlistIndex.from_snapshot(json.load(handle))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable waiting list snapshot {path}: {str(e)}")
+
+    index = index or WaitlistIndex()
+    loaded = refresh(index)
+    logging.info(f"Waiting list index ready: {len(index)} open wants ({loaded} loaded from the database)")
+    return index
+
+def refresh(index):
+    """
+    Add open wants missing from the index, in keyset-ordered chunks, starting
+    REFRESH_OVERLAP before the watermark; wants already indexed are skipped
+    """
+    loaded = 0
+    since = index.watermark[0] - REFRESH_OVERLAP if index.watermark is not None else None
+    after = None
+    while True:
+        query = db.session.query(WaitingList.id, WaitingList.created_at, WaitingList.item_requested).filter(
+            WaitingList.is_notified == 'no')
+        if after is not None:
+            query = query.filter(tuple_(WaitingList.created_at, WaitingList.id) > tuple_(
+                *after, types=(WaitingList.created_at.type, WaitingList.id.type)))
+        elif since is not None:
+            query = query.filter(WaitingList.created_at >= since)
+        rows = query.order_by(WaitingList.created_at, WaitingList.id).limit(LOAD_CHUNK_SIZE).all()
+
+        for want_id, created_at, item_requested in rows:
+            if want_id not in index:
+                index.add(want_id, item_requested)
+                loaded += 1
+            index.advance(created_at, want_id)
+        if rows:
+            after = (rows[-1].created_at, rows[-1].id)
+
+        if len(rows) < LOAD_CHUNK_SIZE:
+            return loaded
+
+def save_snapshot(index=None):
+    """Persist the index so the next process only loads newer wants"""
+    path = _snapshot_path()
+    index = index or _index
+    if not path or index is None:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(index.to_snapshot(), handle)
+    os.replace(tmp_path, path)
+    index.changes = 0
+
+def register_want(want):
+    """Index a newly committed want"""
+    index = get_index()
+    index.add(want.id, want.item_requested)
+    _maybe_snapshot(index)
+
+def remove_want(want_id):
+    """Drop a want from the index (deleted or notified)"""
+    if _index is not None:
+        _index.remove(want_id)
+        _maybe_snapshot(_index)
+
+def _maybe_snapshot(index):
+    if _snapshot_path() and index.changes >= SNAPSHOT_EVERY_CHANGES:
+        try:
+            save_snapshot(index)
+        except OSError as e:
+            logging.warning(f"Could not save waiting list snapshot: {str(e)}")
+
+def notify_matches(listing):
+    """
+    Find open wants matching an available listing, mark them notified and
+    queue their notifications. Returns the number of wants matched.
+    """
+    return notify_matches_many([listing])
+
+def notify_matches_many(listings):
+    """
+    Batch version of notify_matches (e.g. for bulk imports): one refresh,
+    one candidate query and one commit for the whole batch. A want matched
+    by several listings is notified once, for the first of them.
+    """
+    listings = [listing for listing in listings if listing.is_available]
+    if not listings:
+        return 0
+
+    index = get_index()
+    # Pick up wants registered through other workers since the last refresh
+    refresh(index)
+
+    matched_listing = {}
+    for listing in listings:
+        for want_id in index.match(listing.item_name):
+            matched_listing.setdefault(want_id, listing)
+    if not matched_listing:
+        return 0
+
+    # The index may hold wants deleted or notified by another worker; the database decides
+    candidate_ids = list(matched_listing)
+    wants = []
+    for start in range(0, len(candidate_ids), LOAD_CHUNK_SIZE):
+        chunk = candidate_ids[start:start + LOAD_CHUNK_SIZE]
+        wants.extend(WaitingList.query.filter(WaitingList.id.in_(chunk), WaitingList.is_notified == 'no'))
+    for want in wants:
+        want.is_notified = 'yes'
+    db.session.commit()
+
+    for want_id in candidate_ids:
+        index.remove(want_id)
+    _maybe_snapshot(index)
+
+    notifications = []
+    for want in wants:
+        listing = matched_listing[want.id]
+        notifications.append({
+            'waiting_list_id': want.id,
+            'buyer_id': want.buyer_id,
+            'contact': want.contact,
+            'item_requested': want.item_requested,
+            'listing_id': listing.id,
+            'item_name': listing.item_name,
+            'quantity': listing.quantity,
+            'supplier_contact': listing.contact
+        })
+    get_dispatcher().submit(notifications)
+    return len(notifications)
@@ -0,0 +1,238 @@
+"""
+Paystack webhook processing
+
+Events are applied either inline by the webhook route (WEBHOOK_MODE=inline,
+the default) or queued: the route verifies the signature, stores the raw
+event in webhook_events (deduplicated by event key) and returns 200 at once,
+and a background worker applies pending events in batches with one
+transaction per batch.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from models import Listing, Payment, WebhookEvent
+from pubsub import publish_payment_status
+from cache import invalidate_listings
+from reservations import release
+from sales import record_settlement
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_POLL_INTERVAL = 1.0
+
+def _settle(payment, status):
+    """Move a payment from pending to status; False if another transaction settled it first (caller commits)"""
+    now = datetime.utcnow()
+    statement = update(Payment).where(
+        Payment.id == payment.id,
+        Payment.status == 'pending'
+    ).values(
+        status=status,
+        updated_at=now
+    ).execution_options(synchronize_session=False)
+    if db.session.execute(statement).rowcount != 1:
+        db.session.refresh(payment)
+        return False
+    set_committed_value(payment, 'status', status)
+    set_committed_value(payment, 'updated_at', now)
+    return True
+
+def complete_payment(payment):
+    """Mark a pending payment completed and its listing sold; False if it was already settled (caller commits)"""
+    if not _settle(payment, 'completed'):
+        return False
+    record_settlement(payment, 'completed')
+
+    # Mark listing as unavailable
+    listing = db.session.get(Listing, payment.listing_id)
+    if listing:
+        if listing.reservation_reference not in (None, payment.transaction_id):
+            logging.warning(f"Payment {payment.transaction_id} completed while listing {listing.id} "
+                            f"was held for {listing.reservation_reference}")
+        listing.is_available = False
+        listing.reserved_by = None
+        listing.reserved_until = None
+        listing.reservation_reference = None
+    return True
+
+def fail_payment(payment):
+    """Mark a pending payment failed and release its listing hold; False if it was already settled (caller commits)"""
+    if not _settle(payment, 'failed'):
+        return False
+    record_settlement(payment, 'failed')
+    release(payment.listing_id, payment.transaction_id)
+    return True
+
+def apply_event(event_data, payments=None):
+    """
+    Apply one parsed webhook event without committing
+    Returns (result, payment) where result is 'success', 'failed',
+    'already_processed' or 'ignored' and payment is the Payment changed, if any.
+    `payments` optionally maps reference -> Payment to avoid per-event lookups.
+    """
+    event_type = event_data.get('event')
+    transaction_data = event_data.get('data') or {}
+    reference = transaction_data.get('reference')
+
+    if event_type not in ('charge.success', 'charge.failed') or not reference:
+        return 'ignored', None
+    if event_type == 'charge.success' and transaction_data.get('status') != 'success':
+        return 'ignored', None
+
+    # Find the payment record
+    if payments is not None:
+        payment = payments.get(reference)
+    else:
+        payment = Payment.query.filter_by(transaction_id=reference).first()
+
+    if not payment or payment.status != 'pending':
+        return 'already_processed', None
+
+    # Settled by a concurrent delivery, the worker or reconcile-payments since it was loaded
+    if event_type == 'charge.success':
+        if not complete_payment(payment):
+            return 'already_processed', None
+        return 'success', payment
+
+    if not fail_payment(payment):
+        return 'already_processed', None
+    return 'failed', payment
+
+def event_key(event_data, payload):
+    """Deduplication key: Paystack's event type and data id, or a hash of the payload"""
+    data_id = (event_data.get('data') or {}).get('id')
+    if data_id is not None:
+        return f"{event_data.get('event')}:{data_id}"
+    return 'sha256:' + hashlib.sha256(payload).hexdigest()
+
+def enqueue_event(event_data, payload):
+    """Store a verified webhook event for the worker; returns False if it was a duplicate"""
+    values = {
+        'event_key': event_key(event_data, payload),
+        'event_type': event_data.get('event') or 'unknown',
+        'reference': (event_data.get('data') or {}).get('reference'),
+        'payload': payload.decode('utf-8'),
+        'status': 'pending',
+        'attempts': 0,
+        'received_at': datetime.utcnow()
+    }
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(WebhookEvent.__table__).values(**values)
+        result = db.session.execute(statement.on_conflict_do_nothing(index_elements=['event_key']))
+        db.session.commit()
+        return result.rowcount == 1
+
+    if WebhookEvent.query.filter_by(event_key=values['event_key']).first():
+        return False
+    db.session.add(WebhookEvent(**values))
+    db.session.commit()
+    return True
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply up to batch_size pending events in a single transaction
+    A failing event is rolled back to its savepoint and marked failed without
+    affecting the rest of the batch. Returns the number of events handled.
+    """
+    query = WebhookEvent.query.filter_by(status='pending').order_by(WebhookEvent.received_at).limit(batch_size)
+    if db.engine.dialect.name == 'postgresql':
+        # Lets several workers drain the queue without blocking each other
+        query = query.with_for_update(skip_locked=True)
+
+    events = query.all()
+    if not events:
+        db.session.rollback()
+        return 0
+
+    parsed = {}
+    for event in events:
+        try:
+            parsed[event.id] = json.loads(event.payload)
+        except ValueError as e:
+            parsed[event.id] = e
+
+    # Load every payment and listing the batch touches in two queries
+    references = {event.reference for event in events if event.reference}
+    payments = {}
+    if references:
+        payments = {payment.transaction_id: payment
+                    for payment in Payment.query.filter(Payment.transaction_id.in_(references))}
+        listing_ids = {payment.listing_id for payment in payments.values()}
+        if listing_ids:
+            Listing.query.filter(Listing.id.in_(listing_ids)).all()
+
+    changed = []
+    now = datetime.utcnow()
+    for event in events:
+        event.attempts += 1
+        try:
+            if isinstance(parsed[event.id], Exception):
+                raise parsed[event.id]
+            with db.session.begin_nested():
+                result, payment = apply_event(parsed[event.id], payments)
+            event.status = 'processed'
+            event.processed_at = now
+            event.last_error = None
+            if payment is not None:
+                changed.append(payment)
+                logging.info(f"Webhook {event.event_key} applied: {result} {event.reference}")
+        except Exception as e:
+            event.status = 'failed'
+            event.last_error = str(e)[:1000]
+            logging.error(f"Webhook {event.event_key} failed: {str(e)}")
+
+    db.session.commit()
+
+    # Sold listings must drop out of the cached feed
+    if any(payment.status == 'completed' for payment in changed):
+        invalidate_listings()
+
+    for payment in changed:
+        publish_payment_status(payment)
+
+    return len(events)
+
+def run_worker(batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL, once=False):
+    """Drain the queue, sleeping only when a batch comes back short"""
+    while True:
+        try:
+            handled = process_batch(batch_size)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Webhook worker error: {str(e)}")
+            handled = 0
+
+        if handled:
+            metrics = queue_metrics()
+            logging.info(f"Webhook batch of {handled}: {metrics['pending']} pending, lag {metrics['lag_seconds']:.1f}s")
+
+        if once and handled < batch_size:
+            return
+        if handled < batch_size:
+            time.sleep(poll_interval)
+
+def replay_failed(event_keys=None):
+    """Put failed events back on the queue (all of them, or only the given keys)"""
+    query = WebhookEvent.query.filter_by(status='failed')
+    if event_keys:
+        query = query.filter(WebhookEvent.event_key.in_(event_keys))
+    count = query.update({'status': 'pending', 'last_error': None}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+def queue_metrics():
+    """Queue depth, failed count and lag (age of the oldest pending event)"""
+    pending = WebhookEvent.query.filter_by(status='pending').count()
+    failed = WebhookEvent.query.filter_by(status='failed').count()
+    oldest = db.session.query(db.func.min(WebhookEvent.received_at)).filter(
+        WebhookEvent.status == 'pending').scalar()
+    lag = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    return {'pending': pending, 'failed': failed, 'lag_seconds': lag}